@@ -1,7 +1,10 @@
 import os
-from typing import Optional, List, Any
+import asyncio
+from typing import Optional, List, Any, Dict, Union
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from processors.operations import (
     handle_autofill,
@@ -12,152 +15,401 @@ from processors.operations import (
     handle_batchproc,
     handle_formula_pbe,
     handle_create_visual,
-    handle_formula_chk
+    handle_formula_chk,
+    context_manager,
+    lm,
 )
+from processors.executor import LLMExecutor
+from processors.cache import prediction_cache
+from processors.serializer import serializer_stats
+from processors.history import HistoryStore
+from processors.jobs import JobManager, JobQueueFull
+from processors.singleflight import SingleFlight, SharedRuns, request_key
+from processors.batching import CoalescingLM
+from processors.strategy import latency_tracker
+from processors.compression import GzipRequestMiddleware
+from processors.wire import decode_request, dumps, FastJSONResponse
 
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
-# Global variable to store conversation history
-conversation_history = []
+# Gzip replies above GZIP_MIN_SIZE bytes and accept gzip-encoded request bodies from remote clients
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+app.add_middleware(GzipRequestMiddleware, max_size=int(os.getenv("MAX_REQUEST_BYTES", str(256 * 1024 * 1024))))
+
+# Bounded pool for the blocking DSPy handlers, so /history and /health stay responsive
+llm_executor = LLMExecutor(max_workers=int(os.getenv("LLM_POOL_SIZE", "4")))
+
+# Concurrent identical requests (e.g. a double-clicked Execute) share one generation; shared_runs
+# does the same for the /stream routes and jobs, replaying progress to every subscriber
+single_flight = SingleFlight()
+shared_runs = SharedRuns()
+
+# Background jobs for long operations; finished jobs are kept for JOB_RETENTION seconds
+job_manager = JobManager(
+    max_workers=int(os.getenv("JOB_POOL_SIZE", "2")),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", "32")),
+    retention=float(os.getenv("JOB_RETENTION", "3600")),
+    flights=shared_runs,
+)
+
+# A grid is either a dense 2D list or a sparse/columnar encoding (see processors/wire.py)
+Grid = Union[List[List[Any]], Dict[str, Any]]
+
+# Bounded conversation history; large result grids are stored as placeholders
+history_store = HistoryStore(
+    max_entries=int(os.getenv("HISTORY_MAX_ENTRIES", "200")),
+    max_cells=int(os.getenv("HISTORY_MAX_CELLS", "500")),
+)
+
+# Leader tasks of shared runs, referenced until done so they are not garbage collected
+_shared_tasks = set()
+
+async def handler_events(op, handler, msg, request_summary, callback, to_event):
+    """Run `handler` on the LLM pool and yield the events its `callback` keyword argument reports.
+
+    Identical requests (and jobs) in flight share one run: a request joining late first gets the
+    events reported so far. `to_event` turns the callback's arguments into an event dict. The last
+    event is {"type": "done", "result"} (without any candidate grid) or {"type": "error", "message"}.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    session = msg.get("sessionId")
+
+    def report(*args):
+        loop.call_soon_threadsafe(queue.put_nowait, to_event(*args))
+
+    def finished():
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    key = request_key(op, msg)
+    run, token, leader = shared_runs.join(key, session, report, finished)
+    if leader:
+        task = asyncio.ensure_future(llm_executor.run(
+            shared_runs.execute, key, run, lambda publish: handler(msg, **{callback: publish})))
+        _shared_tasks.add(task)
+        task.add_done_callback(_shared_tasks.discard)
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+        if run.error is not None:
+            print(f"Exception in streamed {handler.__name__}: {run.error}")
+            event = {"type": "error", "message": str(run.error)}
+        else:
+            if not leader:
+                context_manager.copy(run.session, session)
+            history_store.append(request_summary, run.result)
+            event = {"type": "done", "result": {k: v for k, v in run.result.items() if k != "candidate"}}
+        yield event
+    finally:
+        # Also on disconnect: a run nobody listens to any more stops at its next progress report
+        run.unsubscribe(token)
+
+async def run_coalesced(op, handler, msg):
+    """Run `handler(msg)` on the LLM pool, sharing the call with identical requests already in flight.
+
+    Callers that reuse another session's generation also get its context, so /feedback works for them.
+    """
+    async def call():
+        return await llm_executor.run(handler, msg), msg.get("sessionId")
+
+    (result, leader_session), shared = await single_flight.run(request_key(op, msg), call)
+    if shared:
+        context_manager.copy(leader_session, msg.get("sessionId"))
+    return result
+
+def stream_cells(op, handler, msg, request_summary):
+    """NDJSON stream of a cell-producing handler.
+
+    Emits {"type": "start"}, then {"type": "rows", "offset", "rows"} blocks as the handler
+    produces them (offsets are relative to the target range), then the done or error event.
+    """
+    async def lines():
+        yield dumps({"type": "start"}) + b"\n"
+        async for event in handler_events(op, handler, msg, request_summary, "on_rows",
+                                          lambda offset, rows: {"type": "rows", "offset": offset, "rows": rows}):
+            yield dumps(event) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def stream_text(op, handler, msg, request_summary):
+    """Server-sent events for a text-producing handler: `text` events carry decoded answer text
+    as the LM generates it, then a `done` event with the final reply, or an `error` event."""
+    async def messages():
+        async for event in handler_events(op, handler, msg, request_summary, "on_text",
+                                          lambda text: {"type": "text", "text": text}):
+            data = {k: v for k, v in event.items() if k != "type"}
+            yield f"event: {event['type']}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+    return StreamingResponse(messages(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 class AutofillRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     outputRange: str
-    outputData: List[List[Any]]
+    outputData: Grid
     description: str
+    fillMode: Optional[str] = None
+    sessionId: Optional[str] = None
 
 @app.post("/autofill")
 async def autofill_route(request: AutofillRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received autofill request: {msg}")
     request_summary = f"Action: autofill\nInput Range: {msg['inputRange']}\nOutput Range: {msg['outputRange']}\nDescription: {msg['description']}"
-    result = handle_autofill(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Autofill processed", "result": result}
+    result = await run_coalesced("autofill", handle_autofill, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Autofill processed", "result": result})
+
+@app.post("/autofill/stream")
+async def autofill_stream_route(request: AutofillRequest):
+    msg = decode_request(request.dict())
+    request_summary = f"Action: autofill (stream)\nInput Range: {msg['inputRange']}\nOutput Range: {msg['outputRange']}\nDescription: {msg['description']}"
+    return stream_cells("autofill", handle_autofill, msg, request_summary)
 
 class FeedbackRequest(BaseModel):
     feedbackMsg: str
+    sessionId: Optional[str] = None
 
 @app.post("/feedback")
 async def feedback_route(request: FeedbackRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received feedback request: {msg}")
     request_summary = f"Action: feedback\nFeedback: {msg['feedbackMsg']}"
-    result = handle_feedback(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Feedback processed", "result": result}
+    result = await llm_executor.run(handle_feedback, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Feedback processed", "result": result})
 
 class RangeselRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     description: str
+    sessionId: Optional[str] = None
     
 @app.post("/rangesel")
 async def rangesel_route(request: RangeselRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received rangesel request: {msg}")
     request_summary = f"Action: rangesel\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
-    result = handle_rangesel(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Rangesel processed", "result": result}
+    result = await run_coalesced("rangesel", handle_rangesel, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Rangesel processed", "result": result})
 
 class SummaryRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     outputRange: Optional[str] = None
-    outputData: Optional[List[List[Any]]] = None
+    outputData: Optional[Grid] = None
     description: str
+    sessionId: Optional[str] = None
 
 @app.post("/summary")
 async def summary_route(request: SummaryRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received summary request: {msg}")
     request_summary = f"Action: summary\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
-    result = handle_summary(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Summary processed", "result": result}
+    result = await run_coalesced("summary", handle_summary, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Summary processed", "result": result})
+
+@app.post("/summary/stream")
+async def summary_stream_route(request: SummaryRequest):
+    msg = decode_request(request.dict())
+    request_summary = f"Action: summary (stream)\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
+    return stream_text("summary", handle_summary, msg, request_summary)
 
 class FormulaExpRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     outputRange: Optional[str] = None
-    outputData: Optional[List[List[Any]]] = None
+    outputData: Optional[Grid] = None
     description: str
+    sessionId: Optional[str] = None
 
 @app.post("/formula_exp")
 async def formula_exp_route(request: FormulaExpRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received formula explanation request: {msg}")
     request_summary = f"Action: formula_exp\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
-    result = handle_formula_exp(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Formula explanation processed", "result": result}
+    result = await run_coalesced("formula_exp", handle_formula_exp, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Formula explanation processed", "result": result})
+
+@app.post("/formula_exp/stream")
+async def formula_exp_stream_route(request: FormulaExpRequest):
+    msg = decode_request(request.dict())
+    request_summary = f"Action: formula_exp (stream)\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
+    return stream_text("formula_exp", handle_formula_exp, msg, request_summary)
 
 class BatchprocRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     description: str
+    sessionId: Optional[str] = None
 
 @app.post("/batchproc")
 async def batchproc_route(request: BatchprocRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received batch processing request: {msg}")
     request_summary = f"Action: batchproc\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
-    result = handle_batchproc(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Batch processing processed", "result": result}
+    result = await run_coalesced("batchproc", handle_batchproc, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Batch processing processed", "result": result})
+
+@app.post("/batchproc/stream")
+async def batchproc_stream_route(request: BatchprocRequest):
+    msg = decode_request(request.dict())
+    request_summary = f"Action: batchproc (stream)\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
+    return stream_cells("batchproc", handle_batchproc, msg, request_summary)
 
 class FormulaPBERequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     outputRange: str
-    outputData: List[List[Any]]
+    outputData: Grid
     description: str
+    fillMode: Optional[str] = None
+    sessionId: Optional[str] = None
 
 @app.post("/formula_pbe")
 async def formula_pbe_route(request: FormulaPBERequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received formula PBE request: {msg}")
     request_summary = f"Action: formula_pbe\nInput Range: {msg['inputRange']}\nOutput Range: {msg['outputRange']}\nDescription: {msg['description']}"
-    result = handle_formula_pbe(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Formula PBE processed", "result": result}
+    result = await run_coalesced("formula_pbe", handle_formula_pbe, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Formula PBE processed", "result": result})
+
+@app.post("/formula_pbe/stream")
+async def formula_pbe_stream_route(request: FormulaPBERequest):
+    msg = decode_request(request.dict())
+    request_summary = f"Action: formula_pbe (stream)\nInput Range: {msg['inputRange']}\nOutput Range: {msg['outputRange']}\nDescription: {msg['description']}"
+    return stream_cells("formula_pbe", handle_formula_pbe, msg, request_summary)
 
 class CreateVisualRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     outputRange: Optional[str] = None
-    outputData: Optional[List[List[Any]]] = None
+    outputData: Optional[Grid] = None
     description: str
+    sessionId: Optional[str] = None
 
 @app.post("/create_visual")
 async def create_visual_route(request: CreateVisualRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received create visual request: {msg}")
     request_summary = f"Action: create_visual\nInput Range: {msg['inputRange']}\nDescription: {msg['description']}"
-    result = handle_create_visual(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Create visual processed", "result": result}
+    result = await run_coalesced("create_visual", handle_create_visual, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Create visual processed", "result": result})
 
 class FormulaChkRequest(BaseModel):
     inputRange: str
-    inputData: List[List[Any]]
+    inputData: Grid
     outputRange: Optional[str] = None
-    outputData: Optional[List[List[Any]]] = None
+    outputData: Optional[Grid] = None
     description: str
+    sessionId: Optional[str] = None
 
 @app.post("/formula_chk")
 async def formula_chk_route(request: FormulaChkRequest):
-    msg = request.dict()
+    msg = decode_request(request.dict())
     print(f"Received formula check request: {msg}")
     request_summary = f"Action: formula_chk\nInput Range: {msg['inputRange']}\nOutput Range: {msg['outputRange']}\nDescription: {msg['description']}"
-    result = handle_formula_chk(msg)
-    conversation_history.append((request_summary, result))
-    return {"message": "Formula check processed", "result": result}
+    result = await run_coalesced("formula_chk", handle_formula_chk, msg)
+    history_store.append(request_summary, result)
+    return FastJSONResponse({"message": "Formula check processed", "result": result})
+
+# op -> (request model, handler, progress callback keyword)
+JOB_OPS = {
+    "autofill": (AutofillRequest, handle_autofill, "on_rows"),
+    "batchproc": (BatchprocRequest, handle_batchproc, "on_rows"),
+    "formula_pbe": (FormulaPBERequest, handle_formula_pbe, "on_rows"),
+    "summary": (SummaryRequest, handle_summary, "on_text"),
+    "formula_exp": (FormulaExpRequest, handle_formula_exp, "on_text"),
+    "rangesel": (RangeselRequest, handle_rangesel, None),
+    "create_visual": (CreateVisualRequest, handle_create_visual, None),
+    "formula_chk": (FormulaChkRequest, handle_formula_chk, None),
+    "feedback": (FeedbackRequest, handle_feedback, None),
+}
+
+@app.post("/jobs/{op}", status_code=202)
+async def submit_job_route(op: str, request: Request):
+    if op not in JOB_OPS:
+        raise HTTPException(status_code=404, detail=f"Unknown operation: {op}")
+    model, handler, callback = JOB_OPS[op]
+    try:
+        body = await request.json()
+        msg = decode_request(model(**body).dict())
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid {op} request: {e}")
+    # Rows of the grid the operation writes, for progress reporting
+    target = msg.get("outputData") if op in ("autofill", "formula_pbe") else msg.get("inputData")
+    total_rows = len(target) if callback == "on_rows" and isinstance(target, list) else 0
+    labels = {"inputRange": "Input Range", "outputRange": "Output Range", "description": "Description", "feedbackMsg": "Feedback"}
+    request_summary = f"Action: {op} (job)\n" + "\n".join(f"{label}: {msg[k]}" for k, label in labels.items() if msg.get(k))
+    try:
+        job = job_manager.submit(op, handler, msg, callback, total_rows,
+                                 on_done=lambda result: history_store.append(request_summary, result),
+                                 key=request_key(op, msg) if op != "feedback" else None,
+                                 on_shared=lambda leader: context_manager.copy(leader, msg.get("sessionId")))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return FastJSONResponse({"id": job.id, "op": op, "status": job.status}, status_code=202)
+
+@app.get("/jobs/{job_id}")
+async def job_status_route(job_id: str, partial: bool = False):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return FastJSONResponse(job.to_dict(partial=partial))
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job_route(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return FastJSONResponse(job.to_dict())
 
 @app.get("/history")
-async def history_route():
-    return {"history": conversation_history}
+async def history_route(request: Request, limit: Optional[int] = None, before: Optional[int] = None, since_id: Optional[int] = None):
+    etag = history_store.etag(limit, before, since_id)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    entries = history_store.query(limit=limit, before=before, since_id=since_id)
+    return FastJSONResponse({"history": entries, "last_id": history_store.last_id}, headers={"ETag": etag})
+
+@app.get("/health")
+async def health_route():
+    return {"status": "ok", "executor": llm_executor.stats()}
+
+@app.get("/metrics")
+async def metrics_route():
+    return {
+        "executor": llm_executor.stats(),
+        "cache": prediction_cache.stats() if prediction_cache else None,
+        "prompt_tokens": serializer_stats.stats(),
+        "history": history_store.stats(),
+        "sessions": context_manager.stats(),
+        "jobs": job_manager.stats(),
+        "coalescing": dict(single_flight.stats(), streams_and_jobs=shared_runs.stats()),
+        "lm_batching": lm.batcher.stats() if isinstance(lm, CoalescingLM) else None,
+        "strategies": latency_tracker.stats(),
+    }
+
+@app.delete("/cache")
+async def clear_cache_route():
+    if prediction_cache:
+        prediction_cache.clear()
+    return {"message": "Prediction cache cleared"}
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    llm_executor.shutdown()
+    job_manager.shutdown()
+    if isinstance(lm, CoalescingLM):
+        lm.batcher.shutdown()
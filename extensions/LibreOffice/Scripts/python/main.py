@@ -1,15 +1,406 @@
 import re
-import urllib.request
+import gzip
+import base64
+import socket
+import threading
+import http.client
 import json
+import time
 import traceback
+import uuid
+from contextlib import closing
 import uno
 import unohelper
 from com.sun.star.awt import Rectangle
-from com.sun.star.awt import XActionListener, XItemListener
+from com.sun.star.awt import XActionListener, XItemListener, XCallback
 from com.sun.star.awt.MessageBoxType import INFOBOX
 from com.sun.star.task import XJobExecutor
 from com.sun.star.lang import XServiceInfo
 
+API_HOST = "127.0.0.1"
+API_PORT = 8000
+REQUEST_TIMEOUT = 600 # Seconds to wait for the server before a request is abandoned
+PROGRESS_INTERVAL = 0.5 # Seconds between status bar updates while a request runs
+GZIP_MIN_BYTES = 16384 # Request bodies at least this large are sent gzip-compressed
+# How grids are sent: "dense" 2D lists, "sparse" coordinate lists, "columns" per-column arrays,
+# or "auto" (sparse when at least SPARSE_MIN_EMPTY of the cells are empty, dense otherwise)
+WIRE_FORMAT = "auto"
+SPARSE_MIN_EMPTY = 0.9
+# Cell-producing operations use their /stream endpoint and write each block of rows as it arrives
+STREAMING = True
+# formula_pbe only streams row by row with PBE_CANDIDATES=1 on the server; add it here in that case
+STREAM_OPS = ("autofill", "batchproc")
+# Text answers stream into the output window as they are generated
+STREAM_TEXT_OPS = ("summary", "formula_exp")
+
+# "bulk" reads a range with one getDataArray/getFormulaArray call per chunk; "cells" reads cell by cell
+READ_MODE = "bulk"
+READ_CHUNK_ROWS = 2000 # Rows fetched per bridge call in bulk mode
+# "bulk" writes each formula/value rectangle with one setFormulaArray/setDataArray call; "cells" writes cell by cell
+WRITE_MODE = "bulk"
+
+def encode_grid(data, fmt=WIRE_FORMAT):
+    """Encode a grid in the request formats understood by processors/wire.py on the server."""
+    rows = len(data)
+    cols = max((len(row) for row in data), default=0)
+    if fmt == "auto":
+        filled = sum(1 for row in data for v in row if v != "")
+        fmt = "sparse" if rows * cols and 1 - filled / (rows * cols) >= SPARSE_MIN_EMPTY else "dense"
+    if fmt == "sparse":
+        cells = [[r, c, v] for r, row in enumerate(data) for c, v in enumerate(row) if v != ""]
+        return {"format": "sparse", "rows": rows, "cols": cols, "cells": cells}
+    if fmt == "columns":
+        columns = []
+        for c in range(cols):
+            mask = bytearray((rows + 7) // 8)
+            values = []
+            for r, row in enumerate(data):
+                if c < len(row) and row[c] != "":
+                    mask[r >> 3] |= 1 << (r & 7)
+                    values.append(row[c])
+            columns.append({"mask": base64.b64encode(bytes(mask)).decode("ascii"), "values": values})
+        return {"format": "columns", "rows": rows, "cols": cols, "columns": columns}
+    return data
+
+def _is_standard_format(key):
+    # The General/Standard format of every locale sits at a multiple of 10000 in the formatter's key table
+    return key % 10000 == 0
+
+def _read_values(block):
+    """Display text of a block, as getString gives it, from one getDataArray call.
+
+    Strings are already display text. Numbers are whole numbers in General format rendered
+    directly; dates, percentages, currency, booleans, other number formats and non-integer values
+    fall back to getString so the model sees what the user sees.
+    """
+    rows = [list(row) for row in block.getDataArray()]
+    base = block.getRangeAddress()
+    for format_range in block.getCellFormatRanges():
+        address = format_range.getRangeAddress()
+        standard = _is_standard_format(format_range.NumberFormat)
+        for r in range(address.StartRow - base.StartRow, address.EndRow - base.StartRow + 1):
+            row = rows[r]
+            for c in range(address.StartColumn - base.StartColumn, address.EndColumn - base.StartColumn + 1):
+                value = row[c]
+                if not isinstance(value, float):
+                    continue
+                if standard and value.is_integer() and abs(value) < 1e15:
+                    row[c] = str(int(value))
+                else:
+                    row[c] = block.getCellByPosition(c, r).getString()
+    return rows
+
+def read_range(sheet, address, formulas=False, chunk_rows=READ_CHUNK_ROWS):
+    data = []
+    for start in range(address.StartRow, address.EndRow + 1, chunk_rows):
+        end = min(start + chunk_rows - 1, address.EndRow)
+        block = sheet.getCellRangeByPosition(address.StartColumn, start, address.EndColumn, end)
+        if formulas:
+            data.extend(list(row) for row in block.getFormulaArray())
+        else:
+            data.extend(_read_values(block))
+    return data
+
+def _is_formula(value):
+    # Heuristic to check if it's a formula: starts with '='
+    return isinstance(value, str) and value.startswith('=')
+
+def write_blocks(data):
+    """Split a (possibly ragged) grid into rectangles of only formulas or only values.
+
+    Returns (row, col, is_formula, rows) tuples; runs with the same columns and kind on
+    consecutive rows are merged, so a column of formulas becomes one block.
+    """
+    blocks = []
+    open_blocks = {}
+    for r, row in enumerate(data):
+        runs = []
+        for c, value in enumerate(row):
+            kind = _is_formula(value)
+            if runs and runs[-1][2] == kind:
+                runs[-1][1] = c
+            else:
+                runs.append([c, c, kind])
+        still_open = {}
+        for start, end, kind in runs:
+            values = list(row[start:end + 1])
+            block = open_blocks.get((start, end, kind))
+            if block and block[0] + len(block[3]) == r:
+                block[3].append(values)
+            else:
+                block = [r, start, kind, [values]]
+                blocks.append(block)
+            still_open[(start, end, kind)] = block
+        open_blocks = still_open
+    return [tuple(b) for b in blocks]
+
+class GridWrite:
+    """One undo step with repaint and automatic recalculation suspended, across any number of writes.
+
+    `close()` restores the document and recalculates once; it is safe to call more than once.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.undo_manager = model.getUndoManager()
+        self.auto_calc = model.isAutomaticCalculationEnabled()
+        self.undo_manager.enterUndoContext("OS3M Sheet")
+        model.lockControllers()
+        model.addActionLock()
+        self.open = True
+        if self.auto_calc:
+            model.enableAutomaticCalculation(False)
+
+    def write(self, sheet, start_col, start_row, data):
+        """Write a candidate grid with its top-left cell at (start_col, start_row); returns the number of write calls."""
+        blocks = write_blocks(data)
+        for r, c, is_formula, rows in blocks:
+            block = sheet.getCellRangeByPosition(start_col + c, start_row + r, start_col + c + len(rows[0]) - 1, start_row + r + len(rows) - 1)
+            if is_formula:
+                block.setFormulaArray(tuple(tuple(row) for row in rows))
+            else:
+                block.setDataArray(tuple(tuple(str(v) for v in row) for row in rows))
+        return len(blocks)
+
+    def close(self):
+        if not self.open:
+            return
+        self.open = False
+        try:
+            if self.auto_calc:
+                self.model.enableAutomaticCalculation(True)
+                self.model.calculate()
+        finally:
+            self.model.removeActionLock()
+            self.model.unlockControllers()
+            self.undo_manager.leaveUndoContext()
+
+def write_range(model, sheet, start_col, start_row, data):
+    """Write a candidate grid in one undo step, with repaint and automatic recalculation suspended."""
+    grid_write = GridWrite(model)
+    try:
+        return grid_write.write(sheet, start_col, start_row, data)
+    finally:
+        grid_write.close()
+
+COLOR_MAP = {'green': 0x00FF00, 'yellow': 0xFFFF00, 'red': 0xFF0000, 'white': 0xFFFFFF}
+
+def color_range(model, sheet, address, blocks):
+    """Apply {color: [[row, col, height, width], ...]} blocks, one SheetCellRanges per color."""
+    model.lockControllers()
+    try:
+        for color_name, rects in blocks.items():
+            ranges = model.createInstance("com.sun.star.sheet.SheetCellRanges")
+            addresses = []
+            for row, col, height, width in rects:
+                rect = uno.createUnoStruct("com.sun.star.table.CellRangeAddress")
+                rect.Sheet = address.Sheet
+                rect.StartColumn = address.StartColumn + col
+                rect.StartRow = address.StartRow + row
+                rect.EndColumn = rect.StartColumn + width - 1
+                rect.EndRow = rect.StartRow + height - 1
+                addresses.append(rect)
+            ranges.addRangeAddresses(tuple(addresses), False)
+            ranges.CellBackColor = COLOR_MAP.get(color_name, 0xFFFFFF)
+    finally:
+        model.unlockControllers()
+
+def write_range_by_cell(sheet, start_col, start_row, data):
+    for r_idx, row_list in enumerate(data):
+        for c_idx, cell_val in enumerate(row_list):
+            cell = sheet.getCellByPosition(start_col + c_idx, start_row + r_idx)
+            if _is_formula(cell_val):
+                cell.setFormula(cell_val)
+            else:
+                cell.setString(str(cell_val))
+
+def read_range_by_cell(sheet, address, formulas=False):
+    data = []
+    for r in range(address.StartRow, address.EndRow + 1):
+        row_data = []
+        for c in range(address.StartColumn, address.EndColumn + 1):
+            cell = sheet.getCellByPosition(c, r)
+            row_data.append(cell.getFormula() if formulas else cell.getString())
+        data.append(row_data)
+    return data
+
+class ApiClient:
+    """One keep-alive connection to the server, shared by a dialog's requests.
+
+    Large request bodies are gzip-compressed and gzip replies are inflated. A request on a
+    connection the server has since closed is retried once on a fresh one.
+    """
+
+    def __init__(self, host=API_HOST, port=API_PORT):
+        self.connection = http.client.HTTPConnection(host, port, timeout=REQUEST_TIMEOUT)
+        self.lock = threading.Lock()
+        self.aborted = False
+
+    def _open(self, method, path, payload, headers, timeout):
+        # Caller holds self.lock; returns the response with its body still unread
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+            if len(body) >= GZIP_MIN_BYTES:
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+        self.aborted = False
+        for attempt in range(2):
+            reused = self.connection.sock is not None
+            self.connection.timeout = timeout
+            if reused:
+                self.connection.sock.settimeout(timeout)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                return self.connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.connection.close()
+                if not reused or attempt or self.aborted:
+                    raise
+            except Exception:
+                self.connection.close()
+                raise
+
+    def request(self, method, path, payload=None, headers=None, timeout=REQUEST_TIMEOUT):
+        headers = dict(headers or {}, **{"Accept-Encoding": "gzip"})
+        with self.lock:
+            response = self._open(method, path, payload, headers, timeout)
+            try:
+                data = response.read()
+            except Exception:
+                self.connection.close()
+                raise
+            if response.will_close:
+                self.connection.close()
+        if response.getheader("Content-Encoding", "").lower() == "gzip":
+            data = gzip.decompress(data)
+        return response.status, response, data
+
+    def stream(self, path, payload, accept="application/x-ndjson", timeout=REQUEST_TIMEOUT):
+        """POST and yield the reply's lines as they arrive."""
+        # Uncompressed, so each line is readable as soon as the server sends it
+        headers = {"Accept-Encoding": "identity", "Accept": accept}
+        with self.lock:
+            response = self._open("POST", path, payload, headers, timeout)
+            finished = False
+            try:
+                if response.status >= 400:
+                    raise RuntimeError(f"HTTP {response.status}: {response.read()[:200].decode('utf-8', 'replace')}")
+                for line in response:
+                    yield line.decode("utf-8").rstrip("\r\n")
+                finished = True
+            finally:
+                if not finished or response.will_close:
+                    self.connection.close()
+
+    def abort(self):
+        # Unblocks a thread waiting on the reply; the next request reconnects
+        self.aborted = True
+        sock = self.connection.sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.connection.close()
+
+class ApiRequest:
+    """One POST to the server, run off the UI thread.
+
+    `cancel()` shuts the connection down, so a worker blocked on the reply returns at once.
+    """
+
+    def __init__(self, client, endpoint, request_data, timeout=REQUEST_TIMEOUT):
+        self.client = client
+        self.endpoint = endpoint
+        self.request_data = request_data
+        self.timeout = timeout
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            status, _, payload = self.client.request("POST", f"/{self.endpoint}", self.request_data, timeout=self.timeout)
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}: {payload[:200].decode('utf-8', 'replace')}")
+            self.result = json.loads(payload.decode("utf-8"))
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            self.done.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.client.abort()
+
+def ndjson_events(lines):
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+def sse_events(lines):
+    """Parse server-sent events into {"type": <event>, **data} dicts."""
+    kind, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield dict(json.loads("\n".join(data)), type=kind)
+            kind, data = "message", []
+        elif line.startswith("event:"):
+            kind = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+class StreamRequest(ApiRequest):
+    """ApiRequest for a /<op>/stream endpoint; `on_event(event)` is called from the worker per event."""
+
+    def __init__(self, client, endpoint, request_data, on_event, sse=False, timeout=REQUEST_TIMEOUT):
+        super().__init__(client, endpoint, request_data, timeout)
+        self.on_event = on_event
+        self.sse = sse
+
+    def run(self):
+        try:
+            accept = "text/event-stream" if self.sse else "application/x-ndjson"
+            # The generator holds the client lock while suspended; close it on every exit so a
+            # stored exception's traceback cannot keep it alive (and the lock held) until GC
+            with closing(self.client.stream(f"/{self.endpoint}/stream", self.request_data, accept=accept, timeout=self.timeout)) as lines:
+                for event in (sse_events(lines) if self.sse else ndjson_events(lines)):
+                    if self.cancelled:
+                        break
+                    if event.get("type") == "error":
+                        raise RuntimeError(event.get("message", "stream failed"))
+                    if event.get("type") == "done":
+                        self.result = {"result": event.get("result", {})}
+                    self.on_event(event)
+            if self.result is None and not self.cancelled:
+                raise RuntimeError("stream ended before the operation completed")
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            self.done.set()
+
+class MainThreadCallback(unohelper.Base, XCallback):
+    # Used with com.sun.star.awt.AsyncCallback to run `fn` on the UNO main thread
+    def __init__(self, fn):
+        self.fn = fn
+
+    def notify(self, data):
+        try:
+            self.fn()
+        except Exception:
+            print(traceback.format_exc())
+
 class ActionComboListener(unohelper.Base, XItemListener):
     def __init__(self, controller):
         self.controller = controller
@@ -30,6 +421,30 @@ class CloseButtonListener(unohelper.Base, XActionListener):
     def disposing(self, event):
         pass
 
+class CloseWindowListener(unohelper.Base, XActionListener):
+    # Closes a non-modal window; `on_close` runs first
+    def __init__(self, dialog, on_close=None):
+        self.dialog = dialog
+        self.on_close = on_close
+
+    def actionPerformed(self, event):
+        if self.on_close:
+            self.on_close()
+        self.dialog.dispose()
+
+    def disposing(self, event):
+        pass
+
+class CancelButtonListener(unohelper.Base, XActionListener):
+    def __init__(self, controller):
+        self.controller = controller
+
+    def actionPerformed(self, event):
+        self.controller.cancel_request()
+
+    def disposing(self, event):
+        pass
+
 class ExecuteButtonListener(unohelper.Base, XActionListener):
     def __init__(self, controller):
         self.controller = controller
@@ -55,6 +470,17 @@ class Os3mSheetController:
             if hasattr(self.model.CurrentController, "Frame") and self.model.CurrentController.Frame:
                 self.window = self.model.CurrentController.Frame.ContainerWindow
         self.dialog = None
+        self.history_last_id = 0
+        self.history_etag = None
+        self.history_text = ""
+        # Identifies this dialog's work so feedback applies to its own last operation
+        self.session_id = uuid.uuid4().hex
+        self.pending = None
+        # Open while a stream writes rows, so the whole stream is one undo step and one recalculation
+        self.stream_write = None
+        self.status_indicator = None
+        self.async_callback = self.smgr.createInstanceWithContext("com.sun.star.awt.AsyncCallback", ctx)
+        self.api = ApiClient()
 
     def run(self):
         if not self.sheet:
@@ -251,7 +677,7 @@ class Os3mSheetController:
         # --- Buttons ---
         button_width = 80
         button_spacing = 10
-        total_buttons_width = (button_width * 2) + button_spacing # For two buttons
+        total_buttons_width = (button_width * 3) + (button_spacing * 2) # For three buttons
         start_x = (dialog_model.Width - total_buttons_width) / 2
         
         # Execute button
@@ -265,9 +691,20 @@ class Os3mSheetController:
         execute_button_model.DefaultButton = True
         dialog_model.insertByName("ExecuteButton", execute_button_model)
 
+        # Cancel button, enabled while a request is running
+        cancel_button_model = dialog_model.createInstance("com.sun.star.awt.UnoControlButtonModel")
+        cancel_button_model.PositionX = start_x + button_width + button_spacing
+        cancel_button_model.PositionY = y_pos
+        cancel_button_model.Width = button_width
+        cancel_button_model.Height = 25
+        cancel_button_model.Name = "CancelButton"
+        cancel_button_model.Label = "Cancel"
+        cancel_button_model.Enabled = False
+        dialog_model.insertByName("CancelButton", cancel_button_model)
+
         # Close button at the bottom
         close_button_model = dialog_model.createInstance("com.sun.star.awt.UnoControlButtonModel")
-        close_button_model.PositionX = start_x + button_width + button_spacing
+        close_button_model.PositionX = start_x + (button_width + button_spacing) * 2
         close_button_model.PositionY = y_pos
         close_button_model.Width = button_width
         close_button_model.Height = 25
@@ -299,9 +736,15 @@ class Os3mSheetController:
         execute_button = self.dialog.getControl("ExecuteButton")
         execute_button.addActionListener(ExecuteButtonListener(self))
 
+        # Attach listener to Cancel button
+        self.dialog.getControl("CancelButton").addActionListener(CancelButtonListener(self))
+
         # Show dialog
         self.dialog.execute()
+        self.cancel_request()
+        self.api.close()
         self.dialog.dispose()
+        self.dialog = None
 
     def toggle_visibility(self, action):
         action_descriptions = {
@@ -342,6 +785,7 @@ class Os3mSheetController:
         button_y_pos = self.dialog.getControl("HistoryTextArea").getPosSize().Y + self.dialog.getControl("HistoryTextArea").getPosSize().Height + 15
         
         self.dialog.getControl("ExecuteButton").setPosSize(self.dialog.getControl("ExecuteButton").getPosSize().X, button_y_pos, 0, 0, 1) # 1 = PosSize.Y
+        self.dialog.getControl("CancelButton").setPosSize(self.dialog.getControl("CancelButton").getPosSize().X, button_y_pos, 0, 0, 1) # 1 = PosSize.Y
         self.dialog.getControl("CloseButton").setPosSize(self.dialog.getControl("CloseButton").getPosSize().X, button_y_pos, 0, 0, 1) # 1 = PosSize.Y
         
         # The new height is the button's Y position plus its height and a margin
@@ -350,28 +794,40 @@ class Os3mSheetController:
         self.dialog.setPosSize(self.dialog.getPosSize().X, self.dialog.getPosSize().Y, self.dialog.getPosSize().Width, final_height, 15) # 15 = SizeFlags.HEIGHT
 
     def update_history_display(self, force_refresh=False):
+        # Only fetch entries newer than the last one shown; the server answers 304 when nothing changed
         try:
-            url = "http://127.0.0.1:8000/history"
-            req = urllib.request.Request(url, headers={"Accept": "application/json"})
-            with urllib.request.urlopen(req) as response:
-                response_data = json.loads(response.read().decode("utf-8"))
-            
+            headers = {"Accept": "application/json"}
+            if self.history_etag:
+                headers["If-None-Match"] = self.history_etag
+            status, response, payload = self.api.request("GET", f"/history?since_id={self.history_last_id}", headers=headers, timeout=10)
+            if status == 304:
+                return
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}")
+            self.history_etag = response.getheader("ETag")
+            response_data = json.loads(payload.decode("utf-8"))
+
             history = response_data.get("history", [])
-            history_text = ""
-            if not history:
-                history_text = "No conversation history yet."
-            else:
-                for i, (request_str, response_obj) in enumerate(history):
-                    response_str = json.dumps(response_obj, indent=2)
-                    history_text += f"--- Interaction {i+1} ---\nUSER:\n{request_str}\n\nLLM:\n{response_str}\n\n"
-            
-            self.dialog.getControl("HistoryTextArea").setText(history_text)
+            last_id = response_data.get("last_id", self.history_last_id)
+            if last_id < self.history_last_id:
+                # Server restarted; start over
+                self.history_last_id = 0
+                self.history_text = ""
+                self.history_etag = None
+                return self.update_history_display()
+
+            for entry in history:
+                response_str = json.dumps(entry.get("result"), indent=2)
+                self.history_text += f"--- Interaction {entry.get('id')} ---\nUSER:\n{entry.get('request')}\n\nLLM:\n{response_str}\n\n"
+            self.history_last_id = last_id
+
+            self.dialog.getControl("HistoryTextArea").setText(self.history_text or "No conversation history yet.")
         except Exception as e:
             error_text = f"Failed to fetch conversation history: {e}"
             self.dialog.getControl("HistoryTextArea").setText(error_text)
             print(error_text)
 
-    def show_output_dialog(self, result):
+    def build_output_dialog(self, result):
         dialog_model = self.smgr.createInstanceWithContext("com.sun.star.awt.UnoControlDialogModel", self.ctx)
         dialog_model.PositionX = 100
         dialog_model.PositionY = 100
@@ -405,6 +861,10 @@ class Os3mSheetController:
         toolkit = self.smgr.createInstanceWithContext("com.sun.star.awt.Toolkit", self.ctx)
         dialog.createPeer(toolkit, None)
 
+        return dialog
+
+    def show_output_dialog(self, result):
+        dialog = self.build_output_dialog(result)
         close_button = dialog.getControl("CloseButton")
         close_listener = CloseButtonListener(dialog)
         close_button.addActionListener(close_listener)
@@ -412,6 +872,33 @@ class Os3mSheetController:
         dialog.execute()
         dialog.dispose()
 
+    def stream_text_async(self, op_type, request_data):
+        """Stream a text answer into a non-modal output window as it is generated."""
+        dialog = self.build_output_dialog("")
+        text_area = dialog.getControl("OutputTextArea")
+        shown = {"length": 0, "open": True}
+
+        def close():
+            shown["open"] = False
+        dialog.getControl("CloseButton").addActionListener(CloseWindowListener(dialog, close))
+        dialog.setVisible(True)
+
+        def show_event(event):
+            # Main thread; append the new text at the end of the window
+            if request is not self.pending or not shown["open"] or event.get("type") != "text":
+                return
+            end = uno.createUnoStruct("com.sun.star.awt.Selection", shown["length"], shown["length"])
+            text_area.insertText(end, event["text"])
+            shown["length"] += len(event["text"])
+
+        def finish(result):
+            self.update_history_display(force_refresh=True)
+            if shown["open"]:
+                text_area.setText(result.get("result", {}).get("reply") or text_area.getText() or "No reply received.")
+
+        request = StreamRequest(self.api, op_type, request_data, lambda event: self.run_on_main_thread(lambda: show_event(event)), sse=True)
+        self.call_api_async(op_type, request_data, finish, request=request)
+
     def create_chart(self, sheet, chart_range_address_str, title, chart_type_str):
         try:
             # Define the chart position and size
@@ -471,21 +958,67 @@ class Os3mSheetController:
         except Exception as e:
             self.show_message("Chart Error", f"Failed to create chart: {e}\nType: {type(e)}\nArgs: {e.args}")
 
-    def call_api(self, endpoint, request_data):
-        url = f"http://127.0.0.1:8000/{endpoint}"
-        try:
-            data = json.dumps(request_data).encode("utf-8")
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={"Content-Type": "application/json"}
-            )
-            with urllib.request.urlopen(req) as response:
-                response_data = json.loads(response.read().decode("utf-8"))
-            return response_data
-        except Exception as e:
-            self.show_message("API Error", f"Could not call API endpoint {endpoint}: {e}")
-            return None
+    def run_on_main_thread(self, fn):
+        self.async_callback.addCallback(MainThreadCallback(fn), None)
+
+    def call_api_async(self, endpoint, request_data, on_done, request=None):
+        """POST on a worker thread and call `on_done(result)` on the main thread when it succeeds."""
+        if self.pending:
+            self.show_message("Busy", f"A {self.pending.endpoint} request is still running.")
+            return
+        request = request or ApiRequest(self.api, endpoint, request_data)
+        self.pending = request
+        self.set_busy(True, endpoint)
+
+        def work():
+            request.run()
+            self.run_on_main_thread(lambda: self.finish_request(request, on_done))
+
+        def tick():
+            while not request.done.wait(PROGRESS_INTERVAL):
+                self.run_on_main_thread(lambda: self.update_progress(request))
+
+        threading.Thread(target=work, daemon=True).start()
+        threading.Thread(target=tick, daemon=True).start()
+
+    def update_progress(self, request):
+        if request is not self.pending or not self.status_indicator:
+            return
+        elapsed = time.time() - request.started
+        self.status_indicator.setText(f"OS3M Sheet: {request.endpoint} ({elapsed:.0f}s)")
+        self.status_indicator.setValue(min(99, int(elapsed / request.timeout * 100)))
+
+    def finish_request(self, request, on_done):
+        if request is not self.pending:
+            return # Cancelled, or the dialog was closed
+        self.pending = None
+        self.end_stream_write()
+        self.set_busy(False)
+        if request.error:
+            self.show_message("API Error", f"Could not call API endpoint {request.endpoint}: {request.error}")
+            return
+        on_done(request.result)
+
+    def cancel_request(self):
+        request = self.pending
+        if not request:
+            return
+        self.pending = None
+        request.cancel()
+        self.end_stream_write()
+        self.set_busy(False)
+        print(f"Cancelled {request.endpoint} request after {time.time() - request.started:.1f}s")
+
+    def set_busy(self, busy, endpoint=""):
+        if self.dialog:
+            self.dialog.getControl("ExecuteButton").setEnable(not busy)
+            self.dialog.getControl("CancelButton").setEnable(busy)
+        if busy and self.model.CurrentController.Frame:
+            self.status_indicator = self.model.CurrentController.Frame.createStatusIndicator()
+            self.status_indicator.start(f"OS3M Sheet: {endpoint}", 100)
+        elif not busy and self.status_indicator:
+            self.status_indicator.end()
+            self.status_indicator = None
 
     def show_message(self, title, message):
         toolkit = self.smgr.createInstanceWithContext("com.sun.star.awt.Toolkit", self.ctx)
@@ -517,17 +1050,16 @@ class Os3mSheetController:
 
                 cell_range = current_sheet.getCellRangeByName(cell_range_str)
                 range_address = cell_range.getRangeAddress()
-                
-                data = []
-                for r in range(range_address.StartRow, range_address.EndRow + 1):
-                    row_data = []
-                    for c in range(range_address.StartColumn, range_address.EndColumn + 1):
-                        cell = current_sheet.getCellByPosition(c, r)
-                        if op_type in ["formula_exp", "formula_chk", "formula_pbe"]:
-                            row_data.append(cell.getFormula())
-                        else:
-                            row_data.append(cell.getString())
-                    data.append(row_data)
+                formulas = op_type in ["formula_exp", "formula_chk", "formula_pbe"]
+
+                started = time.perf_counter()
+                if READ_MODE == "cells":
+                    data = read_range_by_cell(current_sheet, range_address, formulas)
+                else:
+                    data = read_range(current_sheet, range_address, formulas)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                cells = sum(len(row) for row in data)
+                print(f"Read {range_str} ({cells} cells) in {elapsed_ms:.1f} ms [{READ_MODE}]")
                 return data
             except Exception as e:
                 self.show_message("Error", f"Could not get data from range {range_str}: {e}")
@@ -542,120 +1074,182 @@ class Os3mSheetController:
             # For batchproc, the output range is the same as the input range
             request_data = {
                 "inputRange": input_range,
-                "inputData": input_data,
+                "inputData": encode_grid(input_data),
                 "description": description
             }
             if output_range: # outputRange and outputData are optional for Analysis constructor
                 output_data = get_data_from_range(output_range)
                 request_data["outputRange"] = output_range
-                request_data["outputData"] = output_data
+                request_data["outputData"] = encode_grid(output_data)
+        request_data["sessionId"] = self.session_id
+
+        stream_range = input_range if op_type == "batchproc" else output_range
+        if STREAMING and op_type in STREAM_OPS and stream_range:
+            self.stream_api_async(op_type, request_data, stream_range)
+        elif STREAMING and op_type in STREAM_TEXT_OPS:
+            self.stream_text_async(op_type, request_data)
+        else:
+            self.call_api_async(op_type, request_data, lambda result: self.apply_result(op_type, result, input_range, output_range))
+
+    def write_grid(self, sheet, col, row, data):
+        """Write `data` with its top-left cell at (col, row); returns the number of write calls."""
+        if WRITE_MODE == "cells":
+            write_range_by_cell(sheet, col, row, data)
+            return sum(len(r) for r in data)
+        return write_range(self.model, sheet, col, row, data)
+
+    def write_stream_rows(self, sheet, col, row, data):
+        """Like `write_grid`, but inside one undo step kept open until `end_stream_write()`."""
+        if WRITE_MODE == "cells":
+            return self.write_grid(sheet, col, row, data)
+        if self.stream_write is None:
+            self.stream_write = GridWrite(self.model)
+        return self.stream_write.write(sheet, col, row, data)
+
+    def end_stream_write(self):
+        # Main thread; restores undo, repaint and recalculation once the stream is over
+        stream_write, self.stream_write = self.stream_write, None
+        if stream_write:
+            stream_write.close()
+
+    def resolve_range(self, range_str):
+        parts = range_str.rsplit('!', 1)
+        sheet = self.model.getSheets().getByName(parts[0]) if len(parts) > 1 else self.sheet
+        return sheet, sheet.getCellRangeByName(parts[-1]).getRangeAddress()
+
+    def stream_api_async(self, op_type, request_data, range_to_use):
+        """Run a cell-producing operation on its stream endpoint, writing rows as they arrive."""
+        try:
+            target_sheet, address = self.resolve_range(range_to_use)
+        except Exception as e:
+            self.show_message("Error", f"Invalid target range {range_to_use}: {e}")
+            return
+        progress = {"rows": 0, "calls": 0, "first_ms": None, "started": time.perf_counter()}
+
+        def write_event(event):
+            # Main thread; blocks from a cancelled request are dropped
+            if request is not self.pending or event.get("type") != "rows":
+                return
+            rows = event.get("rows") or []
+            progress["calls"] += self.write_stream_rows(target_sheet, address.StartColumn, address.StartRow + event.get("offset", 0), rows)
+            progress["rows"] += len(rows)
+            if progress["first_ms"] is None:
+                progress["first_ms"] = (time.perf_counter() - progress["started"]) * 1000
+
+        request = StreamRequest(self.api, op_type, request_data, lambda event: self.run_on_main_thread(lambda: write_event(event)))
+        self.call_api_async(op_type, request_data, lambda result: self.finish_stream(op_type, result, range_to_use, progress), request=request)
 
-        result = self.call_api(op_type, request_data)
+    def finish_stream(self, op_type, result, range_to_use, progress):
+        self.update_history_display(force_refresh=True)
+        total_ms = (time.perf_counter() - progress["started"]) * 1000
+        first_ms = progress["first_ms"] or total_ms
+        print(f"Streamed {progress['rows']} row(s) to {range_to_use} in {progress['calls']} call(s); first block after {first_ms:.0f} ms, done after {total_ms:.0f} ms")
+        reply = result.get("result", {})
+        if reply.get("status") == "error":
+            self.show_message("Error", reply.get("message", f"{op_type} failed."))
+            return
+        notes = ""
+        if reply.get("failed_rows"):
+            notes += f"\n{reply['failed_rows']} row(s) could not be processed and were left unchanged."
+        if reply.get("verification"):
+            notes += f"\nVerification: {reply['verification']}"
+        self.show_message("Operation Success", f"{op_type} data written to {range_to_use} ({progress['rows']} rows).{notes}")
+
+    def apply_result(self, op_type, result, input_range, output_range):
+        # Runs on the UNO main thread once the worker has the server's reply
+        if not result:
+            self.show_message("API Call Failed", f"No response from {op_type} API.")
+            return
 
         # Update the history display on the dialog
-        if result:
-            self.update_history_display(force_refresh=True) # Update history for all other ops
-            if op_type in ["autofill", "formula_pbe", "feedback", "batchproc"]:
-                # Assume result has {"candidate": data_to_write, "range": target_range}
-                candidate_data = result.get("result", {}).get("candidate") # Assuming result from api.py is {"message": "...", "result": actual_result}
-                target_range_str = result.get("result", {}).get("range")
-                
-                # Prefer user input for range to preserve sheet name
-                range_to_use = target_range_str
-                if op_type in ["autofill", "formula_pbe"] and output_range:
-                    range_to_use = output_range
-                elif op_type == "batchproc" and input_range:
-                    range_to_use = input_range
-
-                if candidate_data and range_to_use:
-                    # Write data back to sheet
-                    self.show_message("Autofill Result", f"Writing to {range_to_use}: {candidate_data}")
-                    try:
-                        parts = range_to_use.rsplit('!', 1)
-                        if len(parts) > 1:
-                            sheet_name = parts[0]
-                            cell_range_str = parts[1]
-                        else:
-                            sheet_name = self.sheet.Name
-                            cell_range_str = parts[0]
-
-                        target_sheet = self.model.getSheets().getByName(sheet_name)
-                        target_range_address = target_sheet.getCellRangeByName(cell_range_str).getRangeAddress()
-
-                        row_offset = target_range_address.StartRow
-                        col_offset = target_range_address.StartColumn
-
-                        for r_idx, row_list in enumerate(candidate_data):
-                            for c_idx, cell_val in enumerate(row_list):
-                                cell = target_sheet.getCellByPosition(col_offset + c_idx, row_offset + r_idx)
-                                # Heuristic to check if it's a formula: starts with '='
-                                if isinstance(cell_val, str) and cell_val.startswith('='):
-                                    cell.setFormula(cell_val)
-                                else:
-                                    cell.setString(str(cell_val))
-                        self.show_message("Operation Success", f"{op_type} data written to {range_to_use}.")
-                    except Exception as e:
-                        self.show_message("Write Error", f"Failed to write autofill/formula_pbe data: {e}")
-                else:
-                    self.show_message("Error", f"Invalid result for {op_type}: {result}")
-            elif op_type == "summary" or op_type == "formula_exp":
-                summary_text = result.get("result", {}).get("reply", "No reply received.")
-                self.show_output_dialog(summary_text)
-            elif op_type == "rangesel":
-                colors = result.get("result", {}).get("colors", [])
-                colors = [c for c in colors if c]
-                target_range_str = result.get("result", {}).get("range")
-                if not colors or not target_range_str:
-                    self.show_message("Range Select Error", "Did not receive color data from the API.")
-                    return
+        self.update_history_display(force_refresh=True) # Update history for all other ops
+        if op_type in ["autofill", "formula_pbe", "feedback", "batchproc"]:
+            # Assume result has {"candidate": data_to_write, "range": target_range}
+            candidate_data = result.get("result", {}).get("candidate") # Assuming result from api.py is {"message": "...", "result": actual_result}
+            target_range_str = result.get("result", {}).get("range")
+
+            # Prefer user input for range to preserve sheet name
+            range_to_use = target_range_str
+            if op_type in ["autofill", "formula_pbe"] and output_range:
+                range_to_use = output_range
+            elif op_type == "batchproc" and input_range:
+                range_to_use = input_range
+
+            if candidate_data and range_to_use:
+                # Write data back to sheet
+                self.show_message("Autofill Result", f"Writing to {range_to_use}: {candidate_data}")
                 try:
-                    parts = target_range_str.rsplit('!', 1)
+                    parts = range_to_use.rsplit('!', 1)
                     if len(parts) > 1:
                         sheet_name = parts[0]
                         cell_range_str = parts[1]
                     else:
                         sheet_name = self.sheet.Name
                         cell_range_str = parts[0]
+
                     target_sheet = self.model.getSheets().getByName(sheet_name)
                     target_range_address = target_sheet.getCellRangeByName(cell_range_str).getRangeAddress()
 
-                    color_map = {'green': 0x00FF00, 'yellow': 0xFFFF00, 'red': 0xFF0000, 'white': 0xFFFFFF}
-                    color_counts = {'green': 0, 'yellow': 0, 'red': 0, 'white': 0}
-                    color_idx = 0
-
-                    for r in range(target_range_address.StartRow, target_range_address.EndRow + 1):
-                        for c in range(target_range_address.StartColumn, target_range_address.EndColumn + 1):
-                            if color_idx < len(colors):
-                                color_name = str(colors[color_idx]).lower().strip()
-                                cell = target_sheet.getCellByPosition(c, r)
-                                cell.CellBackColor = color_map.get(color_name, 0xFFFFFF)
-                                color_counts[color_name] = color_counts.get(color_name, 0) + 1
-                                color_idx += 1
-                    self.show_message("Range Select Complete", f"Highlighting complete. Counts: {color_counts}")
+                    row_offset = target_range_address.StartRow
+                    col_offset = target_range_address.StartColumn
+
+                    started = time.perf_counter()
+                    blocks = self.write_grid(target_sheet, col_offset, row_offset, candidate_data)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    print(f"Wrote {range_to_use} in {blocks} call(s), {elapsed_ms:.1f} ms [{WRITE_MODE}]")
+                    self.show_message("Operation Success", f"{op_type} data written to {range_to_use}.")
                 except Exception as e:
-                    self.show_message("Range Select Error", f"Failed to apply highlighting: {e}")
-            elif op_type == "create_visual":
-                title = result.get("result", {}).get("title", "No Title")
-                chart_type = result.get("result", {}).get("chart_type", "Unknown")
-                target_range_str = result.get("result", {}).get("range") # This is inputSection range
-                
-                # Use input_range if available to preserve sheet info
-                range_to_use = input_range if input_range else target_range_str
-
-                if range_to_use:
-                    self.create_chart(self.sheet, range_to_use, title, chart_type)
+                    self.show_message("Write Error", f"Failed to write autofill/formula_pbe data: {e}")
+            else:
+                self.show_message("Error", f"Invalid result for {op_type}: {result}")
+        elif op_type == "summary" or op_type == "formula_exp":
+            summary_text = result.get("result", {}).get("reply", "No reply received.")
+            self.show_output_dialog(summary_text)
+        elif op_type == "rangesel":
+            blocks = result.get("result", {}).get("blocks", {})
+            color_counts = result.get("result", {}).get("counts", {})
+            target_range_str = result.get("result", {}).get("range")
+            if not blocks or not target_range_str:
+                self.show_message("Range Select Error", "Did not receive color data from the API.")
+                return
+            try:
+                parts = target_range_str.rsplit('!', 1)
+                if len(parts) > 1:
+                    sheet_name = parts[0]
+                    cell_range_str = parts[1]
                 else:
-                    self.show_message("Chart Error", "No data range provided for chart creation.")
-            elif op_type == "formula_chk":
-                infos = result.get("result", {}).get("info", [])
-                info_text = "\n".join([f"[{i['intent'].upper()}] {i['info']}" for i in infos])
-                self.show_output_dialog(f"Formula Check Results:\n{info_text}")
-            elif op_type == "feedback":
-                self.show_message("Feedback", result.get("message", "Feedback sent."))
+                    sheet_name = self.sheet.Name
+                    cell_range_str = parts[0]
+                target_sheet = self.model.getSheets().getByName(sheet_name)
+                target_range_address = target_sheet.getCellRangeByName(cell_range_str).getRangeAddress()
+
+                started = time.perf_counter()
+                color_range(self.model, target_sheet, target_range_address, blocks)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"Colored {target_range_str} with {sum(len(b) for b in blocks.values())} block(s) in {elapsed_ms:.1f} ms")
+                self.show_message("Range Select Complete", f"Highlighting complete. Counts: {color_counts}")
+            except Exception as e:
+                self.show_message("Range Select Error", f"Failed to apply highlighting: {e}")
+        elif op_type == "create_visual":
+            title = result.get("result", {}).get("title", "No Title")
+            chart_type = result.get("result", {}).get("chart_type", "Unknown")
+            target_range_str = result.get("result", {}).get("range") # This is inputSection range
+
+            # Use input_range if available to preserve sheet info
+            range_to_use = input_range if input_range else target_range_str
+
+            if range_to_use:
+                self.create_chart(self.sheet, range_to_use, title, chart_type)
             else:
-                self.show_message("API Response", str(result))
+                self.show_message("Chart Error", "No data range provided for chart creation.")
+        elif op_type == "formula_chk":
+            infos = result.get("result", {}).get("info", [])
+            info_text = "\n".join([f"[{i['intent'].upper()}] {i['info']}" for i in infos])
+            self.show_output_dialog(f"Formula Check Results:\n{info_text}")
+        elif op_type == "feedback":
+            self.show_message("Feedback", result.get("message", "Feedback sent."))
         else:
-            self.show_message("API Call Failed", f"No response from {op_type} API.")
+            self.show_message("API Response", str(result))
 
 class Os3mSheetJob(unohelper.Base, XJobExecutor, XServiceInfo):
     def __init__(self, ctx):
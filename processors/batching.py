@@ -0,0 +1,128 @@
+import time
+import queue
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+import dspy
+
+_STOP = object()
+
+
+class CoalescingThrottle:
+    """Holds LM calls that arrive close together and releases each group at the same moment.
+
+    This is not request batching: every call is still its own completion request. A dispatcher
+    thread takes the first queued call, waits up to `window` seconds for up to `max_batch - 1`
+    more, then starts the whole group concurrently so a server with continuous batching (vLLM)
+    is likely to schedule them in the same step. At most `max_in_flight` calls run at once, which
+    defaults to no fewer than `max_batch`; callers block once `max_queue` calls are waiting.
+    """
+
+    def __init__(self, window: float = 0.01, max_batch: int = 8, max_in_flight: int = 48, max_queue: int = 256):
+        self.window = max(0.0, window)
+        self.max_batch = max(1, int(max_batch))
+        self.max_in_flight = max(self.max_batch, int(max_in_flight))
+        self.max_queue = max(1, int(max_queue))
+        self.queue = queue.Queue(maxsize=self.max_queue)
+        self.slots = threading.Semaphore(self.max_in_flight)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="os3m-lm-batch")
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.batches = 0
+        self.full_batches = 0
+        self.queue_wait = 0.0
+        self.max_depth = 0
+        self.blocked = 0
+        self.dispatcher = threading.Thread(target=self._loop, name="os3m-lm-batcher", daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, fn):
+        """Run `fn()` with the next group and return its result (blocking)."""
+        future = Future()
+        item = (time.perf_counter(), contextvars.copy_context(), fn, future)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.blocked += 1
+            self.queue.put(item)
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return future.result()
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            now = time.perf_counter()
+            with self.lock:
+                self.batches += 1
+                self.calls += len(batch)
+                self.full_batches += len(batch) == self.max_batch
+                self.queue_wait += sum(now - queued for queued, _, _, _ in batch)
+            for _, context, fn, future in batch:
+                self.slots.acquire()
+                self.pool.submit(self._call, context, fn, future)
+
+    def _call(self, context, fn, future):
+        try:
+            # Run in the caller's context so dspy.context() overrides and callbacks still apply
+            future.set_result(context.run(fn))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "window_ms": round(self.window * 1000, 3),
+                "max_batch": self.max_batch,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_depth,
+                "calls": self.calls,
+                "batches": self.batches,
+                "avg_batch_size": round(self.calls / self.batches, 3) if self.batches else 0.0,
+                "full_batches": self.full_batches,
+                "avg_queue_wait_ms": round(self.queue_wait / self.calls * 1000, 3) if self.calls else 0.0,
+                "blocked_submits": self.blocked,
+            }
+
+    def shutdown(self):
+        self.queue.put(_STOP)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class CoalescingLM(dspy.LM):
+    """dspy.LM whose synchronous calls go through a CoalescingThrottle.
+
+    Async calls (used for token streaming) bypass the throttle.
+    """
+
+    def __init__(self, model: str, batcher: CoalescingThrottle, **kwargs):
+        super().__init__(model, **kwargs)
+        self.batcher = batcher
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        return self.batcher.submit(lambda: super(CoalescingLM, self).__call__(prompt, messages=messages, **kwargs))
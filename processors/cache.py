@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import dspy
+from dspy.streaming import StreamListener, StreamResponse
+from dotenv import load_dotenv
+
+
+def _normalize(value):
+    # Only surrounding whitespace is dropped: inner spacing is part of cell content and TSV structure
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    return value
+
+
+class PredictionCache:
+    """Two-tier (memory LRU + sqlite) cache of DSPy prediction fields."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400, path: str = None, max_disk_entries: int = 5000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.by_signature = {}
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, signature TEXT, created REAL, expires REAL, fields TEXT)"
+            )
+            self.db.commit()
+
+    def make_key(self, signature: str, module: str, model: str, inputs: dict):
+        payload = json.dumps(
+            {"signature": signature, "module": module, "model": model, "inputs": _normalize(inputs)},
+            sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, signature: str, hit: bool):
+        counts = self.by_signature.setdefault(signature, {"hits": 0, "misses": 0})
+        counts["hits" if hit else "misses"] += 1
+
+    def get(self, key: str, signature: str = ""):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires, fields = entry
+                if expires > now:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self._count(signature, True)
+                    return fields
+                del self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT expires, fields FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row and row[0] > now:
+                    fields = json.loads(row[1])
+                    self._put_memory(key, row[0], fields)
+                    self.disk_hits += 1
+                    self._count(signature, True)
+                    return fields
+                if row:
+                    self.db.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                    self.db.commit()
+
+            self.misses += 1
+            self._count(signature, False)
+            return None
+
+    def peek(self, key: str) -> bool:
+        """Whether `key` has a live entry, without touching hit counts or LRU order."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] > now:
+                return True
+            if self.db is not None:
+                row = self.db.execute("SELECT expires FROM predictions WHERE key = ?", (key,)).fetchone()
+                return bool(row and row[0] > now)
+            return False
+
+    def _put_memory(self, key: str, expires: float, fields: dict):
+        self.memory[key] = (expires, fields)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def set(self, key: str, fields: dict, signature: str = ""):
+        now = time.time()
+        expires = now + self.ttl
+        with self.lock:
+            self._put_memory(key, expires, fields)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                    (key, signature, now, expires, json.dumps(fields, default=str))
+                )
+                self.db.execute("DELETE FROM predictions WHERE expires <= ?", (now,))
+                self.db.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM predictions")
+                self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_entries = 0
+            if self.db is not None:
+                disk_entries = self.db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": disk_entries,
+                "by_signature": {k: dict(v) for k, v in self.by_signature.items()},
+            }
+
+
+load_dotenv()
+prediction_cache = None
+if os.getenv("PREDICTION_CACHE", "on").lower() not in ("0", "off", "false", "no"):
+    prediction_cache = PredictionCache(
+        max_entries=int(os.getenv("PREDICTION_CACHE_SIZE", "256")),
+        ttl=float(os.getenv("PREDICTION_CACHE_TTL", "86400")),
+        path=os.getenv("PREDICTION_CACHE_PATH", ".os3m_cache/predictions.sqlite3") or None,
+        max_disk_entries=int(os.getenv("PREDICTION_CACHE_DISK_SIZE", "5000")),
+    )
+
+
+def _cache_key(module, signature, config: dict, inputs: dict):
+    lm = dspy.settings.lm
+    model = getattr(lm, "model", None) or str(lm)
+    return prediction_cache.make_key(signature.__name__, module.__name__, model, dict(inputs, _config=config) if config else inputs)
+
+
+def is_cached(module, signature, config: dict = None, **inputs) -> bool:
+    """Whether `cached_predict` would answer this call from the cache."""
+    if prediction_cache is None:
+        return False
+    return prediction_cache.peek(_cache_key(module, signature, config or {}, inputs))
+
+
+def _from_fields(fields: dict, signature):
+    """Rebuild a cached prediction; `.completions` is always set, as on a fresh call."""
+    return dspy.Prediction.from_completions(fields.get("_completions") or [fields], signature=signature)
+
+
+def cached_predict(module, signature, config: dict = None, **inputs):
+    """Call `module(signature, **config)(**inputs)`, serving repeat calls from the prediction cache."""
+    config = config or {}
+    if prediction_cache is None:
+        return module(signature, **config)(**inputs)
+
+    name = signature.__name__
+    key = _cache_key(module, signature, config, inputs)
+    fields = prediction_cache.get(key, name)
+    if fields is not None:
+        return _from_fields(fields, signature)
+
+    pred = module(signature, **config)(**inputs)
+    completions = pred.completions
+    if completions is not None and len(completions) > 1:
+        fields = {"_completions": [{k: completions[i][k] for k in completions[i].keys()} for i in range(len(completions))]}
+    else:
+        fields = {k: pred[k] for k in pred.keys()}
+    prediction_cache.set(key, fields, name)
+    return pred
+
+
+def cached_stream(module, signature, field: str, on_chunk=None, **inputs):
+    """Like `cached_predict`, but calls `on_chunk(text)` with `field`'s raw text as the LM streams it.
+
+    Cache hits and LMs that do not stream deliver the whole field in one chunk.
+    """
+    if on_chunk is None:
+        return cached_predict(module, signature, **inputs)
+    name = signature.__name__
+    key = _cache_key(module, signature, None, inputs) if prediction_cache is not None else None
+    fields = prediction_cache.get(key, name) if key else None
+    if fields is not None and "_completions" not in fields:
+        on_chunk(str(fields.get(field, "")))
+        return _from_fields(fields, signature)
+
+    program = dspy.streamify(module(signature), stream_listeners=[StreamListener(signature_field_name=field)], async_streaming=False)
+    pred, streamed = None, False
+    for value in program(**inputs):
+        if isinstance(value, StreamResponse):
+            streamed = True
+            on_chunk(value.chunk)
+        elif isinstance(value, dspy.Prediction):
+            pred = value
+    if pred is None:
+        raise RuntimeError(f"{name} stream ended without a prediction")
+    if not streamed:
+        on_chunk(str(pred.get(field, "")))
+    if key:
+        prediction_cache.set(key, {k: pred[k] for k in pred.keys()}, name)
+    return pred
@@ -0,0 +1,150 @@
+from functools import lru_cache
+from processors.formula import tokenize
+from processors.serializer import num_to_column
+
+# Functions that behave the same in Excel and LibreOffice Calc
+COMMON_FUNCTIONS = frozenset("""
+ABS ACOS ACOSH ACOT ACOTH AGGREGATE ARABIC ASIN ASINH ATAN ATAN2 ATANH BASE CEILING CEILING.MATH CEILING.PRECISE
+COMBIN COMBINA COS COSH COT COTH CSC CSCH DECIMAL DEGREES EVEN EXP FACT FACTDOUBLE FLOOR FLOOR.MATH FLOOR.PRECISE
+GCD INT ISO.CEILING LCM LN LOG LOG10 MDETERM MINVERSE MMULT MOD MROUND MULTINOMIAL MUNIT ODD PI POWER PRODUCT
+QUOTIENT RADIANS RAND RANDBETWEEN ROMAN ROUND ROUNDDOWN ROUNDUP SEC SECH SERIESSUM SIGN SIN SINH SQRT SQRTPI
+SUBTOTAL SUM SUMIF SUMIFS SUMPRODUCT SUMSQ SUMX2MY2 SUMX2PY2 SUMXMY2 TAN TANH TRUNC
+AVEDEV AVERAGE AVERAGEA AVERAGEIF AVERAGEIFS BETADIST BETA.DIST BETAINV BETA.INV BINOMDIST BINOM.DIST CHIDIST
+CHIINV CHITEST CONFIDENCE CORREL COUNT COUNTA COUNTBLANK COUNTIF COUNTIFS COVAR COVARIANCE.P COVARIANCE.S DEVSQ
+EXPONDIST EXPON.DIST FISHER FISHERINV FORECAST FORECAST.LINEAR FREQUENCY GAMMA GAMMADIST GAMMALN GEOMEAN GROWTH
+HARMEAN INTERCEPT KURT LARGE LINEST LOGEST MAX MAXA MAXIFS MEDIAN MIN MINA MINIFS MODE MODE.SNGL MODE.MULT
+NORMDIST NORM.DIST NORMINV NORM.INV NORMSDIST NORM.S.DIST NORMSINV NORM.S.INV PEARSON PERCENTILE PERCENTILE.INC
+PERCENTILE.EXC PERCENTRANK PERMUT POISSON POISSON.DIST QUARTILE QUARTILE.INC QUARTILE.EXC RANK RANK.EQ RANK.AVG
+RSQ SKEW SLOPE SMALL STANDARDIZE STDEV STDEV.S STDEV.P STDEVA STDEVP STDEVPA STEYX TDIST T.DIST TINV T.INV TREND
+TRIMMEAN TTEST T.TEST VAR VAR.S VAR.P VARA VARP VARPA WEIBULL ZTEST
+CHAR CLEAN CODE CONCAT CONCATENATE DOLLAR EXACT FIND FIXED LEFT LEN LOWER MID NUMBERVALUE PROPER REPLACE REPT
+RIGHT SEARCH SUBSTITUTE T TEXT TEXTJOIN TRIM UNICHAR UNICODE UPPER VALUE
+AND FALSE IF IFERROR IFNA IFS NOT OR SWITCH TRUE XOR
+ADDRESS AREAS CHOOSE COLUMN COLUMNS GETPIVOTDATA HLOOKUP HYPERLINK INDEX INDIRECT LOOKUP MATCH OFFSET ROW ROWS
+TRANSPOSE VLOOKUP
+DATE DATEDIF DATEVALUE DAY DAYS DAYS360 EDATE EOMONTH HOUR ISOWEEKNUM MINUTE MONTH NETWORKDAYS NETWORKDAYS.INTL
+NOW SECOND TIME TIMEVALUE TODAY WEEKDAY WEEKNUM WORKDAY WORKDAY.INTL YEAR YEARFRAC
+CELL ERROR.TYPE INFO ISBLANK ISERR ISERROR ISEVEN ISFORMULA ISLOGICAL ISNA ISNONTEXT ISNUMBER ISODD ISREF ISTEXT
+N NA SHEET SHEETS TYPE
+DB DDB EFFECT FV IPMT IRR ISPMT MIRR NOMINAL NPER NPV PMT PPMT PV RATE SLN SYD VDB XIRR XNPV
+DAVERAGE DCOUNT DCOUNTA DGET DMAX DMIN DPRODUCT DSTDEV DSTDEVP DSUM DVAR DVARP
+BIN2DEC BIN2HEX BIN2OCT DEC2BIN DEC2HEX DEC2OCT HEX2BIN HEX2DEC HEX2OCT OCT2BIN OCT2DEC OCT2HEX BITAND BITLSHIFT
+BITOR BITRSHIFT BITXOR COMPLEX CONVERT DELTA ERF ERFC GESTEP IMABS IMAGINARY IMREAL
+ENCODEURL FILTERXML WEBSERVICE
+""".split())
+
+# Excel 365 dynamic-array functions that LibreOffice added in 24.8
+LIBREOFFICE_248_FUNCTIONS = frozenset("FILTER LET RANDARRAY SEQUENCE SORT SORTBY UNIQUE XLOOKUP XMATCH".split())
+
+# Excel functions LibreOffice lacks or only has in its most recent releases
+EXCEL_ONLY_FUNCTIONS = {
+    **dict.fromkeys("LAMBDA MAP REDUCE SCAN BYROW BYCOL MAKEARRAY ISOMITTED".split(), "LAMBDA functions are not supported by LibreOffice"),
+    **dict.fromkeys("TEXTSPLIT TEXTBEFORE TEXTAFTER VSTACK HSTACK TOCOL TOROW WRAPROWS WRAPCOLS TAKE DROP CHOOSEROWS "
+                    "CHOOSECOLS EXPAND ARRAYTOTEXT VALUETOTEXT REGEXTEST REGEXEXTRACT REGEXREPLACE TRIMRANGE".split(),
+                    "recent Excel 365 function; older LibreOffice releases show #NAME?"),
+    **dict.fromkeys("IMAGE STOCKHISTORY FIELDVALUE GROUPBY PIVOTBY PERCENTOF PY CUBEMEMBER CUBEVALUE CUBESET CUBESETCOUNT "
+                    "CUBERANKEDMEMBER CUBEMEMBERPROPERTY CUBEKPIMEMBER".split(), "Excel-only function, not available in LibreOffice"),
+}
+
+# LibreOffice functions Excel does not have, with the Excel equivalent where there is one
+LIBREOFFICE_ONLY_FUNCTIONS = {
+    "B": None, "CHISQDIST": None, "COLOR": None, "CURRENT": None, "EASTERSUNDAY": None, "FOURIER": None,
+    "GAUSS": "NORM.S.DIST(x,TRUE)-0.5", "RAWSUBTRACT": None, "ROT13": None, "STYLE": None, "WEEKS": None,
+    "DAYSINMONTH": "DAY(EOMONTH(date,0))", "DAYSINYEAR": "DATE(YEAR(date)+1,1,1)-DATE(YEAR(date),1,1)", "WEEKSINYEAR": None,
+    "ISLEAPYEAR": "MONTH(DATE(YEAR(date),2,29))=2", "MONTHS": "DATEDIF", "YEARS": "DATEDIF",
+    "REGEX": "REGEXEXTRACT / REGEXREPLACE (Excel 365)", "ROUNDSIG": "ROUND(x,n-1-INT(LOG10(ABS(x))))",
+    "FORMULA": "FORMULATEXT", "ERRORTYPE": "ERROR.TYPE",
+}
+
+_ADDIN_PREFIX = "COM.SUN.STAR.SHEET.ADDIN."
+_KNOWN_OTHER = ("$", "'", "!", "~", "@", "#", "[", "]", "|", ".")
+
+
+def _function_name(name: str):
+    """Canonical upper-case name, and whether LibreOffice kept Excel's `_xlfn.` prefix (unknown function)."""
+    upper = name.upper()
+    if upper.startswith(_ADDIN_PREFIX):
+        # Analysis add-in functions come back as e.g. com.sun.star.sheet.addin.Analysis.getEomonth
+        upper = upper.rsplit(".", 1)[-1]
+        return (upper[3:] if upper.startswith("GET") else upper), False
+    for prefix in ("_XLFN._XLWS.", "_XLFN.", "_XLWS."):
+        if upper.startswith(prefix):
+            return upper[len(prefix):], True
+    return upper, False
+
+
+@lru_cache(maxsize=65536)
+def check_formula(formula: str):
+    """Rule-based compatibility check of one formula.
+
+    Returns (findings, classified): findings are (intent, message) pairs, and `classified` is
+    False when the formula uses a function or syntax the rules do not know, so only a model
+    can judge it.
+    """
+    findings = []
+    classified = True
+    seps = set()
+    depth = 0
+    previous = None
+    for token in tokenize(formula[1:] if formula.startswith("=") else formula):
+        kind, value = token.type, token.value
+        if kind == "func":
+            name, unknown = _function_name(value)
+            if unknown:
+                findings.append(("warning", f"{name} is not known to this LibreOffice version (stored as _xlfn.{name})"))
+            elif name in COMMON_FUNCTIONS:
+                pass
+            elif name in LIBREOFFICE_248_FUNCTIONS:
+                findings.append(("warning", f"{name} needs LibreOffice 24.8 or later (Excel 2021/365)"))
+            elif name in EXCEL_ONLY_FUNCTIONS:
+                findings.append(("warning", f"{name}: {EXCEL_ONLY_FUNCTIONS[name]}"))
+            elif name in LIBREOFFICE_ONLY_FUNCTIONS:
+                alternative = LIBREOFFICE_ONLY_FUNCTIONS[name]
+                hint = f"; use {alternative} instead" if alternative else ""
+                findings.append(("warning", f"{name} is LibreOffice-only, Excel shows #NAME?{hint}"))
+            else:
+                classified = False
+        elif kind == "lbrace":
+            depth += 1
+            findings.append(("info", "Array constant: Excel separates columns with ',' and rows with ';', "
+                                     "LibreOffice uses the separators set in Tools > Options > Calc > Formula"))
+        elif kind == "rbrace":
+            depth = max(0, depth - 1)
+        elif kind == "sep" and not depth:
+            seps.add(value)
+        elif kind == "other":
+            if value == "@":
+                findings.append(("warning", "The implicit intersection operator @ is Excel-only"))
+            elif value == "#" and previous is not None and previous.type in ("ref", "name", "rparen"):
+                findings.append(("warning", "Spilled range references (A1#) are Excel-only"))
+            elif value == "~":
+                findings.append(("warning", "The ~ range union operator is LibreOffice-only; Excel uses a comma inside parentheses"))
+            elif value == "[":
+                findings.append(("warning", "Structured table references need a LibreOffice database range with matching headers"))
+            elif value not in _KNOWN_OTHER:
+                classified = False
+        previous = token
+    if len(seps) > 1:
+        findings.append(("warning", "Mixes ',' and ';' argument separators; use one consistently"))
+    # Several calls to one function give the same message once
+    return tuple(dict.fromkeys(findings)), classified
+
+
+def check_grid(data: list, first_row: int = 1, first_col: int = 1):
+    """Check every formula in a grid.
+
+    Returns (findings, unclassified, count): findings as (cell, intent, message) with A1 cell
+    names, the (row, col) grid positions the rules could not classify, and the number of formulas.
+    """
+    findings, unclassified, count = [], [], 0
+    for r, row in enumerate(data):
+        for c, value in enumerate(row):
+            if not isinstance(value, str) or not value.startswith("="):
+                continue
+            count += 1
+            cell_findings, classified = check_formula(value)
+            cell = f"{num_to_column(first_col + c)}{first_row + r}"
+            findings.extend((cell, intent, message) for intent, message in cell_findings)
+            if not classified:
+                unclassified.append((r, c))
+    return findings, unclassified, count
@@ -0,0 +1,63 @@
+import zlib
+from starlette.responses import JSONResponse
+
+
+def gunzip(body: bytes, max_size: int) -> bytes:
+    """Decompress a gzip body, refusing anything that inflates past `max_size` bytes."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, max_size + 1)
+    if len(data) > max_size or decompressor.unconsumed_tail:
+        raise ValueError(f"decompressed body exceeds {max_size} bytes")
+    if not decompressor.eof:
+        raise ValueError("truncated gzip body")
+    return data
+
+
+class GzipRequestMiddleware:
+    """ASGI middleware that inflates request bodies sent with `Content-Encoding: gzip`.
+
+    Responses are compressed separately by Starlette's `GZipMiddleware`.
+    """
+
+    def __init__(self, app, max_size: int = 256 * 1024 * 1024):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = scope.get("headers", [])
+        encoding = next((v for k, v in headers if k == b"content-encoding"), b"").strip().lower()
+        if encoding != b"gzip":
+            return await self.app(scope, receive, send)
+
+        chunks = []
+        size = 0
+        more = True
+        while more:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.max_size:
+                response = JSONResponse({"detail": f"gzip request body exceeds {self.max_size} bytes"}, status_code=413)
+                return await response(scope, receive, send)
+            chunks.append(chunk)
+            more = message.get("more_body", False)
+        try:
+            data = gunzip(b"".join(chunks), self.max_size)
+        except (zlib.error, ValueError) as e:
+            response = JSONResponse({"detail": f"Invalid gzip request body: {e}"}, status_code=400)
+            return await response(scope, receive, send)
+
+        headers = [(k, v) for k, v in headers if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(data)).encode()))
+        delivered = False
+
+        async def receive_inflated():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": data, "more_body": False}
+            return await receive()
+
+        await self.app(dict(scope, headers=headers), receive_inflated, send)
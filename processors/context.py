@@ -1,16 +1,83 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_SESSION = "default"
+
+
+def _cells(analysis) -> int:
+    total = 0
+    for section in (getattr(analysis, "inputSection", None), getattr(analysis, "outputSection", None)):
+        data = getattr(section, "data", None) or []
+        total += sum(len(row) for row in data if isinstance(row, list))
+    return total
+
+
 class ContextManager:
-    def __init__(self):
-        self.context = None
-        self.analysis = None
+    """Last context and analysis per session, for feedback.
+
+    Sessions are kept in LRU order and dropped after `ttl` seconds of inactivity, when more than
+    `max_sessions` are open, or when the stored analyses together exceed `max_cells` cells.
+    """
+
+    def __init__(self, max_sessions: int = 256, ttl: float = 3600, max_cells: int = 2_000_000):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self.max_cells = max_cells
+        self.sessions = OrderedDict()
+        self.cells = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def _drop(self, session_id):
+        _, _, _, cells = self.sessions.pop(session_id)
+        self.cells -= cells
+        self.evicted += 1
+
+    def _evict(self, now):
+        # The LRU end is also the oldest, so expiry stops at the first live session.
+        # The most recent session is kept over the size limits so feedback on it still works.
+        while self.sessions:
+            session_id, (touched, _, _, _) = next(iter(self.sessions.items()))
+            expired = now - touched > self.ttl
+            oversized = len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.cells > self.max_cells)
+            if not expired and not oversized:
+                break
+            self._drop(session_id)
 
-    def set_last_context(self, context):
-        self.context = context
+    def set_last(self, session_id, context, analysis):
+        session_id = session_id or DEFAULT_SESSION
+        cells = _cells(analysis)
+        now = time.time()
+        with self.lock:
+            if session_id in self.sessions:
+                self.cells -= self.sessions.pop(session_id)[3]
+            self.sessions[session_id] = (now, context, analysis, cells)
+            self.cells += cells
+            self._evict(now)
 
-    def set_last_analysis(self, analysis):
-        self.analysis = analysis
+    def get_last(self, session_id):
+        """(context, analysis) for the session, or (None, None) when it is unknown or expired."""
+        session_id = session_id or DEFAULT_SESSION
+        now = time.time()
+        with self.lock:
+            self._evict(now)
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None, None
+            _, context, analysis, cells = entry
+            self.sessions[session_id] = (now, context, analysis, cells)
+            self.sessions.move_to_end(session_id)
+            return context, analysis
 
-    def get_last_context(self):
-        return self.context
+    def copy(self, source_id, target_id):
+        """Give `target_id` the last context of `source_id`, e.g. when both shared one generation."""
+        context, analysis = self.get_last(source_id)
+        if analysis is not None and (source_id or DEFAULT_SESSION) != (target_id or DEFAULT_SESSION):
+            # A copy of its own: /feedback mutates the Analysis, and the sessions must not see each other's changes
+            self.set_last(target_id, context, copy.deepcopy(analysis))
 
-    def get_last_analysis(self):
-        return self.analysis
\ No newline at end of file
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions), "max_sessions": self.max_sessions, "cells": self.cells, "evicted": self.evicted}
@@ -2,6 +2,7 @@ import os
 import dspy
 from dotenv import load_dotenv
 from .llm import Context, LLM
+from .batching import CoalescingThrottle, CoalescingLM
 
 class DSPyContext(Context):
     def __init__(self, lm=None):
@@ -30,9 +31,7 @@ class DSPyLLM(LLM):
         self.lm = lm
 
     def getContext(self):
-        context = DSPyContext(lm=self.lm)
-        self.context.append(context)
-        return context
+        return DSPyContext(lm=self.lm)
 
 def setup_dspy():
     load_dotenv()
@@ -45,11 +44,24 @@ def setup_dspy():
         if base_url and not model.startswith("openai/"):
             model = f"openai/{model}"
 
-        lm = dspy.LM(
-            model=model,
-            api_key=api_key,
-            api_base=base_url
-        )
+        if os.getenv("LM_BATCHING", "off").lower() in ("1", "on", "true", "yes"):
+            # Release concurrent prompts together so a batching server (e.g. scripts/vllm_modal.py) runs them in one step.
+            # The in-flight cap defaults to every tile the request and job workers can send, so it never throttles those pools
+            workers = int(os.getenv("LLM_POOL_SIZE", "4")) + int(os.getenv("JOB_POOL_SIZE", "2"))
+            in_flight = int(os.getenv("BATCHPROC_PARALLELISM", "8")) * workers
+            batcher = CoalescingThrottle(
+                window=float(os.getenv("LM_BATCH_WINDOW_MS", "10")) / 1000,
+                max_batch=int(os.getenv("LM_BATCH_MAX_SIZE", "8")),
+                max_in_flight=int(os.getenv("LM_BATCH_MAX_IN_FLIGHT", str(in_flight))),
+                max_queue=int(os.getenv("LM_BATCH_MAX_QUEUE", "256")),
+            )
+            lm = CoalescingLM(model=model, batcher=batcher, api_key=api_key, api_base=base_url)
+        else:
+            lm = dspy.LM(
+                model=model,
+                api_key=api_key,
+                api_base=base_url
+            )
         dspy.settings.configure(lm=lm)
         return lm
     return None
\ No newline at end of file
@@ -0,0 +1,530 @@
+import re
+import math
+from processors.formula import parse, FormulaSyntaxError
+from processors.matcher import column_to_num
+
+
+class FormulaError(Exception):
+    """A spreadsheet error value such as #VALUE! raised during evaluation."""
+
+    def __init__(self, code: str = "#VALUE!"):
+        super().__init__(code)
+        self.code = code
+
+
+class UnsupportedFormula(Exception):
+    """The formula uses something the local evaluator does not implement."""
+
+
+class RangeValue:
+    def __init__(self, rows: list):
+        self.rows = rows
+
+    def values(self):
+        return [v for row in self.rows for v in row]
+
+
+def _to_number(value):
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            raise FormulaError("#VALUE!")
+    raise FormulaError("#VALUE!")
+
+
+def _to_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return "%.15g" % value
+    return str(value)
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        if value.upper() in ("TRUE", "FALSE"):
+            return value.upper() == "TRUE"
+        raise FormulaError("#VALUE!")
+    return _to_number(value) != 0
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _scalar(value):
+    if isinstance(value, RangeValue):
+        values = value.values()
+        if len(values) != 1:
+            raise FormulaError("#VALUE!")
+        return values[0]
+    return value
+
+
+def _numbers(args):
+    """Numbers for aggregate functions: ranges skip text/blanks, direct arguments are coerced."""
+    numbers = []
+    for arg in args:
+        if isinstance(arg, RangeValue):
+            numbers.extend(float(v) for v in arg.values() if _is_number(v))
+        elif arg is not None:
+            numbers.append(_to_number(arg))
+    return numbers
+
+
+def _compare_key(value):
+    # Spreadsheet ordering: numbers < text < booleans; text compares case-insensitively
+    if value is None:
+        return (0, 0.0)
+    if isinstance(value, bool):
+        return (2, value)
+    if _is_number(value):
+        return (0, float(value))
+    return (1, str(value).lower())
+
+
+def _criteria(criteria):
+    """Build a predicate from a COUNTIF/SUMIF criteria such as ">5", "<>x" or "a*"."""
+    if _is_number(criteria) or isinstance(criteria, bool):
+        return lambda v: v is not None and _compare_key(v) == _compare_key(criteria)
+    text = _to_text(criteria)
+    match = re.match(r"^(<>|<=|>=|=|<|>)?(.*)$", text, re.DOTALL)
+    op, operand = match.group(1) or "=", match.group(2)
+    try:
+        target = float(operand)
+    except ValueError:
+        target = operand
+    if isinstance(target, str) and op in ("=", "<>") and any(ch in target for ch in "*?"):
+        pattern = re.compile("^" + re.escape(target).replace(r"\*", ".*").replace(r"\?", ".") + "$", re.IGNORECASE | re.DOTALL)
+        matches = lambda v: bool(pattern.match(_to_text(v)))
+        return matches if op == "=" else (lambda v: not matches(v))
+    if op == "=" and target == "":
+        return lambda v: v is None or v == ""
+
+    def predicate(v):
+        if isinstance(v, str) and _is_number(target):
+            try:
+                v = float(v)
+            except ValueError:
+                return op == "<>"
+        if (_is_number(target) and not _is_number(v)) or (isinstance(target, str) and _is_number(v)):
+            return op == "<>"
+        a, b = _compare_key(v), _compare_key(target)
+        return {"=": a == b, "<>": a != b, "<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b}[op]
+    return predicate
+
+
+def _round_half_away(x, digits):
+    factor = 10 ** digits
+    return math.copysign(math.floor(abs(x) * factor + 0.5) / factor, x)
+
+
+def _subtotal(code, *args):
+    functions = {1: "AVERAGE", 2: "COUNT", 3: "COUNTA", 4: "MAX", 5: "MIN", 6: "PRODUCT", 9: "SUM"}
+    name = functions.get(int(_to_number(_scalar(code))) % 100)
+    if not name:
+        raise UnsupportedFormula("SUBTOTAL function code")
+    return FUNCTIONS[name](*args)
+
+
+def _average(*args):
+    numbers = _numbers(args)
+    if not numbers:
+        raise FormulaError("#DIV/0!")
+    return sum(numbers) / len(numbers)
+
+
+def _product(*args):
+    result = 1.0
+    for n in _numbers(args):
+        result *= n
+    return result
+
+
+def _mid(text, start, length):
+    start, length = int(_to_number(start)), int(_to_number(length))
+    if start < 1 or length < 0:
+        raise FormulaError("#VALUE!")
+    return _to_text(text)[start - 1:start - 1 + length]
+
+
+def _replace(text, start, length, new_text):
+    text, start, length = _to_text(text), int(_to_number(start)), int(_to_number(length))
+    return text[:start - 1] + _to_text(new_text) + text[start - 1 + length:]
+
+
+def _substitute(text, old, new, instance=None):
+    text, old, new = _to_text(text), _to_text(old), _to_text(new)
+    if not old:
+        return text
+    if instance is None:
+        return text.replace(old, new)
+    n = int(_to_number(instance))
+    index = -1
+    for _ in range(n):
+        index = text.find(old, index + 1)
+        if index < 0:
+            return text
+    return text[:index] + new + text[index + len(old):]
+
+
+def _find(needle, haystack, start=None, ignore_case=False):
+    needle, haystack = _to_text(needle), _to_text(haystack)
+    start = int(_to_number(start)) if start is not None else 1
+    if ignore_case:
+        needle, haystack = needle.lower(), haystack.lower()
+    index = haystack.find(needle, start - 1)
+    if index < 0:
+        raise FormulaError("#VALUE!")
+    return float(index + 1)
+
+
+def _vlookup(lookup, table, col_index, approximate=True):
+    if not isinstance(table, RangeValue):
+        raise FormulaError("#VALUE!")
+    lookup = _scalar(lookup)
+    col = int(_to_number(col_index))
+    if col < 1 or any(col > len(row) for row in table.rows):
+        raise FormulaError("#REF!")
+    approximate = approximate is None or _to_bool(approximate)
+    key = _compare_key(lookup)
+    if not approximate:
+        for row in table.rows:
+            value = row[0]
+            if isinstance(value, str) and _is_number(lookup):
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+            if _compare_key(value) == key:
+                return row[col - 1]
+        raise FormulaError("#N/A")
+    found = None
+    for row in table.rows:
+        if row[0] is None or _compare_key(row[0])[0] != key[0]:
+            continue
+        if _compare_key(row[0]) <= key:
+            found = row
+        else:
+            break
+    if found is None:
+        raise FormulaError("#N/A")
+    return found[col - 1]
+
+
+def _countif(cells, criteria):
+    predicate = _criteria(_scalar(criteria))
+    values = cells.values() if isinstance(cells, RangeValue) else [cells]
+    return float(sum(1 for v in values if predicate(v)))
+
+
+def _sumif(cells, criteria, sum_cells=None, average=False):
+    predicate = _criteria(_scalar(criteria))
+    sum_cells = sum_cells if sum_cells is not None else cells
+    if not isinstance(cells, RangeValue) or not isinstance(sum_cells, RangeValue):
+        raise FormulaError("#VALUE!")
+    picked = []
+    for r, row in enumerate(cells.rows):
+        for c, value in enumerate(row):
+            if predicate(value) and r < len(sum_cells.rows) and c < len(sum_cells.rows[r]):
+                target = sum_cells.rows[r][c]
+                if _is_number(target):
+                    picked.append(float(target))
+    if average:
+        if not picked:
+            raise FormulaError("#DIV/0!")
+        return sum(picked) / len(picked)
+    return sum(picked)
+
+
+def _mod(x, y):
+    x, y = _to_number(x), _to_number(y)
+    if y == 0:
+        raise FormulaError("#DIV/0!")
+    return x - y * math.floor(x / y)
+
+
+def _sqrt(x):
+    x = _to_number(x)
+    if x < 0:
+        raise FormulaError("#NUM!")
+    return math.sqrt(x)
+
+
+def _round_digits(x, digits, mode):
+    x, factor = _to_number(x), 10 ** int(_to_number(digits))
+    return math.copysign(mode(abs(x) * factor) / factor, x)
+
+
+def _proper(text):
+    return re.sub(r"[A-Za-z]+", lambda m: m.group(0).capitalize(), _to_text(text).lower())
+
+
+def _round_to(x, significance, mode):
+    x, significance = _to_number(x), _to_number(significance if significance is not None else 1)
+    if significance == 0:
+        return 0.0
+    return mode(x / significance) * significance
+
+
+FUNCTIONS = {
+    "SUM": lambda *a: sum(_numbers(a)),
+    "AVERAGE": _average,
+    "COUNT": lambda *a: float(sum(1 for arg in a for v in (arg.values() if isinstance(arg, RangeValue) else [arg]) if _is_number(v))),
+    "COUNTA": lambda *a: float(sum(1 for arg in a for v in (arg.values() if isinstance(arg, RangeValue) else [arg]) if v not in (None, ""))),
+    "MIN": lambda *a: min(_numbers(a), default=0.0),
+    "MAX": lambda *a: max(_numbers(a), default=0.0),
+    "PRODUCT": _product,
+    "SUBTOTAL": _subtotal,
+    "MOD": _mod,
+    "POWER": lambda x, y: _to_number(x) ** _to_number(y),
+    "ABS": lambda x: abs(_to_number(x)),
+    "INT": lambda x: float(math.floor(_to_number(x))),
+    "ROUND": lambda x, d=0.0: _round_half_away(_to_number(x), int(_to_number(d))),
+    "ROUNDUP": lambda x, d=0.0: _round_digits(x, d, math.ceil),
+    "ROUNDDOWN": lambda x, d=0.0: _round_digits(x, d, math.floor),
+    "CEILING": lambda x, s=None: _round_to(x, s, math.ceil),
+    "FLOOR": lambda x, s=None: _round_to(x, s, math.floor),
+    "SQRT": _sqrt,
+    "CONCATENATE": lambda *a: "".join(_to_text(_scalar(v)) for v in a),
+    "CONCAT": lambda *a: "".join(_to_text(v) for arg in a for v in (arg.values() if isinstance(arg, RangeValue) else [arg])),
+    "LEN": lambda t: float(len(_to_text(t))),
+    "LEFT": lambda t, n=1.0: _to_text(t)[:max(0, int(_to_number(n)))],
+    "RIGHT": lambda t, n=1.0: _to_text(t)[-int(_to_number(n)):] if int(_to_number(n)) > 0 else "",
+    "MID": _mid,
+    "REPLACE": _replace,
+    "SUBSTITUTE": _substitute,
+    "UPPER": lambda t: _to_text(t).upper(),
+    "LOWER": lambda t: _to_text(t).lower(),
+    "PROPER": _proper,
+    "TRIM": lambda t: re.sub(" +", " ", _to_text(t).strip(" ")),
+    "REPT": lambda t, n: _to_text(t) * int(_to_number(n)),
+    "EXACT": lambda a, b: _to_text(a) == _to_text(b),
+    "FIND": lambda n, h, s=None: _find(n, h, s),
+    "SEARCH": lambda n, h, s=None: _find(n, h, s, ignore_case=True),
+    "VALUE": lambda t: _to_number(t),
+    "TIME": lambda h, m, s: ((_to_number(h) * 3600 + _to_number(m) * 60 + _to_number(s)) / 86400) % 1,
+    "VLOOKUP": _vlookup,
+    "COUNTIF": _countif,
+    "SUMIF": _sumif,
+    "AVERAGEIF": lambda r, c, s=None: _sumif(r, c, s, average=True),
+    "AND": lambda *a: all(_to_bool(v) for arg in a for v in (arg.values() if isinstance(arg, RangeValue) else [arg]) if v is not None),
+    "OR": lambda *a: any(_to_bool(v) for arg in a for v in (arg.values() if isinstance(arg, RangeValue) else [arg]) if v is not None),
+    "NOT": lambda x: not _to_bool(x),
+    "ISBLANK": lambda x: x is None,
+    "ISNUMBER": lambda x: _is_number(x),
+    "ISTEXT": lambda x: isinstance(x, str),
+}
+FUNCTIONS["MODULUS"] = FUNCTIONS["MOD"]
+
+# Functions whose arguments must not all be evaluated up front
+LAZY_FUNCTIONS = ("IF", "IFERROR", "IFNA")
+
+
+class Evaluator:
+    """Evaluates formulas against a sparse map of {(column number, row): raw cell value}."""
+
+    def __init__(self, cells: dict, sheet: str = None):
+        self.cells = cells
+        self.sheet = sheet
+        self.cache = {}
+        self.evaluating = set()
+
+    def evaluate(self, formula: str):
+        """Return the value of `formula`, or the error code string if it evaluates to an error."""
+        try:
+            node = parse(formula)
+        except FormulaSyntaxError as e:
+            raise UnsupportedFormula(str(e))
+        try:
+            return _scalar(self._eval(node))
+        except FormulaError as e:
+            return e.code
+        except (ZeroDivisionError, OverflowError):
+            return "#DIV/0!"
+
+    def value_at(self, col: int, row: int):
+        key = (col, row)
+        if key in self.cache:
+            return self.cache[key]
+        raw = self.cells.get(key)
+        if isinstance(raw, str):
+            text = raw.strip()
+            if text.startswith("=") and len(text) > 1:
+                if key in self.evaluating:
+                    raise FormulaError("#REF!")
+                self.evaluating.add(key)
+                try:
+                    value = _scalar(self._eval(parse(text)))
+                except FormulaSyntaxError as e:
+                    raise UnsupportedFormula(str(e))
+                finally:
+                    self.evaluating.discard(key)
+            elif text == "":
+                value = None
+            elif text.upper() in ("TRUE", "FALSE"):
+                value = text.upper() == "TRUE"
+            else:
+                try:
+                    value = float(text)
+                except ValueError:
+                    value = raw
+        elif isinstance(raw, (int, float)) and not isinstance(raw, bool):
+            value = float(raw)
+        else:
+            value = raw
+        self.cache[key] = value
+        return value
+
+    def _check_sheet(self, ref):
+        if ref.sheet and self.sheet and ref.sheet != self.sheet:
+            raise UnsupportedFormula(f"reference to another sheet: {ref}")
+
+    def _eval(self, node):
+        kind = node.kind
+        if kind in ("number", "string", "bool"):
+            return node.value
+        if kind == "missing":
+            return None
+        if kind == "error":
+            raise FormulaError(node.value)
+        if kind == "ref":
+            self._check_sheet(node.value)
+            return self.value_at(column_to_num(node.value.col), node.value.row)
+        if kind == "range":
+            left, right = node.args
+            if left.kind != "ref" or right.kind != "ref":
+                raise UnsupportedFormula("only cell-to-cell ranges are supported")
+            self._check_sheet(left.value)
+            c1, c2 = sorted((column_to_num(left.value.col), column_to_num(right.value.col)))
+            r1, r2 = sorted((left.value.row, right.value.row))
+            return RangeValue([[self.value_at(c, r) for c in range(c1, c2 + 1)] for r in range(r1, r2 + 1)])
+        if kind == "array":
+            return RangeValue([[self._eval(item) for item in row.args] for row in node.args])
+        if kind == "unary":
+            value = _to_number(_scalar(self._eval(node.args[0])))
+            return -value if node.value == "-" else value
+        if kind == "percent":
+            return _to_number(_scalar(self._eval(node.args[0]))) / 100
+        if kind == "binop":
+            return self._binop(node.value, _scalar(self._eval(node.args[0])), _scalar(self._eval(node.args[1])))
+        if kind == "func":
+            return self._call(node.value, node.args)
+        raise UnsupportedFormula(f"unsupported expression: {kind}")
+
+    def _binop(self, op, a, b):
+        if op == "&":
+            return _to_text(a) + _to_text(b)
+        if op in ("=", "<>", "<", ">", "<=", ">="):
+            if a is None:
+                a = "" if isinstance(b, str) else 0.0
+            if b is None:
+                b = "" if isinstance(a, str) else 0.0
+            ka, kb = _compare_key(a), _compare_key(b)
+            return {"=": ka == kb, "<>": ka != kb, "<": ka < kb, ">": ka > kb, "<=": ka <= kb, ">=": ka >= kb}[op]
+        a, b = _to_number(a), _to_number(b)
+        if op == "+":
+            return a + b
+        if op == "-":
+            return a - b
+        if op == "*":
+            return a * b
+        if op == "/":
+            if b == 0:
+                raise FormulaError("#DIV/0!")
+            return a / b
+        if op == "^":
+            return a ** b
+        raise UnsupportedFormula(f"unsupported operator: {op}")
+
+    def _call(self, name, args):
+        if name in LAZY_FUNCTIONS:
+            if name == "IF":
+                condition = _to_bool(_scalar(self._eval(args[0])))
+                if condition:
+                    return self._eval(args[1]) if len(args) > 1 else True
+                return self._eval(args[2]) if len(args) > 2 else False
+            try:
+                value = _scalar(self._eval(args[0]))
+                if name == "IFNA" or not isinstance(value, str) or not value.startswith("#"):
+                    return value
+            except FormulaError as e:
+                if name == "IFNA" and e.code != "#N/A":
+                    raise
+            return self._eval(args[1]) if len(args) > 1 else ""
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise UnsupportedFormula(f"unsupported function: {name}")
+        values = [self._eval(arg) for arg in args]
+        try:
+            return function(*values)
+        except TypeError:
+            raise FormulaError("#VALUE!")
+
+
+def values_match(actual, expected) -> bool:
+    """Compare an evaluated value with an example cell, tolerating number formatting."""
+    if isinstance(actual, str) and actual.startswith("#"):
+        return isinstance(expected, str) and actual == expected.strip()
+    expected_text = _to_text(expected).strip()
+    if isinstance(actual, bool) or expected_text.upper() in ("TRUE", "FALSE"):
+        return _to_text(actual).upper() == expected_text.upper()
+    try:
+        expected_number = float(expected_text)
+    except ValueError:
+        return _to_text(actual) == expected_text
+    try:
+        actual_number = _to_number(actual)
+    except FormulaError:
+        return False
+    if math.isclose(actual_number, expected_number, rel_tol=1e-9, abs_tol=1e-9):
+        return True
+    # Examples are often typed with fewer decimals than the exact result
+    decimals = len(expected_text.split(".")[1]) if "." in expected_text and "e" not in expected_text.lower() else 0
+    return _round_half_away(actual_number, decimals) == expected_number
+
+
+def score_candidate(inputSection, outputSection, examples: list, grid: list):
+    """Evaluate `grid` against the non-empty example cells. Returns (checked, matched)."""
+    cells = {}
+    for section, data in ((inputSection, inputSection.data), (outputSection, examples)):
+        base_col, base_row = column_to_num(section.cellL.col), section.cellL.row
+        for r, row in enumerate(data or []):
+            for c, value in enumerate(row):
+                if value not in (None, ""):
+                    cells[(base_col + c, base_row + r)] = value
+    evaluator = Evaluator(cells, inputSection.sheet)
+
+    checked = matched = 0
+    for r, row in enumerate(examples or []):
+        for c, expected in enumerate(row):
+            if expected in (None, "") or r >= len(grid) or c >= len(grid[r]):
+                continue
+            candidate = grid[r][c]
+            try:
+                if isinstance(expected, str) and expected.startswith("="):
+                    expected = evaluator.evaluate(expected)
+                if isinstance(candidate, str) and candidate.startswith("="):
+                    actual = evaluator.evaluate(candidate)
+                else:
+                    actual = candidate
+            except UnsupportedFormula as e:
+                print(f"Cannot verify {candidate}: {e}")
+                continue
+            checked += 1
+            if values_match(actual, expected):
+                matched += 1
+    return checked, matched
@@ -0,0 +1,299 @@
+import re
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>\s+)
+  | (?P<string>"(?:[^"]|"")*"?)
+  | (?P<error>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))
+  | (?P<ref>(?:(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?\$?[A-Za-z]{1,3}\$?\d+(?![\w(]))
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<func>[A-Za-z_][\w.]*(?=\s*\())
+  | (?P<name>(?:(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?[A-Za-z_\\][\w.]*)
+  | (?P<op><>|<=|>=|[-+*/^&=<>%:])
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<sep>[,;])
+  | (?P<lbrace>\{)
+  | (?P<rbrace>\})
+  | (?P<other>.)
+''', re.VERBOSE)
+
+_REF_RE = re.compile(r"^(?:(?P<sheet>'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?(?P<col_abs>\$?)(?P<col>[A-Za-z]{1,3})(?P<row_abs>\$?)(?P<row>\d+)$")
+
+
+class FormulaSyntaxError(ValueError):
+    pass
+
+
+class Token:
+    __slots__ = ("type", "value", "pos")
+
+    def __init__(self, type: str, value: str, pos: int):
+        self.type, self.value, self.pos = type, value, pos
+
+    def __repr__(self):
+        return f"Token({self.type}, {self.value!r})"
+
+
+class Node:
+    """Formula AST node. `value` holds the literal/name/operator, `args` the child nodes."""
+    __slots__ = ("kind", "value", "args")
+
+    def __init__(self, kind: str, value=None, args=None):
+        self.kind, self.value, self.args = kind, value, args or []
+
+    def __repr__(self):
+        if self.args:
+            return f"Node({self.kind}, {self.value!r}, {self.args})"
+        return f"Node({self.kind}, {self.value!r})"
+
+
+class Ref:
+    __slots__ = ("sheet", "col", "row", "col_abs", "row_abs")
+
+    def __init__(self, sheet, col: str, row: int, col_abs: bool = False, row_abs: bool = False):
+        self.sheet, self.col, self.row, self.col_abs, self.row_abs = sheet, col.upper(), row, col_abs, row_abs
+
+    def __repr__(self):
+        sheet = f"{self.sheet}!" if self.sheet else ""
+        return f"{sheet}{'$' if self.col_abs else ''}{self.col}{'$' if self.row_abs else ''}{self.row}"
+
+
+def parse_ref(text: str):
+    match = _REF_RE.match(text)
+    if not match:
+        raise FormulaSyntaxError(f"Invalid reference: {text}")
+    sheet = match.group("sheet")
+    if sheet and sheet.startswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return Ref(sheet, match.group("col"), int(match.group("row")), bool(match.group("col_abs")), bool(match.group("row_abs")))
+
+
+def tokenize(formula: str):
+    """Split a formula (with or without the leading '=') into tokens in a single pass."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(formula):
+        kind = match.lastgroup
+        if kind == "ws":
+            continue
+        tokens.append(Token(kind, match.group(), match.start()))
+    return tokens
+
+
+class _Parser:
+    COMPARISON = ("=", "<>", "<", ">", "<=", ">=")
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.i += 1
+        return token
+
+    def at_op(self, *ops):
+        token = self.peek()
+        return token is not None and token.type == "op" and token.value in ops
+
+    def expect(self, type: str):
+        token = self.take()
+        if token is None or token.type != type:
+            raise FormulaSyntaxError(f"Expected {type}, got {token}")
+        return token
+
+    def parse(self):
+        node = self.comparison()
+        if self.peek() is not None:
+            raise FormulaSyntaxError(f"Unexpected token {self.peek()}")
+        return node
+
+    def binary(self, operand, ops):
+        node = operand()
+        while self.at_op(*ops):
+            op = self.take().value
+            node = Node("binop", op, [node, operand()])
+        return node
+
+    def comparison(self):
+        return self.binary(self.concat, self.COMPARISON)
+
+    def concat(self):
+        return self.binary(self.additive, ("&",))
+
+    def additive(self):
+        return self.binary(self.term, ("+", "-"))
+
+    def term(self):
+        return self.binary(self.power, ("*", "/"))
+
+    def power(self):
+        return self.binary(self.unary, ("^",))
+
+    def unary(self):
+        if self.at_op("+", "-"):
+            op = self.take().value
+            return Node("unary", op, [self.unary()])
+        return self.postfix()
+
+    def postfix(self):
+        node = self.range()
+        while self.at_op("%"):
+            self.take()
+            node = Node("percent", None, [node])
+        return node
+
+    def range(self):
+        node = self.primary()
+        while self.at_op(":"):
+            self.take()
+            node = Node("range", None, [node, self.primary()])
+        return node
+
+    def primary(self):
+        token = self.take()
+        if token is None:
+            raise FormulaSyntaxError("Unexpected end of formula")
+        if token.type == "number":
+            return Node("number", float(token.value))
+        if token.type == "string":
+            if len(token.value) < 2 or not token.value.endswith('"'):
+                raise FormulaSyntaxError("Unterminated string")
+            return Node("string", token.value[1:-1].replace('""', '"'))
+        if token.type == "error":
+            return Node("error", token.value)
+        if token.type == "ref":
+            return Node("ref", parse_ref(token.value))
+        if token.type == "name":
+            if token.value.upper() in ("TRUE", "FALSE"):
+                return Node("bool", token.value.upper() == "TRUE")
+            return Node("name", token.value)
+        if token.type == "func":
+            return self.call(token.value.upper())
+        if token.type == "lparen":
+            node = self.comparison()
+            self.expect("rparen")
+            return node
+        if token.type == "lbrace":
+            return self.array()
+        raise FormulaSyntaxError(f"Unexpected token {token}")
+
+    def call(self, name: str):
+        self.expect("lparen")
+        args = []
+        if self.peek() is not None and self.peek().type == "rparen":
+            self.take()
+            return Node("func", name, args)
+        while True:
+            token = self.peek()
+            if token is not None and token.type in ("sep", "rparen"):
+                args.append(Node("missing"))
+            else:
+                args.append(self.comparison())
+            token = self.take()
+            if token is None:
+                raise FormulaSyntaxError(f"Unclosed call to {name}")
+            if token.type == "rparen":
+                return Node("func", name, args)
+            if token.type != "sep":
+                raise FormulaSyntaxError(f"Unexpected token {token} in call to {name}")
+
+    def array(self):
+        # Excel writes {1,2;3,4}; LibreOffice with ';' separators writes {1;2|3;4}
+        libreoffice_style = False
+        for token in self.tokens[self.i:]:
+            if token.type == "rbrace":
+                break
+            if token.value == "|":
+                libreoffice_style = True
+        row_sep = "|" if libreoffice_style else ";"
+        rows, row = [], []
+        while True:
+            row.append(self.unary())
+            token = self.take()
+            if token is None:
+                raise FormulaSyntaxError("Unclosed array constant")
+            if token.type == "rbrace":
+                rows.append(row)
+                return Node("array", None, [Node("row", None, r) for r in rows])
+            if token.value == row_sep:
+                rows.append(row)
+                row = []
+            elif token.type != "sep":
+                raise FormulaSyntaxError(f"Unexpected token {token} in array constant")
+
+
+def parse(formula: str):
+    """Parse a formula into a `Node` tree. A leading '=' is optional."""
+    text = formula.strip()
+    if text.startswith("="):
+        text = text[1:]
+    return _Parser(tokenize(text)).parse()
+
+
+def _rewrite(formula: str, replace):
+    """Rebuild `formula`, substituting each token for which `replace(token)` returns a string."""
+    out, last = [], 0
+    for token in tokenize(formula):
+        new = replace(token)
+        if new is not None:
+            out.append(formula[last:token.pos])
+            out.append(new)
+            last = token.pos + len(token.value)
+    out.append(formula[last:])
+    return "".join(out)
+
+
+def to_semicolons(formula: str) -> str:
+    """Turn `,` separators into the `;` LibreOffice expects, leaving string literals and quoted
+    sheet names alone. Linear in the formula length."""
+    if "," not in formula:
+        return formula
+    if "'" not in formula:
+        # Even segments are outside string literals ("" escapes keep the parity intact)
+        parts = formula.split('"')
+        parts[::2] = [part.replace(",", ";") for part in parts[::2]]
+        return '"'.join(parts)
+    return _rewrite(formula, lambda token: ";" if token.type == "sep" and token.value == "," else None)
+
+
+class ShiftTemplate:
+    """A formula split around its relative row numbers, so fill-down copies are built without re-tokenizing."""
+    __slots__ = ("formula", "chunks", "rows", "digits")
+
+    def __init__(self, formula: str):
+        self.formula = formula
+        self.chunks, self.rows, self.digits = [], [], []
+        last = 0
+        for token in tokenize(formula):
+            if token.type != "ref":
+                continue
+            match = _REF_RE.match(token.value)
+            if match.group("row_abs"):
+                continue
+            self.chunks.append(formula[last:token.pos + match.start("row")])
+            self.digits.append(match.group("row"))
+            self.rows.append(int(match.group("row")))
+            last = token.pos + match.end("row")
+        self.chunks.append(formula[last:])
+
+    def shift(self, row_offset: int) -> str:
+        if not row_offset or not self.rows:
+            return self.formula
+        out = []
+        for chunk, row, digits in zip(self.chunks, self.rows, self.digits):
+            shifted = row + row_offset
+            out.append(chunk)
+            # A reference that would move above row 1 is left as written
+            out.append(str(shifted) if shifted >= 1 else digits)
+        out.append(self.chunks[-1])
+        return "".join(out)
+
+
+def shift_formula(formula: str, row_offset: int) -> str:
+    """Shift the relative row references of an A1 formula by `row_offset`, like a fill-down."""
+    if not row_offset:
+        return formula
+    return ShiftTemplate(formula).shift(row_offset)
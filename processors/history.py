@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import deque
+from itertools import islice
+
+
+def _compact(result, max_cells: int):
+    """Replace candidate grids larger than `max_cells` with their shape, keeping the rest of the result."""
+    if not isinstance(result, dict):
+        return result
+    compacted = dict(result)
+    for key in ("candidate", "colors"):
+        value = compacted.get(key)
+        if isinstance(value, list):
+            cells = sum(len(row) if isinstance(row, list) else 1 for row in value)
+            if cells > max_cells:
+                width = len(value[0]) if value and isinstance(value[0], list) else 1
+                compacted[key] = f"<{cells} cells omitted ({len(value)}x{width})>"
+    return compacted
+
+
+class HistoryStore:
+    """Bounded conversation history with monotonically increasing ids.
+
+    The oldest entries are evicted once `max_entries` is reached, and result grids larger than
+    `max_cells` are stored as a short placeholder instead of the full grid.
+    """
+
+    def __init__(self, max_entries: int = 200, max_cells: int = 500):
+        self.max_entries = max(1, max_entries)
+        self.max_cells = max_cells
+        self.entries = deque()
+        self.next_id = 1
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def append(self, request: str, result):
+        with self.lock:
+            entry = {"id": self.next_id, "time": time.time(), "request": request, "result": _compact(result, self.max_cells)}
+            self.next_id += 1
+            self.entries.append(entry)
+            while len(self.entries) > self.max_entries:
+                self.entries.popleft()
+                self.evicted += 1
+            return entry["id"]
+
+    @property
+    def last_id(self):
+        return self.next_id - 1
+
+    def query(self, limit: int = None, before: int = None, since_id: int = None):
+        """Entries with since_id < id < before, oldest first; `limit` keeps the newest matches."""
+        with self.lock:
+            if not self.entries:
+                return []
+            # Ids are contiguous, so positions can be computed instead of scanning
+            first_id = self.entries[0]["id"]
+            start = 0 if since_id is None else max(0, since_id + 1 - first_id)
+            end = len(self.entries) if before is None else max(0, min(len(self.entries), before - first_id))
+            if limit is not None:
+                start = max(start, end - max(0, limit))
+            return list(islice(self.entries, start, end)) if start < end else []
+
+    def etag(self, *params):
+        with self.lock:
+            first_id = self.entries[0]["id"] if self.entries else 0
+            return f'W/"{first_id}-{self.last_id}-{"-".join(str(p) for p in params)}"'
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "max_entries": self.max_entries, "last_id": self.last_id, "evicted": self.evicted}
@@ -0,0 +1,195 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's progress callback once the job has been cancelled."""
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, op: str, total_rows: int = 0):
+        self.id = uuid.uuid4().hex
+        self.op = op
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.total_rows = total_rows
+        self.done_rows = 0
+        self.blocks = []
+        self.text = []
+        self.result = None
+        self.error = None
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def on_rows(self, offset, rows):
+        if self.cancelled.is_set():
+            raise JobCancelled(self.id)
+        self.blocks.append({"offset": offset, "rows": rows})
+        # Rows can be sent again when a streamed answer is corrected, so count positions, not blocks
+        self.done_rows = max(self.done_rows, offset + len(rows))
+
+    def on_text(self, text):
+        if self.cancelled.is_set():
+            raise JobCancelled(self.id)
+        self.text.append(text)
+
+    def progress(self):
+        if self.status == DONE:
+            return 1.0
+        if self.total_rows:
+            return min(1.0, self.done_rows / self.total_rows)
+        return None
+
+    def to_dict(self, partial: bool = False):
+        now = self.finished or time.time()
+        info = {
+            "id": self.id,
+            "op": self.op,
+            "status": "cancelling" if self.status == RUNNING and self.cancelled.is_set() else self.status,
+            "progress": self.progress(),
+            "rows_done": self.done_rows,
+            "rows_total": self.total_rows,
+            "created": self.created,
+            "elapsed": round(now - (self.started or now), 3),
+        }
+        if self.status == DONE:
+            info["result"] = self.result
+        elif self.status == FAILED:
+            info["error"] = self.error
+        elif partial:
+            # Blocks and text produced so far; offsets are relative to the target range
+            info["partial"] = {"blocks": list(self.blocks), "text": "".join(self.text)}
+        return info
+
+
+class JobManager:
+    """Runs operation handlers as background jobs that outlive the HTTP request that started them.
+
+    Jobs run on a bounded pool of `max_workers` threads; at most `max_pending` may be queued or
+    running at once. Finished jobs are kept for `retention` seconds so their result can be fetched.
+    Cancelling a queued job removes it; a running job stops at its next progress report.
+    With `flights` (a SharedRuns), jobs submitted with a `key` share one run with identical
+    jobs and /stream requests already in flight.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, retention: float = 3600, flights=None):
+        self.flights = flights
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.retention = retention
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="os3m-job")
+        self.jobs = OrderedDict()
+        self.counts = {DONE: 0, FAILED: 0, CANCELLED: 0, "expired": 0}
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        for job_id in [j.id for j in self.jobs.values() if j.finished and now - j.finished > self.retention]:
+            del self.jobs[job_id]
+            self.counts["expired"] += 1
+
+    def _pending(self):
+        return sum(1 for j in self.jobs.values() if j.status in (QUEUED, RUNNING))
+
+    def submit(self, op: str, handler, msg: dict, callback: str = None, total_rows: int = 0, on_done=None,
+               key: str = None, on_shared=None):
+        """Queue `handler(msg)` and return its Job.
+
+        `callback` names the handler's progress keyword argument ("on_rows" or "on_text"), if it has one.
+        `on_done(result)` is called from the worker after the job succeeds. `key` identifies the work
+        for sharing a run; `on_shared(leader_session)` is called when another caller's run was reused.
+        """
+        job = Job(op, total_rows)
+        with self.lock:
+            self._expire(time.time())
+            if self._pending() >= self.max_pending:
+                raise JobQueueFull(f"{self.max_pending} jobs are already queued or running")
+            self.jobs[job.id] = job
+            job.future = self.pool.submit(self._run, job, handler, msg, callback, on_done, key, on_shared)
+        return job
+
+    def _run(self, job, handler, msg, callback, on_done, key=None, on_shared=None):
+        with self.lock:
+            if job.cancelled.is_set():
+                if job.status != CANCELLED:
+                    job.status, job.finished = CANCELLED, time.time()
+                    self.counts[CANCELLED] += 1
+                return
+            job.status = RUNNING
+            job.started = time.time()
+        try:
+            if key and self.flights is not None:
+                result, leader_session, shared = self.flights.call(
+                    key, lambda publish: handler(msg, **({callback: publish} if callback else {})),
+                    listener=getattr(job, callback) if callback else None,
+                    cancelled=job.cancelled, session=msg.get("sessionId"))
+                if shared and on_shared:
+                    on_shared(leader_session)
+            else:
+                result = handler(msg, **({callback: getattr(job, callback)} if callback else {}))
+            status, error = (CANCELLED, None) if job.cancelled.is_set() else (DONE, None)
+        except JobCancelled:
+            result, status, error = None, CANCELLED, None
+        except Exception as e:
+            if job.cancelled.is_set():
+                # e.g. the shared run was abandoned because this job was its last subscriber
+                result, status, error = None, CANCELLED, None
+            else:
+                print(f"Job {job.id} ({job.op}) failed: {e}")
+                result, status, error = None, FAILED, str(e)
+        with self.lock:
+            job.status, job.error, job.finished = status, error, time.time()
+            if status == DONE:
+                job.result = result
+            # The result replaces the partial blocks and text
+            job.blocks, job.text = [], []
+            self.counts[status] += 1
+        if status == DONE and on_done:
+            on_done(result)
+
+    def get(self, job_id: str):
+        with self.lock:
+            self._expire(time.time())
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """Cancel a job; returns the Job, or None when it is unknown or has expired."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job.cancelled.set()
+            if job.status == QUEUED and job.future.cancel():
+                job.status, job.finished = CANCELLED, time.time()
+                self.counts[CANCELLED] += 1
+            return job
+
+    def stats(self):
+        with self.lock:
+            self._expire(time.time())
+            statuses = [j.status for j in self.jobs.values()]
+            return {
+                "pool_size": self.max_workers,
+                "max_pending": self.max_pending,
+                "queued": statuses.count(QUEUED),
+                "running": statuses.count(RUNNING),
+                "retained": len(statuses),
+                **self.counts,
+            }
+
+    def shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancelled.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -11,10 +11,8 @@ class Context:
 
 class LLM:
     def __init__(self):
-        self.context = []
         pass
 
     def getContext(self):
-        context = Context()
-        self.context.append(context)
-        return context
+        # Contexts are owned by the caller (see ContextManager); keeping them here would grow forever
+        return Context()
@@ -1,6 +1,13 @@
 import re
 import json
 import dspy
+from processors.cache import cached_predict, cached_stream
+from processors.strategy import run_strategy
+from processors.jobs import JobCancelled
+from processors.singleflight import Abandoned
+from processors.parsing import parse_reply
+from processors.serializer import format_table
+from processors.profiler import profile_table
 
 cellPattern = re.compile(r'([A-Za-z]+)(\d+)')
 formulaList = ["SUM", "AVERAGE", "COUNT", "SUBTOTAL", "MODULUS", "POWER", "CEILING", "FLOOR", "CONCATENATE", "LEN",
@@ -71,6 +78,13 @@ class SummarizeData(dspy.Signature):
     goal = dspy.InputField()
     summary = dspy.OutputField(desc="JSON object")
 
+class SummarizeProfile(dspy.Signature):
+    """Summarize a large range based on the description, using its precomputed column profile (types, aggregates, top values, group-bys) and a small sample of rows. Output JSON: {"summary": "..."}"""
+    profile = dspy.InputField(desc="JSON column profile of the whole range")
+    sample = dspy.InputField(desc="First rows of the range")
+    goal = dspy.InputField()
+    summary = dspy.OutputField(desc="JSON object")
+
 class ExplainFormulas(dspy.Signature):
     """Explain formulas concisely based on the description. Output JSON: {"explanation": "..."}"""
     formulas = dspy.InputField()
@@ -93,6 +107,18 @@ class SelectCells(dspy.Signature):
     goal = dspy.InputField()
     colors = dspy.OutputField(desc="JSON 2D array of colors")
 
+class CompileSelection(dspy.Signature):
+    """Translate the selection criterion into one JSON predicate that is evaluated locally over every cell of the range.
+    A predicate is {"op": ..., "column": letter or null, "color": "green"|"yellow"|"red", "row": true to highlight whole rows} plus its arguments:
+    "gt"/"ge"/"lt"/"le"/"eq"/"ne" with "value"; "between" with "value" and "value2"; "contains"/"startswith"/"endswith"/"regex" with "value";
+    "top"/"bottom" with "n"; "empty"; "not_empty"; "duplicate".
+    Predicates can be combined as {"all": [...]}, {"any": [...]} or {"not": {...}}.
+    If the criterion cannot be expressed this way, output {"op": "unsupported"}."""
+    sample = dspy.InputField(desc="Column letters, headers and the first rows of the range")
+    input_range = dspy.InputField()
+    goal = dspy.InputField()
+    predicate = dspy.OutputField(desc="JSON object")
+
 class TransformData(dspy.Signature):
     """Think step by step to transform data based on the provided input data in row-major order.
     The output transformed_data should be a JSON 2D array."""
@@ -100,6 +126,21 @@ class TransformData(dspy.Signature):
     goal = dspy.InputField()
     transformed_data = dspy.OutputField(desc="JSON 2D array")
 
+class GenerateTemplateFormula(dspy.Signature):
+    """Using the input data and any output examples in row-major order, generate one formula per output column for the first data row of the output range only.
+    Think step by step.
+    Use relative A1 references so the formulas can be filled down to the remaining rows.
+    If the first row of the input data contains headers, also give a header for each output column and write the formulas for the row below the headers; otherwise leave "header" empty.
+    If feedback is provided, use it to refine the result.
+    Output JSON: {"header": [...], "formulas": [...]}"""
+    input_data = dspy.InputField(desc="Input data")
+    input_range = dspy.InputField()
+    output_range = dspy.InputField()
+    output_example = dspy.InputField(desc="Output examples, may be empty")
+    goal = dspy.InputField()
+    feedback = dspy.InputField(desc="User feedback")
+    template = dspy.OutputField(desc="JSON object with keys 'header' and 'formulas'")
+
 class CheckCompatibility(dspy.Signature):
     """Think step by step to check for formula compatibility issues (Excel/LibreOffice) based on the provided input data.
     The output issues should be a JSON object with keys "issues" and "passed"."""
@@ -121,116 +162,152 @@ class Analysis:
                 self.outputSection = getSection(msg['outputRange'], msg['outputData'])
             except ValueError:
                 pass
+        self.outputExamples = [list(row) for row in self.outputSection.data or []] if self.outputSection else []
         self.desc = msg['description']
         self.feedback = msg.get('feedbackMsg', "")
+        self.fillMode = msg.get('fillMode')
+        self.candidates = []
         pass
 
-    def run_query(self):
+    def table(self, section, signature, data=None):
+        """Prompt text for a section's cells, in the table format configured for `signature`."""
+        return format_table(section.data if data is None else data, signature.__name__,
+                            section.cellL.row, column_to_num(section.cellL.col))
+
+    def stream_formulas(self, signature, on_chunk, **inputs):
+        """Stream `signature`'s `formulas` answer through `on_chunk` with ChainOfThought; None if that fails or is empty."""
+        try:
+            pred = cached_stream(dspy.ChainOfThought, signature, "formulas", on_chunk, **inputs)
+        except (JobCancelled, Abandoned):
+            # Raised by the progress callback: nobody wants the answer, so do not generate it again
+            raise
+        except Exception as e:
+            print(f"Streaming {signature.__name__} failed, retrying without streaming: {e}")
+            return None
+        if str(pred.get("formulas") or "").strip() in ("", "[]", "{}"):
+            print(f"Streaming {signature.__name__} gave no formulas, retrying without streaming")
+            return None
+        return pred
+
+    def run_query(self, on_chunk=None):
+        goal = self.desc if self.desc else "Autofill the remaining cells based on the pattern"
+        inputs = dict(
+            input_data=self.table(self.inputSection, GenerateFormulas),
+            input_range=self.inputSection.range,
+            output_range=self.outputSection.range,
+            goal=goal,
+            feedback=self.feedback
+        )
+        pred = self.stream_formulas(GenerateFormulas, on_chunk, **inputs) if on_chunk else None
+        try:
+            pred = pred or run_strategy(GenerateFormulas, "formulas", **inputs)
+        except Exception as e:
+            print(f"Error in run_query: {e}")
+            return "[]"
+        print(pred)
+        return pred.formulas
+
+    def run_template_query(self, n: int = 1):
         goal = self.desc if self.desc else "Autofill the remaining cells based on the pattern"
+        config = {"n": n, "temperature": 0.7} if n > 1 else None
         try:
-            pred = dspy.ChainOfThought(GenerateFormulas)(
-                input_data=str(self.inputSection.data),
+            pred = run_strategy(GenerateTemplateFormula, "template", config,
+                input_data=self.table(self.inputSection, GenerateTemplateFormula),
                 input_range=self.inputSection.range,
                 output_range=self.outputSection.range,
+                output_example=self.table(self.outputSection, GenerateTemplateFormula, self.outputExamples),
                 goal=goal,
                 feedback=self.feedback
             )
-            print(pred)
-            return pred.formulas
         except Exception as e:
-            print(f"Error in run_query with ChainOfThought: {e}")
-            try:
-                pred = dspy.Predict(GenerateFormulas)(
-                    input_data=str(self.inputSection.data),
-                    input_range=self.inputSection.range,
-                    output_range=self.outputSection.range,
-                    goal=goal,
-                    feedback=self.feedback
-                )
-                print(pred)
-                return pred.formulas
-            except Exception as e2:
-                print(f"Error in run_query with Predict: {e2}")
-                return "[]"
-
-    def run_summary_query(self):
-        pred = dspy.Predict(SummarizeData)(data=str(self.inputSection.data), goal=self.desc)
+            print(f"Error in run_template_query: {e}")
+            return "{}"
+        print(pred)
+        # Backends that ignore `n` (e.g. Ollama) give a single answer
+        self.candidates = list(pred.completions.template) if pred.completions is not None else [pred.template]
+        return pred.template
+
+    def run_summary_query(self, profile: bool = False, sample_rows: int = 5, on_chunk=None):
+        if profile:
+            data = self.inputSection.data
+            stats = profile_table(data, column_to_num(self.inputSection.cellL.col))
+            pred = cached_stream(dspy.Predict, SummarizeProfile, "summary", on_chunk,
+                profile=json.dumps(stats, separators=(",", ":")),
+                sample=self.table(self.inputSection, SummarizeProfile, data[:sample_rows + 1]),
+                goal=self.desc
+            )
+            print(pred)
+            return pred.summary
+        pred = cached_stream(dspy.Predict, SummarizeData, "summary", on_chunk, data=self.table(self.inputSection, SummarizeData), goal=self.desc)
         print(pred)
         return pred.summary
 
-    def run_exp_explain_query(self):
-        pred = dspy.Predict(ExplainFormulas)(formulas=str(self.inputSection.data), goal=self.desc)
+    def run_exp_explain_query(self, on_chunk=None):
+        pred = cached_stream(dspy.Predict, ExplainFormulas, "explanation", on_chunk, formulas=self.table(self.inputSection, ExplainFormulas), goal=self.desc)
         print(pred)
         return pred.explanation
 
-    def run_formula_pbe_query(self):
+    def run_formula_pbe_query(self, n: int = 1, on_chunk=None):
+        """`on_chunk` streams the answer; it is only used with a single candidate (n == 1)."""
         goal = self.desc if self.desc else "Infer the pattern from the examples"
+        config = {"n": n, "temperature": 0.7} if n > 1 else None
+        inputs = dict(
+            input_data=self.table(self.inputSection, GenerateFormulasPBE),
+            output_example=self.table(self.outputSection, GenerateFormulasPBE, self.outputExamples),
+            output_range=self.outputSection.range,
+            goal=goal
+        )
+        pred = self.stream_formulas(GenerateFormulasPBE, on_chunk, **inputs) if on_chunk and n == 1 else None
         try:
-            pred = dspy.ChainOfThought(GenerateFormulasPBE)(
-                input_data=str(self.inputSection.data),
-                output_example=str(self.outputSection.data),
-                output_range=self.outputSection.range,
-                goal=goal
-            )
-            print(pred)
-            return pred.formulas
+            pred = pred or run_strategy(GenerateFormulasPBE, "formulas", config, **inputs)
         except Exception as e:
-            print(f"Error in run_formula_pbe_query with ChainOfThought: {e}")
-            try:
-                pred = dspy.Predict(GenerateFormulasPBE)(
-                    input_data=str(self.inputSection.data),
-                    output_example=str(self.outputSection.data),
-                    output_range=self.outputSection.range,
-                    goal=goal
-                )
-                print(pred)
-                return pred.formulas
-            except Exception as e2:
-                print(f"Error in run_formula_pbe_query with Predict: {e2}")
-                return "[]"
+            print(f"Error in run_formula_pbe_query: {e}")
+            return "[]"
+        print(pred)
+        # Backends that ignore `n` (e.g. Ollama) give a single answer
+        self.candidates = list(pred.completions.formulas) if pred.completions is not None else [pred.formulas]
+        return pred.formulas
 
     def run_range_sel_query(self):
-        pred = dspy.ChainOfThought(SelectCells)(data=str(self.inputSection.data), goal=self.desc)
+        pred = cached_predict(dspy.ChainOfThought, SelectCells, data=self.table(self.inputSection, SelectCells), goal=self.desc)
         print(pred)
         colors = pred.colors
         if isinstance(colors, str):
-            try:
-                parsed = json.loads(colors.replace("'", '"'))
+            parsed = parse_reply(colors)
+            if parsed is not None:
                 return json.dumps(parsed)
-            except Exception:
-                pass
         return colors
 
+    def run_selection_predicate_query(self, sample_rows: int = 5):
+        pred = cached_predict(dspy.Predict, CompileSelection,
+            sample=self.table(self.inputSection, CompileSelection, self.inputSection.data[:sample_rows + 1]),
+            input_range=self.inputSection.range,
+            goal=self.desc
+        )
+        print(pred)
+        return pred.predicate
+
     def run_batchproc_query(self):
         try:
-            pred = dspy.ChainOfThought(TransformData)(data=str(self.inputSection.data), goal=self.desc)
+            pred = run_strategy(TransformData, "transformed_data", data=self.table(self.inputSection, TransformData), goal=self.desc)
             print(pred)
             return pred.transformed_data
         except Exception as e:
-            print(f"Error in run_batchproc_query with ChainOfThought: {e}")
-            try:
-                pred = dspy.Predict(TransformData)(data=str(self.inputSection.data), goal=self.desc)
-                print(pred)
-                return pred.transformed_data
-            except Exception as e2:
-                print(f"Error in run_batchproc_query with Predict: {e2}")
-                return "[]"
-
-    def run_formula_chk_query(self):
-        pred = dspy.ChainOfThought(CheckCompatibility)(formulas=str(self.inputSection.data))
+            print(f"Error in run_batchproc_query: {e}")
+            return "[]"
+
+    def run_formula_chk_query(self, data=None):
+        """`data` limits the check to a copy of the input grid, e.g. with some cells blanked."""
+        pred = cached_predict(dspy.ChainOfThought, CheckCompatibility, formulas=self.table(self.inputSection, CheckCompatibility, data))
         print(pred)
         return pred.issues
 
     def run_create_visual_query(self):
         def capitalize_type(config):
             try:
-                if isinstance(config, str):
-                    try:
-                        data = json.loads(config)
-                    except json.JSONDecodeError:
-                        data = json.loads(config.replace("'", '"'))
-                else:
-                    data = config
+                data = parse_reply(config)
+                if data is None:
+                    return config
 
                 if isinstance(data, dict) and 'type' in data:
                     data['type'] = data['type'].capitalize()
@@ -242,15 +319,9 @@ class Analysis:
                 return config
 
         try:
-            pred = dspy.ChainOfThought(CreateChart)(data=str(self.inputSection.data), goal=self.desc)
+            pred = run_strategy(CreateChart, "chart_config", data=self.table(self.inputSection, CreateChart), goal=self.desc)
             print(pred)
             return capitalize_type(pred.chart_config)
         except Exception as e:
-            print(f"Error in run_create_visual_query with ChainOfThought: {e}")
-            try:
-                pred = dspy.Predict(CreateChart)(data=str(self.inputSection.data), goal=self.desc)
-                print(pred)
-                return capitalize_type(pred.chart_config)
-            except Exception as e2:
-                print(f"Error in run_create_visual_query with Predict: {e2}")
-                return "{}"
\ No newline at end of file
+            print(f"Error in run_create_visual_query: {e}")
+            return "{}"
\ No newline at end of file
@@ -1,24 +1,47 @@
+import os
 import re
-import json
-from processors.matcher import Analysis, cellPattern, formulaList
+from processors.matcher import Analysis, cellPattern, formulaList, column_to_num
+from processors.formula import ShiftTemplate, to_semicolons
 from processors.context import ContextManager
 from processors.dspy_config import setup_dspy, DSPyLLM
+from processors.tiling import split_rows, run_tiles
+from processors.jobs import JobCancelled
+from processors.singleflight import Abandoned
+from processors.streaming import PartialJsonText, PartialJsonRows
+from processors.parsing import parse_reply, coerce_grid
+from processors.compat import check_grid
+from processors.serializer import has_header
+from processors.evaluator import score_candidate
+from processors.selection import evaluate_selection, color_blocks, UnsupportedPredicate
 
 PLATFORM = "libreoffice"
 
 lm = setup_dspy()
+FILL_MODE = os.getenv("FILL_MODE", "grid")
+PBE_CANDIDATES = int(os.getenv("PBE_CANDIDATES", "3"))
+RANGESEL_MODE = os.getenv("RANGESEL_MODE", "predicate")
+SUMMARY_PROFILE_MIN_CELLS = int(os.getenv("SUMMARY_PROFILE_MIN_CELLS", "200"))
+BATCHPROC_TILE_TOKENS = int(os.getenv("BATCHPROC_TILE_TOKENS", "1500"))
+BATCHPROC_PARALLELISM = int(os.getenv("BATCHPROC_PARALLELISM", "8"))
+BATCHPROC_RETRIES = int(os.getenv("BATCHPROC_RETRIES", "2"))
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "200"))
+FORMULA_CHK_MODE = os.getenv("FORMULA_CHK_MODE", "rules")
+CONTEXT_MAX_SESSIONS = int(os.getenv("CONTEXT_MAX_SESSIONS", "256"))
+CONTEXT_TTL = float(os.getenv("CONTEXT_TTL", "3600"))
+CONTEXT_MAX_CELLS = int(os.getenv("CONTEXT_MAX_CELLS", "2000000"))
 llm = DSPyLLM(lm=lm)
-context_manager = ContextManager()
-
-def _parse_json(reply: str):
-    try:
-        clean_reply = re.sub(r'^```json\s*', '', reply, flags=re.MULTILINE)
-        clean_reply = re.sub(r'^```\s*', '', clean_reply, flags=re.MULTILINE)
-        clean_reply = re.sub(r'\s*```$', '', clean_reply, flags=re.MULTILINE)
-        return json.loads(clean_reply)
-    except Exception as e:
-        print(f"JSON Parse Error: {e} for reply: {reply}")
-        return None
+_MISSING = object()  # coerce_grid padding: leave the cell as it is
+# A function name anywhere in a cell marks its row as formula-driven
+_FUNCTION_RE = re.compile("|".join(map(re.escape, formulaList)))
+# A cell reference, or a known function call in any case
+_FORMULA_LIKE_RE = re.compile(cellPattern.pattern + "|(?:" + "|".join(map(re.escape, formulaList)) + r")\(", re.IGNORECASE)
+context_manager = ContextManager(CONTEXT_MAX_SESSIONS, CONTEXT_TTL, CONTEXT_MAX_CELLS)
+
+def _parse_json(reply: str, expect=None):
+    data = parse_reply(reply, expect)
+    if data is None and reply:
+        print(f"JSON Parse Error: no JSON value in reply: {reply}")
+    return data
 
 def _flatten_input(data):
     flat_data = []
@@ -36,48 +59,163 @@ def _flatten_input(data):
     return flat_data
 
 def apply_reply(analysis, reply: str, forceFormula: bool = False, target: str = 'output'):
-    data = _parse_json(reply)
     section = analysis.outputSection if target == 'output' else analysis.inputSection
     if section is None:
         return []
 
-    cell_contents = _flatten_input(data)
+    # Fit the reply to the section; cells the reply does not cover keep their current content
+    width = max((len(row) for row in section.data), default=0)
+    grid = coerce_grid(_parse_json(reply, list), len(section.data), width, fill=_MISSING)
+    formula_rows = _formula_rows(analysis.inputSection.data)
 
-    index = 0
     for r in range(len(section.data)):
-        for c in range(len(section.data[r])):
-            if index >= len(cell_contents):
-                break
-            
-            val = cell_contents[index]
-            content = str(val).strip() if val is not None else ""
-
-            has_formula = any(substr in cell for cell in analysis.inputSection.data[r] for substr in formulaList) if r < len(analysis.inputSection.data) else False
-            if forceFormula or has_formula:
-                if content and content[0] != '=':
-                    content = f"={content}"
-
-            section.data[r][c] = content
-            is_formula_like = False
-            if isinstance(content, str):
-                if cellPattern.search(content):
-                    is_formula_like = True
-                else:
-                    upper_content = content.upper()
-                    for f in formulaList:
-                        if f + "(" in upper_content:
-                            is_formula_like = True
-                            break
-            if (forceFormula or has_formula or is_formula_like) and isinstance(content, str) and content and not content.startswith('='):
-                content = f"={content}"
-            if isinstance(content, str) and content.startswith('=') and PLATFORM == "libreoffice":
-                content = re.sub(r',(?=(?:[^"]*"[^"]*")*[^"]*$)', ';', content)
-            section.data[r][c] = content
-            index += 1
+        force = forceFormula or (r < len(formula_rows) and formula_rows[r])
+        _apply_row(section.data[r], grid[r], force)
     return section.data
 
-def apply_formula_chk(reply: str):
+def _apply_row(row: list, reply_row: list, force: bool):
+    """Write one reply row (padded with _MISSING) into `row`, finalizing each cell."""
+    for c in range(len(row)):
+        val = reply_row[c] if c < len(reply_row) else _MISSING
+        if val is _MISSING:
+            continue
+        content = str(val).strip() if val is not None else ""
+        row[c] = _finalize_cell(content, force)
+    return row
+
+def _formula_rows(data):
+    """Per row, whether any of its cells mentions a function from `formulaList`."""
+    return [any(isinstance(cell, str) and _FUNCTION_RE.search(cell) for cell in row) for row in data]
+
+def _finalize_cell(content: str, forceFormula: bool = False):
+    if not isinstance(content, str) or not content:
+        return content
+    if not content.startswith('=') and (forceFormula or _FORMULA_LIKE_RE.search(content)):
+        content = f"={content}"
+    if content.startswith('=') and PLATFORM == "libreoffice":
+        content = to_semicolons(content)
+    return content
+
+def apply_template(analysis, reply: str):
+    """Fill the whole output section from one template formula per column by shifting its row references."""
     data = _parse_json(reply)
+    section = analysis.outputSection
+    if section is None:
+        return []
+
+    header, formulas = [], []
+    if isinstance(data, dict):
+        header = _flatten_input(data.get("header") or [])
+        formulas = _flatten_input(data.get("formulas") or [])
+    elif isinstance(data, list):
+        formulas = _flatten_input(data)
+
+    templates = []
+    for c in range(section.width):
+        val = formulas[c] if c < len(formulas) else None
+        content = str(val).strip() if val is not None else ""
+        templates.append(ShiftTemplate(_finalize_cell(content, True) if content else ""))
+
+    # The template is written for the first data row, i.e. below the header when there is one
+    anchor_row = section.cellL.row + (1 if header else 0)
+    grid = []
+    for r in range(section.height):
+        sheet_row = section.cellL.row + r
+        if header and r == 0:
+            grid.append([str(header[c]) if c < len(header) else "" for c in range(section.width)])
+        else:
+            grid.append([t.shift(sheet_row - anchor_row) for t in templates])
+    section.data = grid
+    return grid
+
+def select_candidate(analysis, apply):
+    """Apply each sampled reply and keep the first grid that reproduces the output examples locally."""
+    examples = analysis.outputExamples
+    if not analysis.candidates:
+        grid = apply(analysis, "[]")
+        return grid, {"candidates": 0, "checked": 0, "matched": 0, "verified": False}
+
+    best_grid, best_score, best_counts, tried = None, -1.0, (0, 0), 0
+    for reply in analysis.candidates:
+        tried += 1
+        analysis.outputSection.data = [list(row) for row in examples]
+        grid = apply(analysis, reply)
+        checked, matched = score_candidate(analysis.inputSection, analysis.outputSection, examples, grid)
+        print(f"Candidate {tried}: {matched}/{checked} examples reproduced")
+        score = matched / checked if checked else 0.0
+        if score > best_score:
+            best_grid, best_score, best_counts = grid, score, (checked, matched)
+        if checked and matched == checked:
+            break
+
+    analysis.outputSection.data = best_grid
+    checked, matched = best_counts
+    return best_grid, {
+        "candidates": tried,
+        "checked": checked,
+        "matched": matched,
+        "verified": bool(checked) and matched == checked,
+    }
+
+def _emit_rows(grid, on_rows, sent=()):
+    """Hand a finished grid to a streaming caller in blocks of up to STREAM_CHUNK_ROWS rows.
+
+    Rows already streamed unchanged (`sent`, indexed like `grid`) are skipped; rows the final
+    answer changed, e.g. after a fallback call, are sent again.
+    """
+    if not on_rows:
+        return
+    start = None
+    for r in range(len(grid) + 1):
+        pending = r < len(grid) and (r >= len(sent) or sent[r] != grid[r])
+        if pending and start is None:
+            start = r
+        if start is not None and (not pending or r - start == STREAM_CHUNK_ROWS):
+            on_rows(start, grid[start:r])
+            start = r if pending else None
+
+def _row_stream(analysis, on_rows):
+    """Chunk callback that applies each row of the streamed JSON 2D answer as soon as it is complete
+    and passes it to `on_rows`, plus the list of rows sent so far; (None, []) without `on_rows`.
+
+    Rows are applied to copies of the output rows, so the final `apply_reply` still starts from the
+    original section.
+    """
+    sent = []
+    if not on_rows:
+        return None, sent
+    section = analysis.outputSection
+    formula_rows = _formula_rows(analysis.inputSection.data)
+    extractor = PartialJsonRows()
+
+    def on_chunk(chunk):
+        for reply_row in extractor.feed(chunk):
+            r = len(sent)
+            if r >= len(section.data):
+                return
+            force = r < len(formula_rows) and formula_rows[r]
+            row = _apply_row(list(section.data[r]), reply_row, force)
+            sent.append(row)
+            on_rows(r, [row])
+    return on_chunk, sent
+
+def _text_stream(key, on_text):
+    """Chunk callback that decodes the streamed JSON answer's `key` and passes new text to `on_text`."""
+    if not on_text:
+        return None
+    extractor = PartialJsonText(key)
+
+    def on_chunk(chunk):
+        text = extractor.feed(chunk)
+        if text:
+            on_text(text)
+    return on_chunk
+
+def _use_template(analysis):
+    return (analysis.fillMode or FILL_MODE) == "template"
+
+def apply_formula_chk(reply: str):
+    data = _parse_json(reply, dict)
     warns = []
     passes = []
     if data and isinstance(data, dict):
@@ -87,7 +225,7 @@ def apply_formula_chk(reply: str):
     return warns, passes
 
 def apply_create_visual(reply: str):
-    data = _parse_json(reply)
+    data = _parse_json(reply, dict)
     title = "Chart"
     cType = "Line"
     if data and isinstance(data, dict):
@@ -103,24 +241,30 @@ def apply_colors(reply: str):
     return [str(c).strip().lower() for c in flat_data]
 
 def apply_summary(reply: str):
-    data = _parse_json(reply)
+    data = _parse_json(reply, dict)
     if data and isinstance(data, dict):
         return data.get("summary", reply)
     return reply
 
 def apply_explanation(reply: str):
-    data = _parse_json(reply)
+    data = _parse_json(reply, dict)
     if data and isinstance(data, dict):
         return data.get("explanation", reply)
     return reply
 
-def handle_autofill(msg):
+def handle_autofill(msg, on_rows=None):
     analysis = Analysis(msg)
     context = llm.getContext()
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
-    reply = analysis.run_query()
-    cell_candidate = apply_reply(analysis, reply)
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
+    if _use_template(analysis):
+        reply = analysis.run_template_query()
+        cell_candidate = apply_template(analysis, reply)
+        _emit_rows(cell_candidate, on_rows)
+    else:
+        on_chunk, sent = _row_stream(analysis, on_rows)
+        reply = analysis.run_query(on_chunk)
+        cell_candidate = apply_reply(analysis, reply)
+        _emit_rows(cell_candidate, on_rows, sent)
     
     reply = {
         "status": "ok",
@@ -132,8 +276,7 @@ def handle_autofill(msg):
     return reply
 
 def handle_feedback(msg):
-    context = context_manager.get_last_context()
-    analysis = context_manager.get_last_analysis()
+    context, analysis = context_manager.get_last(msg.get("sessionId"))
     if not context or not analysis:
         return {
             "status": "error",
@@ -149,9 +292,14 @@ def handle_feedback(msg):
 
     try:
         analysis.feedback = msg["feedbackMsg"]
-        reply = analysis.run_query()
-        print(reply)
-        cell_candidate = apply_reply(analysis, reply)
+        if _use_template(analysis):
+            reply = analysis.run_template_query()
+            print(reply)
+            cell_candidate = apply_template(analysis, reply)
+        else:
+            reply = analysis.run_query()
+            print(reply)
+            cell_candidate = apply_reply(analysis, reply)
 
         reply = {
             "status": "ok",
@@ -171,24 +319,39 @@ def handle_feedback(msg):
 def handle_rangesel(msg):
     analysis = Analysis(msg)
     context = llm.getContext()
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
-    reply = analysis.run_range_sel_query()
-    colors = apply_colors(reply)
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
+    colors = None
+    if RANGESEL_MODE == "predicate":
+        predicate = _parse_json(analysis.run_selection_predicate_query(), dict)
+        try:
+            section = analysis.inputSection
+            colors, selected = evaluate_selection(predicate, section.data, column_to_num(section.cellL.col))
+            print(f"Predicate {predicate} selected {selected} cells")
+        except UnsupportedPredicate as e:
+            print(f"Falling back to per-cell selection: {e}")
+    if colors is None:
+        reply = analysis.run_range_sel_query()
+        colors = apply_colors(reply)
+    section = analysis.inputSection
+    colors = colors[:section.width * section.height]
+    blocks = color_blocks(colors, section.width)
     reply = {
         "status": "ok",
-        "range": analysis.inputSection.range,
+        "range": section.range,
+        "blocks": blocks,
+        "counts": {color: sum(b[2] * b[3] for b in rects) for color, rects in blocks.items()},
+        # Deprecated: the flat per-cell list read by extension 0.0.8 and earlier; kept for one release
         "colors": colors,
     }
     print(reply)
     return reply
 
-def handle_summary(msg):
+def handle_summary(msg, on_text=None):
     analysis = Analysis(msg)
     context = llm.getContext()
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
-    reply = analysis.run_summary_query()
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
+    cells = sum(len(row) for row in analysis.inputSection.data)
+    reply = analysis.run_summary_query(profile=cells >= SUMMARY_PROFILE_MIN_CELLS, on_chunk=_text_stream("summary", on_text))
     summary_text = apply_summary(reply)
     reply = {
         "status": "ok",
@@ -198,13 +361,12 @@ def handle_summary(msg):
     print(reply)
     return reply
 
-def handle_formula_exp(msg):
+def handle_formula_exp(msg, on_text=None):
     print(f"DEBUG: handle_formula_exp received msg: {msg}")
     analysis = Analysis(msg)
     context = llm.getContext()
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
-    reply = analysis.run_exp_explain_query()
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
+    reply = analysis.run_exp_explain_query(on_chunk=_text_stream("explanation", on_text))
     explanation_text = apply_explanation(reply)
     reply = {
         "status": "ok",
@@ -214,38 +376,86 @@ def handle_formula_exp(msg):
     print(reply)
     return reply
 
-def handle_batchproc(msg):
+def _same_row(row, other):
+    if not isinstance(row, list):
+        return False
+    return [str(v).strip().lower() for v in row] == [str(v).strip().lower() for v in other]
+
+def handle_batchproc(msg, on_rows=None):
     analysis = Analysis(msg)
     context = llm.getContext()
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
-    reply = analysis.run_batchproc_query()
-    cell_candidate = apply_reply(analysis, reply, target='input')
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
+    section = analysis.inputSection
+
+    # Later tiles repeat the header row so the model keeps the column names
+    header = list(section.data[0]) if has_header(section.data) else None
+
+    def process_tile(offset, rows):
+        repeat = header is not None and offset > 0
+        prompt_rows = [header] + [list(row) for row in rows] if repeat else [list(row) for row in rows]
+        first_row = section.cellL.row + offset - repeat
+        tile = Analysis({
+            "inputRange": f"{section.sheet}!{section.cellL.col}{first_row}:{section.cellR.col}{first_row + len(prompt_rows) - 1}",
+            "inputData": prompt_rows,
+            "description": analysis.desc,
+        })
+        data = _parse_json(tile.run_batchproc_query(), list)
+        if not _flatten_input(data):
+            raise ValueError("reply contained no cells")
+        if repeat and isinstance(data, list) and len(data) == len(rows) and not _same_row(data[0], header):
+            data = [header] + data  # answered without the header row
+        width = max((len(row) for row in prompt_rows), default=0)
+        grid = coerce_grid(data, len(prompt_rows), width, fill=_MISSING)
+        # A row is incomplete when the reply leaves out a cell that has content
+        incomplete = sum(
+            any(val is _MISSING and prompt_rows[r][c] not in ("", None) for c, val in enumerate(grid[r]))
+            for r in range(repeat, len(prompt_rows))
+        )
+        if incomplete:
+            raise ValueError(f"reply left {incomplete} of {len(rows)} rows incomplete")
+        result = apply_reply(tile, grid, target='input')
+        return result[1:] if repeat else result
+
+    tiles = split_rows(section.data, BATCHPROC_TILE_TOKENS)
+    print(f"Batch processing {len(section.data)} rows in {len(tiles)} tile(s)")
+    cell_candidate, failed_rows = run_tiles(tiles, process_tile, BATCHPROC_PARALLELISM, BATCHPROC_RETRIES, on_tile=on_rows)
+    section.data = cell_candidate
     reply = {
         "status": "ok",
-        "range": analysis.inputSection.range,
+        "range": section.range,
         "candidate": cell_candidate,
+        "failed_rows": failed_rows,
     }
     print(reply)
     return reply
 
-def handle_formula_pbe(msg):
+def handle_formula_pbe(msg, on_rows=None):
     try:
         analysis = Analysis(msg)
         context = llm.getContext()
-        context_manager.set_last_context(context)
-        context_manager.set_last_analysis(analysis)
-        reply = analysis.run_formula_pbe_query()
-        cell_candidate = apply_reply(analysis, reply)
+        context_manager.set_last(msg.get("sessionId"), context, analysis)
+        if _use_template(analysis):
+            analysis.run_template_query(PBE_CANDIDATES)
+            cell_candidate, verification = select_candidate(analysis, apply_template)
+            _emit_rows(cell_candidate, on_rows)
+        else:
+            # A single candidate needs no selection, so its rows can stream as they are generated
+            on_chunk, sent = _row_stream(analysis, on_rows) if PBE_CANDIDATES == 1 else (None, [])
+            analysis.run_formula_pbe_query(PBE_CANDIDATES, on_chunk)
+            cell_candidate, verification = select_candidate(analysis, apply_reply)
+            _emit_rows(cell_candidate, on_rows, sent)
 
         reply = {
             "status": "ok",
             "range": analysis.outputSection.range,
             "candidate": cell_candidate,
+            "verification": verification,
         }
 
         print(reply)
         return reply
+    except (JobCancelled, Abandoned):
+        raise
     except Exception as e:
         print(f"Exception in handle_formula_pbe: {e}")
         return {
@@ -256,8 +466,7 @@ def handle_formula_pbe(msg):
 def handle_create_visual(msg):
     context = llm.getContext()
     analysis = Analysis(msg)
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
     reply = analysis.run_create_visual_query()
     title, type = apply_create_visual(reply)
     reply = {
@@ -273,19 +482,30 @@ def handle_create_visual(msg):
 def handle_formula_chk(msg):
     context = llm.getContext()
     analysis = Analysis(msg)
-    context_manager.set_last_context(context)
-    context_manager.set_last_analysis(analysis)
-    reply = analysis.run_formula_chk_query()
-    warns, passes = apply_formula_chk(reply)
+    context_manager.set_last(msg.get("sessionId"), context, analysis)
     infos = []
-    for warn in warns:
-        infos.append({"intent": "warning", "info": warn})
-    for pass_ in passes:
-        infos.append({"intent": "success", "info": pass_})
-    if not infos:
-        infos.append({"intent": "info", "info": reply})
-    print(reply)
-    infos.append({"intent": "info", "info": "No issues found."})
+    section = analysis.inputSection
+    data = None
+    if FORMULA_CHK_MODE == "rules":
+        findings, unclassified, count = check_grid(section.data, section.cellL.row, column_to_num(section.cellL.col))
+        for cell, intent, message in findings:
+            infos.append({"intent": intent, "info": f"{cell}: {message}"})
+        print(f"Formula check: {count} formulas, {len(findings)} findings, {len(unclassified)} left for the model")
+        # Only the formulas the rules could not classify go to the model
+        keep = set(unclassified)
+        data = [[value if (r, c) in keep else "" for c, value in enumerate(row)] for r, row in enumerate(section.data)]
+        infos.append({"intent": "info", "info": f"Checked {count - len(unclassified)} of {count} formulas locally."})
+
+    if data is None or any(value for row in data for value in row):
+        reply = analysis.run_formula_chk_query(data)
+        print(reply)
+        warns, passes = apply_formula_chk(reply)
+        for warn in warns:
+            infos.append({"intent": "warning", "info": warn})
+        if not warns and not passes and data is None:
+            infos.append({"intent": "info", "info": reply})
+    if not any(info["intent"] == "warning" for info in infos):
+        infos.append({"intent": "success", "info": "No compatibility issues found."})
     reply = {
         "type": "formula_chk",
         "status": "ok",
@@ -0,0 +1,237 @@
+import re
+import json
+
+_decoder = json.JSONDecoder()
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+
+
+class _Truncated(Exception):
+    """The reply ended inside a value."""
+
+
+class _Parser:
+    """Recursive-descent reader for JSON as models write it.
+
+    Besides strict JSON it accepts single-quoted strings, Python literals (True/False/None),
+    trailing commas, tuples, unquoted words, and input that stops part-way through an array or
+    object, in which case the complete elements read so far are kept.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def _skip(self):
+        text, pos = self.text, self.pos
+        while pos < len(text) and text[pos] in " \t\r\n":
+            pos += 1
+        self.pos = pos
+
+    def value(self, key: bool = False):
+        self._skip()
+        if self.pos >= len(self.text):
+            raise _Truncated()
+        c = self.text[self.pos]
+        if c in "[(":
+            return self.array()
+        if c == "{":
+            return self.obj()
+        if c in "\"'":
+            return self.string(c)
+        return self.bare(key)
+
+    def array(self):
+        self.pos += 1
+        items = []
+        while True:
+            self._skip()
+            if self.pos >= len(self.text):
+                raise _Truncated(items)
+            if self.text[self.pos] in "])":
+                self.pos += 1
+                return items
+            try:
+                items.append(self.value())
+            except _Truncated as e:
+                # Keep a partial nested container (e.g. a cut-off last row), drop a partial scalar
+                if e.args and e.args[0]:
+                    items.append(e.args[0])
+                raise _Truncated(items)
+            self._skip()
+            if self.pos < len(self.text) and self.text[self.pos] == ",":
+                self.pos += 1
+
+    def obj(self):
+        self.pos += 1
+        result = {}
+        while True:
+            self._skip()
+            if self.pos >= len(self.text):
+                raise _Truncated(result)
+            if self.text[self.pos] == "}":
+                self.pos += 1
+                return result
+            key = None
+            try:
+                key = str(self.value(key=True))
+                self._skip()
+                if self.pos < len(self.text) and self.text[self.pos] == ":":
+                    self.pos += 1
+                result[key] = self.value()
+            except _Truncated as e:
+                if key is not None and e.args and e.args[0]:
+                    result[key] = e.args[0]
+                raise _Truncated(result)
+            self._skip()
+            if self.pos < len(self.text) and self.text[self.pos] == ",":
+                self.pos += 1
+
+    def string(self, quote):
+        text, pos = self.text, self.pos + 1
+        out = []
+        while pos < len(text):
+            c = text[pos]
+            if c == quote and (quote == '"' or self._closes(pos + 1)):
+                self.pos = pos + 1
+                return "".join(out)
+            if c == "\\" and pos + 1 < len(text):
+                escape = text[pos + 1]
+                if escape == "u" and pos + 6 <= len(text):
+                    try:
+                        out.append(chr(int(text[pos + 2:pos + 6], 16)))
+                        pos += 6
+                        continue
+                    except ValueError:
+                        pass
+                out.append(_ESCAPES.get(escape, "\\" + escape))
+                pos += 2
+                continue
+            out.append(c)
+            pos += 1
+        raise _Truncated()
+
+    def _closes(self, pos: int) -> bool:
+        """Whether a `'` just before `pos` ends the string; otherwise it is an apostrophe (O'Brien)."""
+        text = self.text
+        while pos < len(text) and text[pos] in " \t\r\n":
+            pos += 1
+        return pos >= len(text) or text[pos] in ",])}:"
+
+    def bare(self, key: bool = False):
+        """An unquoted number, literal or word, e.g. SUM(A1,B1); ends at a delimiter outside parentheses."""
+        text, start = self.text, self.pos
+        pos, depth = start, 0
+        while pos < len(text):
+            c = text[pos]
+            if c == "(":
+                depth += 1
+            elif depth and c == ")":
+                depth -= 1
+            elif c in ",]})\n" or (key and c == ":"):
+                if not depth or c in "\n]}":
+                    break
+            pos += 1
+        self.pos = pos
+        word = text[start:pos].strip()
+        if pos >= len(text) and not key:
+            raise _Truncated()
+        if word in _LITERALS:
+            return _LITERALS[word]
+        try:
+            return int(word)
+        except ValueError:
+            pass
+        try:
+            return float(word)
+        except ValueError:
+            return word
+
+
+_BRACKET_RE = re.compile(r"[\[{]")
+_FENCE_RE = re.compile(r"```[\w-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+
+
+def _decode_at(text: str, start: int):
+    """(value, end, strict) for the value starting at `start`, or None when nothing parses there."""
+    try:
+        value, end = _decoder.raw_decode(text, start)
+        return value, end, True
+    except ValueError:
+        pass
+    parser = _Parser(text)
+    parser.pos = start
+    try:
+        return parser.value(), parser.pos, False
+    except _Truncated as e:
+        return (e.args[0], len(text), False) if e.args else None
+    except RecursionError:
+        return None
+
+
+def _nested(value) -> bool:
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and any(isinstance(v, (list, dict)) for v in value)
+
+
+def parse_reply(reply, expect=None):
+    """Best-effort parse of a model's JSON answer; None when it holds no array or object.
+
+    Every top-level `[`/`{` value in the reply is a candidate, so brackets in surrounding prose
+    (e.g. "use range [A1:B2]") do not hide the answer. The best candidate is of the `expect`ed
+    type (list or dict) if given, then inside a code fence, then valid JSON, then nested, then
+    the longest. A truncated answer yields the complete elements that precede the cut. Strict
+    JSON is decoded by the json module; anything else goes through the tolerant parser.
+    """
+    if not isinstance(reply, str):
+        return reply
+    fences = [m.span(1) for m in _FENCE_RE.finditer(reply)]
+    best, best_rank = None, None
+    pos = 0
+    while True:
+        match = _BRACKET_RE.search(reply, pos)
+        if match is None:
+            break
+        start = match.start()
+        decoded = _decode_at(reply, start)
+        if decoded is None or decoded[0] is None:
+            pos = start + 1
+            continue
+        value, end, strict = decoded
+        rank = (
+            expect is not None and isinstance(value, expect),
+            any(a <= start < b for a, b in fences),
+            strict,
+            _nested(value),
+            end - start,
+        )
+        if best_rank is None or rank > best_rank:
+            best, best_rank = value, rank
+        # Values nested in this one are not candidates of their own
+        pos = max(end, start + 1)
+    return best
+def coerce_grid(data, height: int, width: int, fill=None):
+    """Fit parsed reply data to a `height` x `width` grid, padding with `fill` and trimming the excess.
+
+    Accepts a dict holding the grid (its first list value), a 2D list (rows are aligned; a
+    transposed grid is turned back), a flat list (filled row by row) or a single value.
+    """
+    if isinstance(data, dict):
+        data = next((v for v in data.values() if isinstance(v, list)), None)
+    if data is None:
+        return [[fill] * width for _ in range(height)]
+    if not isinstance(data, list):
+        data = [data]
+    if data and all(isinstance(row, list) for row in data):
+        rows = [list(row) for row in data]
+        if len(rows) == width != height and all(len(row) == height for row in rows):
+            rows = [list(col) for col in zip(*rows)]
+    else:
+        flat = [cell for item in data for cell in (item if isinstance(item, list) else [item])]
+        rows = [flat[i:i + width] for i in range(0, len(flat), max(1, width))]
+    grid = []
+    for r in range(height):
+        row = rows[r] if r < len(rows) else []
+        grid.append([row[c] if c < len(row) else fill for c in range(width)])
+    return grid
@@ -0,0 +1,95 @@
+import re
+import numpy as np
+from processors.serializer import has_header, num_to_column
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def _to_float(value) -> float:
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip().replace(",", "")
+    if text.endswith("%"):
+        text = text[:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _round(x):
+    x = float(x)
+    if not np.isfinite(x):
+        return None
+    return float(f"{x:.6g}")
+
+
+def profile_table(rows: list, first_col: int = 1, top_k: int = 5, max_groups: int = 12):
+    """Compact statistical profile of a range: column types, aggregates, top values and group-bys."""
+    rows = rows or []
+    width = max((len(row) for row in rows), default=0)
+    header = has_header(rows)
+    names = []
+    for c in range(width):
+        letter = num_to_column(first_col + c)
+        label = str(rows[0][c]).strip() if header and c < len(rows[0]) else ""
+        names.append(f"{letter} {label}".strip())
+    body = rows[1:] if header else rows
+
+    n = len(body)
+    grid = np.empty((n, width), dtype=object)
+    grid[:] = ""
+    for r, row in enumerate(body):
+        grid[r, :len(row)] = ["" if v is None else str(v).strip() for v in row]
+
+    profile = {"rows": n, "columns": []}
+    numeric, categorical = {}, {}
+    for c in range(width):
+        text = grid[:, c].astype(str)
+        present = text != ""
+        count = int(present.sum())
+        values = np.fromiter((_to_float(v) for v in text), dtype=float, count=n)
+        is_num = ~np.isnan(values)
+        column = {"name": names[c], "count": count, "missing": n - count}
+
+        if count and is_num.sum() >= 0.8 * count:
+            nums = values[is_num]
+            q25, q50, q75 = np.percentile(nums, [25, 50, 75])
+            column.update(
+                type="number", sum=_round(nums.sum()), mean=_round(nums.mean()), std=_round(nums.std()),
+                min=_round(nums.min()), p25=_round(q25), median=_round(q50), p75=_round(q75), max=_round(nums.max()),
+            )
+            if len(nums) > 2:
+                slope = np.polyfit(np.nonzero(is_num)[0].astype(float), nums, 1)[0]
+                column["trend_per_row"] = _round(slope)
+            numeric[c] = values
+        elif count:
+            labels, counts = np.unique(text[present], return_counts=True)
+            order = np.argsort(-counts, kind="stable")[:top_k]
+            column.update(type="text", unique=int(len(labels)), top=[[str(labels[i]), int(counts[i])] for i in order])
+            if all(_DATE_RE.match(v) for v in labels[:top_k]):
+                column.update(type="date", first=str(labels[0]), last=str(labels[-1]))
+            if 1 < len(labels) <= max_groups:
+                categorical[c] = text
+        else:
+            column["type"] = "empty"
+        profile["columns"].append(column)
+
+    group_bys = []
+    for g, keys in list(categorical.items())[:3]:
+        labels, inverse = np.unique(keys, return_inverse=True)
+        for m, values in list(numeric.items())[:3]:
+            valid = ~np.isnan(values)
+            sums = np.bincount(inverse[valid], weights=values[valid], minlength=len(labels))
+            counts = np.bincount(inverse[valid], minlength=len(labels))
+            group_bys.append({
+                "by": names[g],
+                "value": names[m],
+                "groups": {str(labels[i]) or "(blank)": {"sum": _round(sums[i]), "mean": _round(sums[i] / counts[i]) if counts[i] else None}
+                           for i in range(len(labels))},
+            })
+    if group_bys:
+        profile["group_by"] = group_bys
+    return profile
@@ -0,0 +1,175 @@
+import re
+import numpy as np
+from processors.serializer import has_header
+from processors.matcher import column_to_num
+
+COLORS = ("green", "yellow", "red")
+
+
+class UnsupportedPredicate(ValueError):
+    pass
+
+
+def _to_float(value) -> float:
+    text = "" if value is None else str(value).strip().replace(",", "")
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _number(value):
+    number = _to_float(value)
+    if np.isnan(number):
+        raise UnsupportedPredicate(f"expected a number, got {value!r}")
+    return number
+
+
+class Grid:
+    """Text and numeric views of a range, built once and shared by every predicate node."""
+
+    def __init__(self, data: list, first_col: int = 1):
+        self.height = len(data)
+        self.width = max((len(row) for row in data), default=0)
+        self.first_col = first_col
+        self.text = np.full((self.height, self.width), "", dtype=object)
+        for r, row in enumerate(data):
+            self.text[r, :len(row)] = ["" if v is None else str(v).strip() for v in row]
+        self.text = self.text.astype(str)
+        self.lower = np.char.lower(self.text)
+        self.numbers = np.vectorize(_to_float, otypes=[float])(self.text) if self.text.size else np.zeros((self.height, self.width))
+        self.body = np.ones((self.height, self.width), dtype=bool)
+        if has_header(data):
+            self.body[0, :] = False
+
+    def scope(self, column):
+        """Boolean mask of the cells a predicate applies to: one column or the whole range."""
+        mask = self.body.copy()
+        if column:
+            index = column_to_num(str(column).strip()) - self.first_col
+            if not 0 <= index < self.width:
+                raise UnsupportedPredicate(f"column {column} is outside the range")
+            mask[:, [c for c in range(self.width) if c != index]] = False
+        return mask
+
+
+def _compare(grid, op, value):
+    number = _to_float(value)
+    if op in ("eq", "ne") and np.isnan(number):
+        result = grid.lower == str(value).strip().lower()
+        return result if op == "eq" else ~result
+    number = _number(value)
+    with np.errstate(invalid="ignore"):
+        result = {
+            "gt": grid.numbers > number, "ge": grid.numbers >= number,
+            "lt": grid.numbers < number, "le": grid.numbers <= number,
+            "eq": grid.numbers == number, "ne": grid.numbers != number,
+        }[op]
+    if op == "ne":
+        result &= ~np.isnan(grid.numbers)
+    return result
+
+
+def _evaluate(grid, predicate):
+    if not isinstance(predicate, dict):
+        raise UnsupportedPredicate(f"predicate must be an object, got {predicate!r}")
+    if "all" in predicate or "any" in predicate:
+        parts = [_evaluate(grid, p) for p in predicate.get("all") or predicate.get("any") or []]
+        if not parts:
+            raise UnsupportedPredicate("empty combination")
+        return np.logical_and.reduce(parts) if "all" in predicate else np.logical_or.reduce(parts)
+    if "not" in predicate:
+        return grid.body & ~_evaluate(grid, predicate["not"])
+
+    op = str(predicate.get("op", "")).lower()
+    scope = grid.scope(predicate.get("column"))
+    value = predicate.get("value")
+    if op in ("gt", "ge", "lt", "le", "eq", "ne"):
+        mask = _compare(grid, op, value)
+    elif op == "between":
+        low, high = sorted((_number(value), _number(predicate.get("value2"))))
+        with np.errstate(invalid="ignore"):
+            mask = (grid.numbers >= low) & (grid.numbers <= high)
+    elif op in ("contains", "startswith", "endswith"):
+        needle = str(value).lower()
+        if op == "contains":
+            mask = np.char.find(grid.lower, needle) >= 0
+        elif op == "startswith":
+            mask = np.char.startswith(grid.lower, needle)
+        else:
+            mask = np.char.endswith(grid.lower, needle)
+    elif op == "regex":
+        try:
+            pattern = re.compile(str(value), re.IGNORECASE)
+        except re.error as e:
+            raise UnsupportedPredicate(f"invalid regex: {e}")
+        mask = np.vectorize(lambda v: bool(pattern.search(v)), otypes=[bool])(grid.text) if grid.text.size else np.zeros_like(scope)
+    elif op in ("top", "bottom"):
+        n = int(_number(predicate.get("n", value or 1)))
+        candidates = np.where(scope & ~np.isnan(grid.numbers), grid.numbers, np.nan)
+        valid = candidates[~np.isnan(candidates)]
+        if n <= 0 or valid.size == 0:
+            mask = np.zeros_like(scope)
+        elif op == "top":
+            mask = candidates >= np.sort(valid)[-min(n, valid.size)]
+        else:
+            mask = candidates <= np.sort(valid)[min(n, valid.size) - 1]
+    elif op in ("empty", "not_empty"):
+        mask = grid.text == ""
+        if op == "not_empty":
+            mask = ~mask
+    elif op == "duplicate":
+        labels, inverse, counts = np.unique(np.where(scope, grid.lower, ""), return_inverse=True, return_counts=True)
+        mask = (counts[inverse].reshape(scope.shape) > 1) & (grid.lower != "")
+    else:
+        raise UnsupportedPredicate(f"unsupported op: {op or predicate}")
+
+    mask = mask & scope
+    if predicate.get("row"):
+        mask = np.repeat(mask.any(axis=1, keepdims=True), grid.width, axis=1) & grid.body
+    return mask
+
+
+def evaluate_selection(predicate: dict, data: list, first_col: int = 1):
+    """Evaluate a compiled selection predicate over `data`.
+
+    Returns the row-major list of cell colors and the number of selected cells.
+    """
+    grid = Grid(data, first_col)
+    mask = _evaluate(grid, predicate)
+    color = str(predicate.get("color", "green")).lower()
+    if color not in COLORS:
+        color = "green"
+    colors = np.where(mask, color, "white")
+    return [str(c) for c in colors.ravel()], int(mask.sum())
+
+
+def color_blocks(colors: list, width: int):
+    """Encode a row-major list of cell colors as rectangles per color.
+
+    Runs of one color on a row are merged with an identical run on the row above, so a
+    column or block of one color becomes a single `[row, col, height, width]` entry.
+    Unknown colors are treated as white.
+    """
+    blocks = {}
+    if width <= 0:
+        return blocks
+    open_runs = {}
+    for r in range(0, (len(colors) + width - 1) // width):
+        row = [c if c in COLORS else "white" for c in colors[r * width:(r + 1) * width]]
+        still_open = {}
+        start = 0
+        for c in range(1, len(row) + 1):
+            if c < len(row) and row[c] == row[start]:
+                continue
+            key = (start, c, row[start])
+            block = open_runs.get(key)
+            if block is not None:
+                block[2] += 1
+            else:
+                block = [r, start, 1, c - start]
+                blocks.setdefault(row[start], []).append(block)
+            still_open[key] = block
+            start = c
+        open_runs = still_open
+    return blocks
@@ -0,0 +1,147 @@
+import io
+import os
+import re
+import csv
+import threading
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+FORMATS = ("repr", "csv", "tsv", "markdown")
+_WORD_RE = re.compile(r"\w+|[^\w ]")
+
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when installed, otherwise a words-plus-punctuation approximation."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(_WORD_RE.findall(text))
+
+
+def num_to_column(num: int) -> str:
+    col = ""
+    while num > 0:
+        num, rem = divmod(num - 1, 26)
+        col = chr(ord('A') + rem) + col
+    return col
+
+
+def _cell(value) -> str:
+    return "" if value is None else str(value)
+
+
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _trim(row: list) -> list:
+    cells = [_cell(v) for v in row]
+    while cells and cells[-1] == "":
+        cells.pop()
+    return cells
+
+
+def has_header(rows: list) -> bool:
+    """True when the first row is all text labels and some later row holds numbers."""
+    if len(rows) < 2 or not rows[0]:
+        return False
+    first = [_cell(v).strip() for v in _trim(rows[0])]
+    if not first or any(not v or _is_number(v) or v.startswith("=") for v in first):
+        return False
+    return any(_is_number(_cell(v).strip()) for row in rows[1:] for v in row)
+
+
+def serialize_table(data: list, fmt: str = "tsv", first_row: int = 1, first_col: int = 1, row_indices: bool = False):
+    """Render a 2D list for a prompt.
+
+    `repr` is the Python list repr used historically. `csv`/`tsv` emit one line per row with
+    trailing empty cells elided. `markdown` emits a table with A1 column letters and sheet row
+    numbers, using the first row as column titles when it looks like a header. `row_indices`
+    prefixes csv/tsv rows with their sheet row number.
+    """
+    rows = data or []
+    if fmt == "repr":
+        return str(rows)
+
+    if fmt in ("csv", "tsv"):
+        out = io.StringIO()
+        writer = csv.writer(out, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+        for r, row in enumerate(rows):
+            cells = _trim(row)
+            writer.writerow([str(first_row + r)] + cells if row_indices else cells)
+        text = out.getvalue()
+        # Only the final line break goes: trailing empty rows keep their lines so the shape is preserved
+        return text[:-1] if text.endswith("\n") else text
+
+    if fmt == "markdown":
+        width = max((len(row) for row in rows), default=0)
+        columns = [num_to_column(first_col + c) for c in range(width)]
+        body = rows
+        if has_header(rows):
+            columns = [f"{col} {_cell(rows[0][c]) if c < len(rows[0]) else ''}".strip() for c, col in enumerate(columns)]
+            body = rows[1:]
+            first_row += 1
+        lines = ["| # | " + " | ".join(columns) + " |", "|---" * (width + 1) + "|"]
+        for r, row in enumerate(body):
+            cells = [_cell(row[c]).replace("|", "\\|").replace("\n", " ") if c < len(row) else "" for c in range(width)]
+            lines.append(f"| {first_row + r} | " + " | ".join(cells) + " |")
+        return "\n".join(lines)
+
+    raise ValueError(f"Unknown table format: {fmt}")
+
+
+class SerializerStats:
+    """Prompt token counts per signature, for the configured format and for the `repr` baseline."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_signature = {}
+
+    def record(self, signature: str, fmt: str, baseline: int = None, tokens: int = None):
+        """Count a call; token counts are only given when TABLE_TOKEN_STATS is on."""
+        with self.lock:
+            stats = self.by_signature.setdefault(signature, {"format": fmt, "calls": 0, "baseline_tokens": 0, "tokens": 0})
+            stats["format"] = fmt
+            stats["calls"] += 1
+            if baseline is not None:
+                stats["baseline_tokens"] += baseline
+                stats["tokens"] += tokens
+
+    def stats(self):
+        with self.lock:
+            result = {}
+            for name, s in self.by_signature.items():
+                saved = s["baseline_tokens"] - s["tokens"]
+                result[name] = dict(s, saved_ratio=round(saved / s["baseline_tokens"], 4) if s["baseline_tokens"] else 0.0)
+            return result
+
+
+serializer_stats = SerializerStats()
+
+
+def table_format(signature: str) -> str:
+    fmt = os.getenv(f"TABLE_FORMAT_{signature.upper()}") or os.getenv("TABLE_FORMAT", "tsv")
+    return fmt if fmt in FORMATS else "repr"
+
+
+def format_table(data: list, signature: str, first_row: int = 1, first_col: int = 1) -> str:
+    """Serialize `data` for `signature` in its configured format, recording the token savings when TABLE_TOKEN_STATS is on."""
+    fmt = table_format(signature)
+    row_indices = os.getenv("TABLE_ROW_INDICES", "off").lower() in ("1", "on", "true", "yes")
+    text = serialize_table(data, fmt, first_row, first_col, row_indices)
+    if os.getenv("TABLE_TOKEN_STATS", "off").lower() not in ("1", "on", "true", "yes"):
+        # Tokenizing the repr baseline costs as much as the prompt itself; only do it for metrics
+        serializer_stats.record(signature, fmt)
+        return text
+    baseline = count_tokens(str(data or []))
+    tokens = baseline if fmt == "repr" else count_tokens(text)
+    serializer_stats.record(signature, fmt, baseline, tokens)
+    print(f"{signature} table: {baseline} -> {tokens} tokens ({fmt})")
+    return text
@@ -0,0 +1,186 @@
+import json
+import asyncio
+import hashlib
+import threading
+import itertools
+
+# Fields that identify the caller rather than the work, left out of the key
+IGNORED_FIELDS = ("sessionId",)
+
+
+def request_key(op: str, msg: dict) -> str:
+    """Operation plus a hash of the canonical request payload."""
+    payload = json.dumps({k: v for k, v in msg.items() if k not in IGNORED_FIELDS},
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return f"{op}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """Coalesces concurrent identical requests onto one in-flight call.
+
+    The first caller for a key starts `fn()` as a task; callers arriving before it finishes await
+    the same task and get the same result (or exception). The task is shielded, so one caller
+    disconnecting does not cancel the work for the others.
+    """
+
+    def __init__(self):
+        self.inflight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, fn):
+        """Returns (result, shared); `shared` is True when another caller's call was reused."""
+        task = self.inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+            self.started += 1
+        return await asyncio.shield(task), shared
+
+    def stats(self):
+        total = self.started + self.coalesced
+        return {
+            "in_flight": len(self.inflight),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
+
+
+class Abandoned(Exception):
+    """Every subscriber of a shared run has left, or a waiting subscriber was cancelled."""
+
+
+class SharedRun:
+    """One in-flight handler call whose progress updates are replayed to every subscriber.
+
+    Updates are the argument tuples of the handler's progress callback. A subscriber joining late
+    first receives the updates published so far, then the new ones as they come.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self.lock = threading.Lock()
+        self.updates = []
+        self.listeners = {}
+        self.tokens = itertools.count()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def subscribe(self, listener=None, on_finish=None):
+        """Register `listener(*update)` and `on_finish()`; returns a token for `unsubscribe`."""
+        with self.lock:
+            token = next(self.tokens)
+            self.listeners[token] = (listener, on_finish)
+            if listener is not None:
+                for update in self.updates:
+                    if not self._notify(token, listener, update):
+                        break
+            if self.done.is_set() and on_finish is not None:
+                on_finish()
+            return token
+
+    def unsubscribe(self, token):
+        with self.lock:
+            self.listeners.pop(token, None)
+
+    def _notify(self, token, listener, update):
+        try:
+            listener(*update)
+            return True
+        except Exception:
+            # e.g. a cancelled job's callback; that subscriber stops listening, the run goes on
+            self.listeners.pop(token, None)
+            return False
+
+    def publish(self, *update):
+        """Progress callback for the handler; raises Abandoned once nobody is listening."""
+        with self.lock:
+            self.updates.append(update)
+            for token, (listener, _) in list(self.listeners.items()):
+                if listener is not None:
+                    self._notify(token, listener, update)
+            if not self.listeners:
+                raise Abandoned("no subscriber is waiting for this result")
+
+    def finish(self, result=None, error=None):
+        with self.lock:
+            self.result, self.error = result, error
+            self.done.set()
+            for _, on_finish in self.listeners.values():
+                if on_finish is not None:
+                    on_finish()
+
+
+class SharedRuns:
+    """Single-flight for calls that report progress (the /stream routes and jobs).
+
+    The first caller for a key runs the handler with `SharedRun.publish` as its progress callback;
+    identical calls arriving before it finishes subscribe to the same run instead of starting
+    their own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key: str, session=None, listener=None, on_finish=None):
+        """(run, token, leader); the leader must then call `execute`."""
+        with self.lock:
+            run = self.runs.get(key)
+            leader = run is None or run.done.is_set()
+            if leader:
+                run = SharedRun(session)
+                self.runs[key] = run
+                self.started += 1
+            else:
+                self.coalesced += 1
+        return run, run.subscribe(listener, on_finish), leader
+
+    def execute(self, key: str, run: SharedRun, fn):
+        """Leader side: run `fn(run.publish)` and hand its result or exception to every subscriber."""
+        try:
+            run.finish(result=fn(run.publish))
+        except Exception as e:
+            run.finish(error=e)
+        finally:
+            with self.lock:
+                if self.runs.get(key) is run:
+                    del self.runs[key]
+
+    def call(self, key: str, fn, listener=None, cancelled=None, session=None):
+        """Blocking join-or-run from a worker thread; returns (result, leader_session, shared).
+
+        `cancelled` is a threading.Event; a subscriber waiting on another caller's run raises
+        Abandoned once it is set.
+        """
+        run, token, leader = self.join(key, session, listener)
+        try:
+            if leader:
+                self.execute(key, run, fn)
+            else:
+                while not run.done.wait(0.2):
+                    if cancelled is not None and cancelled.is_set():
+                        raise Abandoned("cancelled while waiting for a shared run")
+        finally:
+            run.unsubscribe(token)
+        if run.error is not None:
+            raise run.error
+        return run.result, run.session, not leader
+
+    def stats(self):
+        with self.lock:
+            total = self.started + self.coalesced
+            return {
+                "in_flight": len(self.runs),
+                "started": self.started,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+            }
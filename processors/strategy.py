@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import dspy
+from dotenv import load_dotenv
+from processors.cache import cached_predict, is_cached
+
+STRATEGIES = ("predict", "cot", "cot_deadline", "hedged", "auto")
+
+load_dotenv()
+STRATEGY_DELAY = float(os.getenv("STRATEGY_DELAY", "15"))
+STRATEGY_PERCENTILE = float(os.getenv("STRATEGY_PERCENTILE", "90"))
+STRATEGY_MIN_SAMPLES = int(os.getenv("STRATEGY_MIN_SAMPLES", "20"))
+STRATEGY_MIN_COT_SUCCESS = float(os.getenv("STRATEGY_MIN_COT_SUCCESS", "0.5"))
+STRATEGY_PROBE_EVERY = int(os.getenv("STRATEGY_PROBE_EVERY", "10"))
+
+_MODULES = {"cot": dspy.ChainOfThought, "predict": dspy.Predict}
+_pool = ThreadPoolExecutor(max_workers=int(os.getenv("STRATEGY_POOL_SIZE", "32")), thread_name_prefix="os3m-strategy")
+
+
+class LatencyTracker:
+    """Recent latencies and success counts per (signature, module)."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hedges = {}
+        self.counts = {}
+
+    def _entry(self, signature: str, module: str):
+        return self.entries.setdefault((signature, module), {
+            "latencies": deque(maxlen=self.window), "outcomes": deque(maxlen=self.window), "ok": 0, "failed": 0, "wins": 0,
+        })
+
+    def record(self, signature: str, module: str, latency: float, ok: bool):
+        with self.lock:
+            entry = self._entry(signature, module)
+            entry["ok" if ok else "failed"] += 1
+            entry["outcomes"].append(ok)
+            if ok:
+                entry["latencies"].append(latency)
+
+    def win(self, signature: str, module: str):
+        with self.lock:
+            self._entry(signature, module)["wins"] += 1
+
+    def hedged(self, signature: str):
+        with self.lock:
+            self.hedges[signature] = self.hedges.get(signature, 0) + 1
+
+    def percentile(self, signature: str, module: str, q: float):
+        """q-th percentile of successful latencies, or None with fewer than STRATEGY_MIN_SAMPLES samples."""
+        with self.lock:
+            samples = sorted(self.entries.get((signature, module), {}).get("latencies", ()))
+        if len(samples) < max(1, STRATEGY_MIN_SAMPLES):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def success_rate(self, signature: str, module: str):
+        """Share of recent attempts that gave a valid answer, or None with too few samples."""
+        with self.lock:
+            outcomes = self.entries.get((signature, module), {}).get("outcomes", ())
+            if len(outcomes) < max(1, STRATEGY_MIN_SAMPLES):
+                return None
+            return sum(outcomes) / len(outcomes)
+
+    def calls(self, signature: str) -> int:
+        with self.lock:
+            self.counts[signature] = self.counts.get(signature, 0) + 1
+            return self.counts[signature]
+
+    def stats(self):
+        with self.lock:
+            result = {}
+            for (signature, module), entry in self.entries.items():
+                samples = sorted(entry["latencies"])
+                total = entry["ok"] + entry["failed"]
+                result.setdefault(signature, {"strategy": strategy_for(signature), "hedges": self.hedges.get(signature, 0)})[module] = {
+                    "ok": entry["ok"],
+                    "failed": entry["failed"],
+                    "wins": entry["wins"],
+                    "success_rate": round(entry["ok"] / total, 4) if total else 0.0,
+                    "p50_s": round(samples[len(samples) // 2], 3) if samples else None,
+                    "p90_s": round(samples[min(len(samples) - 1, int(len(samples) * 0.9))], 3) if samples else None,
+                }
+            return result
+
+
+latency_tracker = LatencyTracker()
+
+
+def strategy_for(signature: str) -> str:
+    # "cot" is the original ChainOfThought-then-Predict flow; hedging doubles the load on serial
+    # backends (e.g. Ollama on CPU), so it is opt-in
+    strategy = os.getenv(f"STRATEGY_{signature.upper()}") or os.getenv("STRATEGY", "cot")
+    return strategy if strategy in STRATEGIES else "cot"
+
+
+def _nonempty(value) -> bool:
+    return value is not None and str(value).strip() not in ("", "[]", "{}")
+
+
+def _attempt(kind, signature, field, config, valid, inputs):
+    """(prediction, None) for a valid answer, else (None, exception); records the latency."""
+    started = time.perf_counter()
+    try:
+        pred = cached_predict(_MODULES[kind], signature, config, **inputs)
+        if not valid(pred.get(field)):
+            raise ValueError(f"{signature.__name__} returned an unusable {field}")
+        latency_tracker.record(signature.__name__, kind, time.perf_counter() - started, True)
+        return pred, None
+    except Exception as e:
+        print(f"{signature.__name__} with {kind} failed: {e}")
+        latency_tracker.record(signature.__name__, kind, time.perf_counter() - started, False)
+        return None, e
+
+
+def _submit(kind, signature, field, config, valid, inputs):
+    # Carry the caller's dspy.context() overrides into the worker thread
+    return _pool.submit(contextvars.copy_context().run, _attempt, kind, signature, field, config, valid, inputs)
+
+
+def _race(signature, field, config, valid, inputs, delay, abandon):
+    """ChainOfThought first, Predict once CoT fails or has run for `delay` seconds (None: no limit).
+
+    Returns the first valid answer. With `abandon`, a CoT answer arriving after the delay is
+    ignored (it still warms the cache).
+    """
+    name = signature.__name__
+    pending = {_submit("cot", signature, field, config, valid, inputs): "cot"}
+    deadline = None if delay is None else time.perf_counter() + delay
+    hedge_started = False
+    error = None
+    while pending:
+        timeout = None if hedge_started or deadline is None else max(0.0, deadline - time.perf_counter())
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            print(f"{name} ChainOfThought passed {delay:.1f}s, starting Predict")
+            latency_tracker.hedged(name)
+            if abandon:
+                pending.clear()
+            pending[_submit("predict", signature, field, config, valid, inputs)] = "predict"
+            hedge_started = True
+            continue
+        for future in done:
+            kind = pending.pop(future)
+            pred, error = future.result()
+            if pred is not None:
+                latency_tracker.win(name, kind)
+                return pred
+            if kind == "cot" and not hedge_started:
+                pending[_submit("predict", signature, field, config, valid, inputs)] = "predict"
+                hedge_started = True
+    raise error
+
+
+def run_strategy(signature, field: str, config: dict = None, valid=None, **inputs):
+    """Prediction for `signature` using its configured strategy (STRATEGY / STRATEGY_<SIGNATURE>).
+
+    - predict: dspy.Predict only.
+    - cot (default): ChainOfThought, then Predict if it fails.
+    - cot_deadline: ChainOfThought, switching to Predict once it exceeds the deadline.
+    - hedged: ChainOfThought, also starting Predict once it exceeds the deadline; first valid answer wins.
+    - auto: hedged, or predict when ChainOfThought's recent success rate is below STRATEGY_MIN_COT_SUCCESS.
+
+    The deadline is the STRATEGY_PERCENTILE-th percentile of observed ChainOfThought latency for the
+    signature, or STRATEGY_DELAY seconds until enough samples exist. An answer is valid when
+    `valid(pred.<field>)` holds (by default: not empty). Raises the last error when every attempt fails.
+    """
+    valid = valid or _nonempty
+    name = signature.__name__
+    strategy = strategy_for(name)
+    if strategy == "auto":
+        rate = latency_tracker.success_rate(name, "cot")
+        # Every STRATEGY_PROBE_EVERY-th call still tries ChainOfThought so a recovered model is noticed
+        probe = latency_tracker.calls(name) % max(1, STRATEGY_PROBE_EVERY) == 0
+        strategy = "predict" if rate is not None and rate < STRATEGY_MIN_COT_SUCCESS and not probe else "hedged"
+    if strategy != "predict" and is_cached(dspy.ChainOfThought, signature, config, **inputs):
+        strategy = "cot"
+    if strategy == "predict":
+        pred, error = _attempt("predict", signature, field, config, valid, inputs)
+        if pred is None:
+            raise error
+        return pred
+    if strategy == "cot":
+        return _race(signature, field, config, valid, inputs, None, False)
+    delay = latency_tracker.percentile(name, "cot", STRATEGY_PERCENTILE) or STRATEGY_DELAY
+    return _race(signature, field, config, valid, inputs, delay, strategy == "cot_deadline")
@@ -0,0 +1,135 @@
+import re
+from processors.parsing import parse_reply
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class PartialJsonText:
+    """Incrementally decode the string value of `key` from a JSON object that is still being generated.
+
+    `feed(chunk)` returns the newly decoded text. Answers that are not a JSON object (after an
+    optional code fence) are passed through as plain text.
+    """
+
+    def __init__(self, key: str):
+        self.buffer = ""
+        self.mode = None
+        self.key_re = re.compile(r'"%s"\s*:\s*"' % re.escape(key))
+        self.pos = 0
+        self.closed = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.mode is None:
+            start = self._content_start()
+            if start is None:
+                return ""
+            if self.buffer.startswith("{", start):
+                match = self.key_re.search(self.buffer, start)
+                if not match:
+                    return ""
+                self.mode, self.pos = "json", match.end()
+            else:
+                self.mode, self.pos = "text", start
+        if self.mode == "text":
+            text, self.pos = self.buffer[self.pos:], len(self.buffer)
+            return text
+        return self._decode()
+
+    def _content_start(self):
+        """Index of the answer's first character past whitespace and an opening code fence, once known."""
+        start = len(self.buffer) - len(self.buffer.lstrip())
+        rest = self.buffer[start:]
+        if rest.startswith("```"):
+            newline = rest.find("\n")
+            if newline < 0:
+                return None
+            start += newline + 1
+            start += len(self.buffer[start:]) - len(self.buffer[start:].lstrip())
+        elif "```".startswith(rest):
+            return None
+        return start if start < len(self.buffer) else None
+
+    def _decode(self) -> str:
+        out = []
+        buffer, i = self.buffer, self.pos
+        while i < len(buffer) and not self.closed:
+            c = buffer[i]
+            if c == '"':
+                self.closed = True
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape == "u":
+                if i + 6 > len(buffer):
+                    break
+                try:
+                    out.append(chr(int(buffer[i + 2:i + 6], 16)))
+                except ValueError:
+                    out.append(buffer[i:i + 6])
+                i += 6
+                continue
+            out.append(_ESCAPES.get(escape, escape))
+            i += 2
+        self.pos = i
+        return "".join(out)
+
+
+class PartialJsonRows:
+    """Incrementally pick the rows of a JSON 2D array that is still being generated.
+
+    `feed(chunk)` returns the rows (as lists) whose closing `]` arrived with this chunk. Text
+    before the outer array, such as a code fence or an enclosing object, is skipped; strings
+    are tracked so brackets inside cell text do not count.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.quote = None
+        self.row_start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        rows = []
+        buffer, i = self.buffer, self.pos
+        while i < len(buffer) and not self.done:
+            c = buffer[i]
+            if self.quote:
+                if c == "\\":
+                    if i + 1 >= len(buffer):
+                        break
+                    i += 1
+                elif c == self.quote:
+                    if c == "'":
+                        # As in parse_reply, a ' followed by more text is an apostrophe (O'Brien)
+                        rest = buffer[i + 1:].lstrip()
+                        if not rest:
+                            break  # wait for the next chunk to decide
+                        if rest[0] in ",])}:":
+                            self.quote = None
+                    else:
+                        self.quote = None
+            elif c == '"' or (c == "'" and self.depth >= 2):
+                self.quote = c
+            elif c == "[":
+                self.depth += 1
+                if self.depth == 2:
+                    self.row_start = i
+            elif c == "]" and self.depth:
+                if self.depth == 2:
+                    row = parse_reply(buffer[self.row_start:i + 1])
+                    if isinstance(row, list):
+                        rows.append(row)
+                self.depth -= 1
+                self.done = self.depth == 0
+            i += 1
+        self.pos = i
+        return rows
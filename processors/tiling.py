@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for the BPE vocabularies we target
+    return max(1, len(text) // 4)
+
+
+def split_rows(rows: list, token_budget: int):
+    """Split `rows` into consecutive (offset, rows) tiles whose prompt size fits `token_budget`."""
+    tiles = []
+    start, current, used = 0, [], 0
+    for i, row in enumerate(rows):
+        cost = estimate_tokens(str(row))
+        if current and used + cost > token_budget:
+            tiles.append((start, current))
+            start, current, used = i, [], 0
+        current.append(row)
+        used += cost
+    if current or not tiles:
+        tiles.append((start, current))
+    return tiles
+
+
+def run_tiles(tiles: list, process, max_workers: int = 8, retries: int = 2, on_tile=None):
+    """Run `process(offset, rows)` over every tile with bounded parallelism.
+
+    `process` must return a list with one output row per input row, or raise. A failing tile is
+    retried by bisecting it, which shrinks the prompt and also sidesteps cached bad answers;
+    rows that still fail are passed through unchanged and counted. Results are returned in input
+    order and, if given, `on_tile(offset, rows)` is called from the caller's thread as each tile
+    completes in order.
+    """
+    def attempt(offset, rows, depth):
+        try:
+            result = process(offset, rows)
+            if len(result) != len(rows):
+                raise ValueError(f"tile at row {offset} returned {len(result)} rows, expected {len(rows)}")
+            return result, 0
+        except Exception as e:
+            print(f"Tile at row {offset} ({len(rows)} rows) failed: {e}")
+            if depth >= retries:
+                return [list(r) for r in rows], len(rows)
+            if len(rows) == 1:
+                return attempt(offset, rows, depth + 1)
+            mid = len(rows) // 2
+            left, left_failed = attempt(offset, rows[:mid], depth + 1)
+            right, right_failed = attempt(offset + mid, rows[mid:], depth + 1)
+            return left + right, left_failed + right_failed
+
+    output = []
+    failed_rows = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="os3m-tile") as pool:
+        futures = [pool.submit(attempt, offset, rows, 0) for offset, rows in tiles]
+        try:
+            for (offset, _), future in zip(tiles, futures):
+                rows, tile_failed = future.result()
+                failed_rows += tile_failed
+                output.extend(rows)
+                if on_tile:
+                    on_tile(offset, rows)
+        except BaseException:
+            # on_tile may raise to stop early (e.g. a cancelled job); skip the tiles not yet started
+            for future in futures:
+                future.cancel()
+            raise
+    return output, failed_rows
@@ -0,0 +1,114 @@
+import os
+import json
+import base64
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    print("orjson is not installed; API responses are encoded with the slower standard json module")
+
+GRID_FIELDS = ("inputData", "outputData")
+
+load_dotenv()
+# Sparse and columnar grids declare their size; these bound what a small payload can make us allocate
+MAX_GRID_ROWS = int(os.getenv("MAX_GRID_ROWS", "1048576"))
+MAX_GRID_COLS = int(os.getenv("MAX_GRID_COLS", "16384"))
+MAX_GRID_CELLS = int(os.getenv("MAX_GRID_CELLS", "10000000"))
+
+
+class GridTooLarge(ValueError):
+    """A sparse or columnar grid declares more rows, columns or cells than allowed."""
+
+
+def _check_shape(rows: int, cols: int):
+    if rows < 0 or cols < 0:
+        raise ValueError(f"negative grid size {rows}x{cols}")
+    if rows > MAX_GRID_ROWS or cols > MAX_GRID_COLS or rows * cols > MAX_GRID_CELLS:
+        raise GridTooLarge(f"{rows}x{cols} grid exceeds the limit of {MAX_GRID_ROWS} rows, "
+                           f"{MAX_GRID_COLS} columns and {MAX_GRID_CELLS} cells")
+
+
+def _cell(value):
+    return "" if value is None else value
+
+
+def encode_sparse(data: list):
+    """Coordinate list of the non-empty cells: {"format": "sparse", "rows", "cols", "cells": [[r, c, v], ...]}."""
+    cols = max((len(row) for row in data), default=0)
+    cells = [[r, c, v] for r, row in enumerate(data) for c, v in enumerate(row) if _cell(v) != ""]
+    return {"format": "sparse", "rows": len(data), "cols": cols, "cells": cells}
+
+
+def encode_columns(data: list):
+    """Per-column arrays of the non-empty values, with an LSB-first base64 bitmap of which rows they fill."""
+    rows = len(data)
+    cols = max((len(row) for row in data), default=0)
+    columns = []
+    for c in range(cols):
+        mask = bytearray((rows + 7) // 8)
+        values = []
+        for r, row in enumerate(data):
+            if c < len(row) and _cell(row[c]) != "":
+                mask[r >> 3] |= 1 << (r & 7)
+                values.append(row[c])
+        columns.append({"mask": base64.b64encode(bytes(mask)).decode("ascii"), "values": values})
+    return {"format": "columns", "rows": rows, "cols": cols, "columns": columns}
+
+
+def decode_grid(value):
+    """Dense 2D list for a grid sent dense, sparse or columnar. Missing cells become ""."""
+    if not isinstance(value, dict):
+        return value
+    fmt = value.get("format")
+    rows, cols = int(value.get("rows", 0)), int(value.get("cols", 0))
+    if fmt == "sparse":
+        _check_shape(rows, cols)
+        grid = [[""] * cols for _ in range(rows)]
+        for r, c, v in value.get("cells", []):
+            if not (0 <= r < rows and 0 <= c < cols):
+                raise ValueError(f"sparse cell ({r}, {c}) is outside a {rows}x{cols} grid")
+            grid[r][c] = _cell(v)
+        return grid
+    if fmt == "columns":
+        columns = value.get("columns", [])
+        cols = max(cols, len(columns))
+        _check_shape(rows, cols)
+        grid = [[""] * cols for _ in range(rows)]
+        for c, column in enumerate(columns):
+            mask = base64.b64decode(column.get("mask", ""))
+            values = iter(column.get("values", []))
+            for r in range(min(rows, len(mask) * 8)):
+                if mask[r >> 3] >> (r & 7) & 1:
+                    grid[r][c] = _cell(next(values, ""))
+        return grid
+    raise ValueError(f"Unknown grid format: {fmt}")
+
+
+def decode_request(msg: dict):
+    """Expand any sparse or columnar grids in a request dict in place."""
+    for field in GRID_FIELDS:
+        if msg.get(field) is not None:
+            try:
+                msg[field] = decode_grid(msg[field])
+            except GridTooLarge as e:
+                raise HTTPException(status_code=422, detail=f"Invalid {field}: {e}")
+            except (ValueError, TypeError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid {field}: {e}")
+    return msg
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when installed, otherwise compact stdlib json."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
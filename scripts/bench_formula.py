@@ -0,0 +1,133 @@
+"""Time the formula post-processing of large candidate grids against the previous implementation.
+
+Covers apply_reply on a reply grid (formula detection plus `,` to `;` conversion), separator
+conversion alone, and filling a template formula down the grid (shift_formula).
+
+    python scripts/bench_formula.py --rows 10000 --cols 10
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from processors.matcher import Analysis, cellPattern, formulaList  # noqa: E402
+from processors.formula import ShiftTemplate, to_semicolons  # noqa: E402
+from processors.operations import apply_reply  # noqa: E402
+
+# Previous implementations, kept here as the baseline
+_refPattern = re.compile(r'(?<![A-Za-z0-9_.$])(\$?)([A-Za-z]{1,3})(\$?)(\d+)(?![A-Za-z0-9_(])')
+
+
+def baseline_separators(content):
+    return re.sub(r',(?=(?:[^"]*"[^"]*")*[^"]*$)', ';', content)
+
+
+def baseline_finalize(content, forceFormula=False):
+    is_formula_like = False
+    if cellPattern.search(content):
+        is_formula_like = True
+    else:
+        upper_content = content.upper()
+        for f in formulaList:
+            if f + "(" in upper_content:
+                is_formula_like = True
+                break
+    if (forceFormula or is_formula_like) and content and not content.startswith('='):
+        content = f"={content}"
+    if content.startswith('='):
+        content = baseline_separators(content)
+    return content
+
+
+def baseline_apply_reply(analysis, reply):
+    section = analysis.outputSection
+    clean_reply = re.sub(r'^```json\s*', '', reply, flags=re.MULTILINE)
+    clean_reply = re.sub(r'^```\s*', '', clean_reply, flags=re.MULTILINE)
+    clean_reply = re.sub(r'\s*```$', '', clean_reply, flags=re.MULTILINE)
+    cell_contents = [cell for row in json.loads(clean_reply) for cell in row]
+    index = 0
+    for r in range(len(section.data)):
+        for c in range(len(section.data[r])):
+            if index >= len(cell_contents):
+                break
+            content = str(cell_contents[index]).strip()
+            has_formula = any(substr in cell for cell in analysis.inputSection.data[r] for substr in formulaList) if r < len(analysis.inputSection.data) else False
+            if has_formula and content and content[0] != '=':
+                content = f"={content}"
+            section.data[r][c] = baseline_finalize(content, has_formula)
+            index += 1
+    return section.data
+
+
+def baseline_shift(formula, row_offset):
+    def shift(match):
+        if match.group(3):
+            return match.group(0)
+        row = int(match.group(4)) + row_offset
+        return match.group(0) if row < 1 else f"{match.group(1)}{match.group(2)}{row}"
+    parts = formula.split('"')
+    for i in range(0, len(parts), 2):
+        parts[i] = _refPattern.sub(shift, parts[i])
+    return '"'.join(parts)
+
+
+def make_reply(rows, cols, seed=0):
+    rng = random.Random(seed)
+    pool = ['=IF(A{r}>0,"yes, sure",B{r})', '=SUM(A{r}:C{r})', '=VLOOKUP(A{r},$F$1:$G$100,2,0)',
+            '=A{r}*$B$1', 'text {r}', '{r}', '=CONCATENATE(A{r},", ",B{r})']
+    return [[rng.choice(pool).format(r=r + 1) for _ in range(cols)] for r in range(rows)]
+
+
+def make_analysis(rows, cols):
+    last = chr(ord("A") + cols - 1)
+    inputs = [[f"=SUM(A{r + 1}:B{r + 1})" if r % 2 else str(r) for _ in range(cols)] for r in range(rows)]
+    return Analysis({
+        "inputRange": f"Sheet1!A1:{last}{rows}",
+        "inputData": inputs,
+        "outputRange": f"Sheet2!A1:{last}{rows}",
+        "outputData": [[""] * cols for _ in range(rows)],
+        "description": "bench",
+    })
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    grid = make_reply(args.rows, args.cols)
+    reply = json.dumps(grid)
+    cells = [cell for row in grid for cell in row]
+    analysis = make_analysis(args.rows, args.cols)
+    template = '=IF(A2>0,B2*$C$1,"none, yet")&Sheet2!D2'
+
+    print(f"{args.rows}x{args.cols} grid ({args.rows * args.cols} cells), best of {args.repeat}")
+    print(f"{'step':<24} {'previous ms':>12} {'current ms':>12}")
+    rows = [
+        ("apply_reply", lambda: baseline_apply_reply(analysis, reply), lambda: apply_reply(analysis, reply)),
+        ("separators", lambda: [baseline_separators(c) for c in cells], lambda: [to_semicolons(c) for c in cells]),
+        ("fill-down template", lambda: [baseline_shift(template, r) for r in range(len(cells))],
+         lambda: [t.shift(r) for t in [ShiftTemplate(template)] for r in range(len(cells))]),
+    ]
+    for name, before, after in rows:
+        print(f"{name:<24} {timed(before, args.repeat):>12.1f} {timed(after, args.repeat):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare request/response wire formats for large grids.
+
+Reports payload size (raw and gzip) and server CPU time to parse, validate and expand an
+/autofill request whose outputData is sent dense, sparse or columnar, plus response encoding
+with the stdlib encoder versus processors.wire.dumps (orjson when installed).
+
+    python scripts/bench_wire.py --rows 2000 --cols 10 --empty 0.9
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import AutofillRequest  # noqa: E402
+from processors.wire import encode_sparse, encode_columns, decode_request, dumps, orjson  # noqa: E402
+
+
+def make_grid(rows, cols, empty, seed=0):
+    rng = random.Random(seed)
+    grid = []
+    for r in range(rows):
+        row = []
+        for c in range(cols):
+            if rng.random() < empty:
+                row.append("")
+            elif c % 3 == 0:
+                row.append(f"item-{rng.randrange(500)}")
+            elif c % 3 == 1:
+                row.append(str(rng.randrange(10000)))
+            else:
+                row.append(f"=B{r + 1}*{c}")
+        grid.append(row)
+    return grid
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--empty", type=float, default=0.9, help="fraction of empty cells in outputData")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    input_grid = make_grid(args.rows, args.cols, 0.05, seed=1)
+    output_grid = make_grid(args.rows, args.cols, args.empty, seed=2)
+    encoders = {"dense": lambda g: g, "sparse": encode_sparse, "columns": encode_columns}
+
+    print(f"{args.rows}x{args.cols} grids, outputData {args.empty:.0%} empty")
+    print(f"{'format':<8} {'bytes':>10} {'gzip':>10} {'parse+validate+decode ms':>26}")
+    for name, encode in encoders.items():
+        body = json.dumps({
+            "inputRange": f"Sheet1!A1:J{args.rows}",
+            "inputData": input_grid,
+            "outputRange": f"Sheet1!K1:T{args.rows}",
+            "outputData": encode(output_grid),
+            "description": "bench",
+        }).encode("utf-8")
+
+        def handle():
+            decode_request(AutofillRequest(**json.loads(body)).model_dump())
+
+        print(f"{name:<8} {len(body):>10} {len(gzip.compress(body)):>10} {timed(handle, args.repeat):>26.1f}")
+
+    reply = {"message": "Autofill processed", "result": {"status": "ok", "range": "Sheet1!K1:T2000", "candidate": output_grid}}
+    stdlib = timed(lambda: json.dumps(reply).encode("utf-8"), args.repeat)
+    fast = timed(lambda: dumps(reply), args.repeat)
+    print(f"response encode: stdlib json {stdlib:.1f} ms, wire.dumps ({'orjson' if orjson else 'compact json'}) {fast:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Check that cancelling a streaming job stops it without another LM call.
+
+Runs an autofill job against a slow stand-in LM, cancels it while the model is answering,
+and fails unless the job ends cancelled after exactly one LM call.
+
+    python scripts/check_job_cancel.py
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["PREDICTION_CACHE"] = "off"
+
+import dspy  # noqa: E402
+from dspy.utils.dummies import DummyLM  # noqa: E402
+from processors.jobs import JobManager, CANCELLED, FINISHED  # noqa: E402
+from processors.operations import handle_autofill  # noqa: E402
+
+
+class SlowLM(DummyLM):
+    """DummyLM that counts its calls and takes `delay` seconds to answer."""
+
+    def __init__(self, answers, delay=0.5):
+        super().__init__(answers)
+        self.delay = delay
+        self.calls = 0
+        self.answering = threading.Event()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        self.calls += 1
+        self.answering.set()
+        time.sleep(self.delay)
+        return super().forward(prompt=prompt, messages=messages, **kwargs)
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        return self.forward(prompt=prompt, messages=messages, **kwargs)
+
+
+def main():
+    answer = json.dumps([[f"=A{r}*2"] for r in range(1, 4)])
+    lm = SlowLM([{"reasoning": "double", "formulas": answer}] * 4)
+    dspy.settings.configure(lm=lm)
+    manager = JobManager(max_workers=1)
+    msg = {
+        "inputRange": "Sheet1!A1:A3", "inputData": [["1"], ["2"], ["3"]],
+        "outputRange": "Sheet1!B1:B3", "outputData": [[""], [""], [""]],
+        "description": "double",
+    }
+    job = manager.submit("autofill", handle_autofill, msg, "on_rows", total_rows=3)
+    if not lm.answering.wait(10):
+        sys.exit("FAIL: the job never called the LM")
+    manager.cancel(job.id)
+    deadline = time.time() + 10
+    while job.status not in FINISHED and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(lm.delay * 2)  # room for a fallback call to show up
+    manager.shutdown()
+    print(f"job status: {job.status}, LM calls: {lm.calls}")
+    if job.status != CANCELLED or lm.calls != 1:
+        sys.exit("FAIL: a cancelled streaming job must stop without another LM call")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
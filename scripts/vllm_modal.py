@@ -23,6 +23,7 @@ app = modal.App("natlas-vllm")
 N_GPU = 1
 MINUTES = 60
 VLLM_PORT = 8000
+MAX_CONCURRENT_INPUTS = 32  # keep BATCHPROC_PARALLELISM on the backend at or below this
 
 
 @app.function(
@@ -36,7 +37,7 @@ VLLM_PORT = 8000
     },
     secrets=[modal.Secret.from_name("my-huggingface-secret")],
 )
-@modal.concurrent(max_inputs=32)
+@modal.concurrent(max_inputs=MAX_CONCURRENT_INPUTS)
 @modal.web_server(port=VLLM_PORT, startup_timeout=10 * MINUTES)
 def serve():
     import subprocess